@@ -0,0 +1,472 @@
+"""
+Local message broker for multi-worker web deployments.
+
+When the web interface runs with several uvicorn workers, every worker is a
+separate process with its own ``message_queues``. Instead of each worker
+pulling the same subscription, a single broker process owns the Pub/Sub
+listeners and fans every message out to the workers over a local socket
+(a Unix domain socket, or a named pipe on Windows).
+
+Workers find the broker through the ``PUBSUB_BROKER_ADDRESS`` and
+``PUBSUB_BROKER_AUTHKEY`` environment variables, which are set by
+``app.server.run_server`` before the workers are spawned.
+"""
+
+import os
+import queue
+import sys
+import tempfile
+import threading
+import uuid
+from multiprocessing.connection import AuthenticationError, Client, Listener
+
+from app.columnar import DEFAULT_QUERY_BUFFER_SIZE, ColumnStore, QueryError
+from app.dedup import MessageDeduplicator
+from app.lifecycle import SubscriptionManager
+from app.render import BodyStore, PathError, expand_body
+from app.shapes import ShapeTracker
+from app.stats import SubscriptionStats
+
+BROKER_ADDRESS_ENV = "PUBSUB_BROKER_ADDRESS"
+BROKER_AUTHKEY_ENV = "PUBSUB_BROKER_AUTHKEY"
+
+# Same timeout the single-process /api/connect endpoint waits for
+CONNECT_TIMEOUT = 5
+# Messages a worker keeps per subscription routed to it; older ones are dropped
+DEFAULT_BROKER_QUEUE_SIZE = int(os.environ.get("BROKER_QUEUE_SIZE", "1000"))
+
+
+def broker_family():
+    """Return the multiprocessing connection family for this platform."""
+    return "AF_PIPE" if sys.platform == "win32" else "AF_UNIX"
+
+
+def new_broker_address():
+    """Generate a fresh address for the broker socket."""
+    if sys.platform == "win32":
+        return rf"\\.\pipe\pubsub-broker-{uuid.uuid4().hex}"
+    return os.path.join(tempfile.mkdtemp(prefix="pubsub-broker-"), "broker.sock")
+
+
+class BrokerServer:
+    """Owns the Pub/Sub listeners and fans their output out to the workers."""
+
+    def __init__(self, address, authkey):
+        self.address = address
+        self.authkey = authkey
+        # client_id -> {"messages": Queue, "status": Queue, "dedup": MessageDeduplicator,
+        #               "stats": SubscriptionStats, "columns": ColumnStore or None,
+        #               "bodies": BodyStore, "shapes": ShapeTracker,
+        #               "workers": set of worker ids}
+        self.subscriptions = {}
+        # worker_id -> (event connection, send lock)
+        self.workers = {}
+        self.listeners = SubscriptionManager()
+        self.lock = threading.Lock()
+
+    def serve_forever(self):
+        """Accept worker connections until the process is terminated."""
+        listener = Listener(self.address, family=broker_family(), authkey=self.authkey)
+        print(f"Message broker listening on {self.address}")
+        while True:
+            try:
+                conn = listener.accept()
+            except (OSError, EOFError, AuthenticationError) as e:
+                print(f"Rejected broker connection: {e}")
+                continue
+            threading.Thread(target=self._handle_connection, args=(conn,), daemon=True).start()
+
+    def _handle_connection(self, conn):
+        try:
+            role, worker_id = conn.recv()
+        except (EOFError, OSError):
+            conn.close()
+            return
+
+        if role == "events":
+            # Event connections are only written to by the broker
+            with self.lock:
+                self.workers[worker_id] = (conn, threading.Lock())
+            conn.send(("ready",))
+            print(f"Worker {worker_id} attached to broker")
+            return
+
+        try:
+            while True:
+                request = conn.recv()
+                conn.send(self._handle_request(worker_id, request))
+        except (EOFError, OSError):
+            self._drop_worker(worker_id)
+        finally:
+            conn.close()
+
+    def _handle_request(self, worker_id, request):
+        command, *args = request
+        if command == "subscribe":
+            return self._subscribe(worker_id, *args)
+        if command == "attach":
+            return self._attach(worker_id, *args)
+        if command == "detach":
+            return self._detach(worker_id, *args)
+        if command == "unsubscribe":
+            return self._unsubscribe(*args)
+        if command == "status":
+            return self._status()
+        if command == "stats":
+            return self._field_stats(*args)
+        if command == "query":
+            return self._query(*args)
+        if command == "query_fields":
+            return self._query_fields(*args)
+        if command == "resources":
+            return self._resources()
+        if command == "expand":
+            return self._expand(*args)
+        if command == "shapes":
+            return self._shapes(*args)
+        return {"error": f"Unknown broker command: {command}", "code": 400}
+
+    def _subscribe(self, worker_id, project_id, subscription_id):
+        # Imported here so the broker module stays cheap to import from workers
+        from app.routes.api import create_subscription_listener
+
+        client_id = f"{project_id}:{subscription_id}"
+        with self.lock:
+            entry = self.subscriptions.get(client_id)
+            if entry is not None:
+                entry["workers"].add(worker_id)
+                return {"status": "already_connected", "client_id": client_id}
+            entry = {
+                "messages": queue.Queue(),
+                "status": queue.Queue(),
+                "dedup": MessageDeduplicator(),
+                "stats": SubscriptionStats(),
+                "columns": ColumnStore() if DEFAULT_QUERY_BUFFER_SIZE > 0 else None,
+                "bodies": BodyStore(),
+                "shapes": ShapeTracker(),
+                "workers": {worker_id}
+            }
+            self.subscriptions[client_id] = entry
+
+        print(f"Broker starting Pub/Sub listener thread for {client_id}")
+        self.listeners.start(
+            client_id, create_subscription_listener,
+            project_id, subscription_id, entry["messages"], entry["status"],
+            entry["dedup"], entry["stats"], entry["columns"], entry["bodies"],
+            entry["shapes"]
+        )
+
+        try:
+            status = entry["status"].get(timeout=CONNECT_TIMEOUT)
+        except queue.Empty:
+            self._remove_subscription(client_id, entry)
+            return {"error": "Connection timeout", "code": 408}
+
+        if "error" in status:
+            self._remove_subscription(client_id, entry)
+            return {"error": status["error"], "code": 400}
+
+        threading.Thread(target=self._pump, args=(client_id, entry), daemon=True).start()
+        return {"status": "connected", "client_id": client_id}
+
+    def _attach(self, worker_id, client_id):
+        with self.lock:
+            entry = self.subscriptions.get(client_id)
+            if entry is None:
+                return False
+            entry["workers"].add(worker_id)
+            return True
+
+    def _detach(self, worker_id, client_id):
+        with self.lock:
+            entry = self.subscriptions.get(client_id)
+            if entry is None:
+                return False
+            entry["workers"].discard(worker_id)
+            return True
+
+    def _unsubscribe(self, client_id):
+        with self.lock:
+            entry = self.subscriptions.pop(client_id, None)
+        if entry is None:
+            return {"error": "Client ID not found", "code": 404}
+        self._publish(entry, ("closed", client_id))
+        self.listeners.stop(client_id)
+        return {"status": "disconnected", "client_id": client_id}
+
+    def _status(self):
+        with self.lock:
+            return {
+                client_id: {
+                    "workers": len(entry["workers"]),
+                    "pending_messages": entry["messages"].qsize(),
+                    "duplicates": entry["dedup"].stats()["duplicates"]
+                }
+                for client_id, entry in self.subscriptions.items()
+            }
+
+    def _field_stats(self, client_id, top_k):
+        entry = self.subscriptions.get(client_id)
+        return entry["stats"].snapshot(top_k) if entry is not None else None
+
+    def _query(self, client_id, where, group_by, limit, ids):
+        entry = self.subscriptions.get(client_id)
+        if entry is None:
+            return {"error": "Client ID not found", "code": 404}
+        if entry["columns"] is None:
+            return {"error": "Query buffer is disabled (QUERY_BUFFER_SIZE=0)", "code": 400}
+        try:
+            return entry["columns"].query(where, group_by, limit, ids)
+        except QueryError as e:
+            return {"error": str(e), "code": 400}
+
+    def _query_fields(self, client_id):
+        entry = self.subscriptions.get(client_id)
+        if entry is None:
+            return {"error": "Client ID not found", "code": 404}
+        if entry["columns"] is None:
+            return {"error": "Query buffer is disabled (QUERY_BUFFER_SIZE=0)", "code": 400}
+        return entry["columns"].describe()
+
+    def _expand(self, client_id, message_id, path, limits):
+        entry = self.subscriptions.get(client_id)
+        if entry is None:
+            return {"error": "Client ID not found", "code": 404}
+        try:
+            return expand_body(entry["bodies"], message_id, path, limits)
+        except KeyError:
+            return {"error": "Message body is no longer available", "code": 404}
+        except PathError as e:
+            return {"error": str(e), "code": 400}
+
+    def _shapes(self, client_id):
+        entry = self.subscriptions.get(client_id)
+        if entry is None:
+            return None
+        return {"messages": entry["shapes"].messages, "shapes": entry["shapes"].counts()}
+
+    def _resources(self):
+        with self.lock:
+            entries = dict(self.subscriptions)
+        return self.listeners.report(entries)
+
+    def _remove_subscription(self, client_id, entry):
+        with self.lock:
+            if self.subscriptions.get(client_id) is entry:
+                del self.subscriptions[client_id]
+        self.listeners.stop(client_id)
+
+    def _pump(self, client_id, entry):
+        """Forward one subscription's messages and status updates to its workers."""
+        while self.subscriptions.get(client_id) is entry:
+            try:
+                message = entry["messages"].get(timeout=0.1)
+                self._publish(entry, ("message", client_id, message))
+            except queue.Empty:
+                pass
+            while not entry["status"].empty():
+                self._publish(entry, ("status", client_id, entry["status"].get_nowait()))
+
+    def _publish(self, entry, event):
+        for worker_id in list(entry["workers"]):
+            worker = self.workers.get(worker_id)
+            if worker is None:
+                continue
+            conn, send_lock = worker
+            try:
+                with send_lock:
+                    conn.send(event)
+            except (OSError, ValueError):
+                self._drop_worker(worker_id)
+
+    def _drop_worker(self, worker_id):
+        with self.lock:
+            worker = self.workers.pop(worker_id, None)
+            for entry in self.subscriptions.values():
+                entry["workers"].discard(worker_id)
+        if worker is not None:
+            print(f"Worker {worker_id} detached from broker")
+            try:
+                worker[0].close()
+            except OSError:
+                pass
+
+
+def run_broker(address, authkey):
+    """Process entry point for the broker."""
+    BrokerServer(address, authkey).serve_forever()
+
+
+class BrokerClient:
+    """Worker-side connection to the shared broker.
+
+    Messages for every subscription this worker has subscribed to or attached to
+    are put on the same ``{"messages": Queue, "status": Queue}`` dicts the
+    single-process mode keeps in ``message_queues``, so the endpoints read them
+    the same way in both modes. Only the latest ``queue_size`` messages are kept
+    in each, in case nothing in this worker is reading them.
+    """
+
+    def __init__(self, address, authkey, on_closed=None, queue_size=DEFAULT_BROKER_QUEUE_SIZE):
+        self.address = address
+        self.authkey = authkey
+        self.on_closed = on_closed
+        self.queue_size = max(queue_size, 1)
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.routes = {}
+        # Routes that were open when the broker connection was lost
+        self._lost_routes = {}
+        self._control = None
+        self._control_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, on_closed=None):
+        """Create a client if this process was started behind a broker."""
+        address = os.environ.get(BROKER_ADDRESS_ENV)
+        if not address:
+            return None
+        authkey = bytes.fromhex(os.environ.get(BROKER_AUTHKEY_ENV, ""))
+        return cls(address, authkey, on_closed=on_closed)
+
+    def _connect(self):
+        if self._control is not None:
+            return
+        events = Client(self.address, family=broker_family(), authkey=self.authkey)
+        events.send(("events", self.worker_id))
+        # Wait until the broker has registered us so no early event is lost
+        events.recv()
+        threading.Thread(target=self._read_events, args=(events,), daemon=True).start()
+
+        control = Client(self.address, family=broker_family(), authkey=self.authkey)
+        control.send(("control", self.worker_id))
+        self._control = control
+        self._reattach()
+
+    def _reattach(self):
+        """Re-attach the routes that were open before the connection was lost.
+
+        The broker forgets a worker when its connection drops, so without this
+        a reconnected worker would silently stop receiving those subscriptions.
+        Subscriptions the broker no longer has (it was restarted) are reported
+        as errors and closed.
+        """
+        lost, self._lost_routes = self._lost_routes, {}
+        for client_id, queues in lost.items():
+            if self.routes.get(client_id) is not queues:
+                continue
+            self._control.send(("attach", client_id))
+            if self._control.recv():
+                print(f"Re-attached {client_id} to message broker")
+                queues["status"].put({"status": "connected"})
+                continue
+            print(f"Subscription {client_id} no longer exists in message broker")
+            self.routes.pop(client_id, None)
+            queues["status"].put({"error": "Subscription was lost by the message broker"})
+            if self.on_closed:
+                self.on_closed(client_id)
+
+    def _request(self, *request):
+        with self._control_lock:
+            self._connect()
+            try:
+                self._control.send(request)
+                return self._control.recv()
+            except (EOFError, OSError):
+                self._control = None
+                raise
+
+    def _read_events(self, conn):
+        try:
+            while True:
+                kind, client_id, *payload = conn.recv()
+                if kind == "closed":
+                    self.routes.pop(client_id, None)
+                    if self.on_closed:
+                        self.on_closed(client_id)
+                    continue
+                route = self.routes.get(client_id)
+                if route is None:
+                    continue
+                if kind == "message":
+                    messages = route["messages"]
+                    while messages.qsize() >= self.queue_size:
+                        try:
+                            messages.get_nowait()
+                        except queue.Empty:
+                            break
+                    messages.put(payload[0])
+                else:
+                    route["status"].put(payload[0])
+        except (EOFError, OSError):
+            print(f"Lost connection to message broker at {self.address}")
+            with self._control_lock:
+                if self._control is not None:
+                    self._control.close()
+                self._control = None
+                # A copy, as request threads add and remove routes meanwhile
+                routes = dict(self.routes)
+                # Re-attached when the connection is made again
+                self._lost_routes.update(routes)
+            for route in routes.values():
+                route["status"].put({"error": "Lost connection to message broker"})
+            # Reconnect right away; later requests retry if the broker is still down
+            try:
+                with self._control_lock:
+                    self._connect()
+            except (EOFError, OSError) as e:
+                print(f"Could not reconnect to message broker: {str(e)}")
+
+    def subscribe(self, project_id, subscription_id, queues):
+        """Ask the broker to listen to a subscription and route it to ``queues``."""
+        client_id = f"{project_id}:{subscription_id}"
+        self.routes[client_id] = queues
+        reply = self._request("subscribe", project_id, subscription_id)
+        if "error" in reply:
+            self.routes.pop(client_id, None)
+        return reply
+
+    def attach(self, client_id, queues):
+        """Route an existing broker subscription to ``queues``; False if unknown."""
+        self.routes[client_id] = queues
+        if self._request("attach", client_id):
+            return True
+        self.routes.pop(client_id, None)
+        return False
+
+    def detach(self, client_id):
+        """Stop routing a subscription to this worker; it keeps running for the others."""
+        self.routes.pop(client_id, None)
+        return self._request("detach", client_id)
+
+    def unsubscribe(self, client_id):
+        """Stop the subscription for every worker."""
+        self.routes.pop(client_id, None)
+        return self._request("unsubscribe", client_id)
+
+    def status(self):
+        """Return per-subscription broker statistics."""
+        return self._request("status")
+
+    def field_stats(self, client_id, top_k=10):
+        """Return the per-field statistics snapshot, or None if unknown."""
+        return self._request("stats", client_id, top_k)
+
+    def query(self, client_id, where, group_by, limit=100, ids=0):
+        """Run a query on the broker's column store for a subscription."""
+        return self._request("query", client_id, list(where), list(group_by), limit, ids)
+
+    def resources(self):
+        """Return the broker's threads, streams and memory per subscription."""
+        return self._request("resources")
+
+    def expand(self, client_id, message_id, path, limits):
+        """Summarise part of a truncated message kept by the broker."""
+        return self._request("expand", client_id, message_id, path, limits)
+
+    def shapes(self, client_id):
+        """Return the message counts per shape, or None if unknown."""
+        return self._request("shapes", client_id)
+
+    def query_fields(self, client_id):
+        """List the queryable fields of a subscription."""
+        return self._request("query_fields", client_id)
@@ -0,0 +1,261 @@
+"""
+Columnar buffer of recent messages for fast filter / group-by / count queries.
+
+Each scalar field path of a message (``customer.id``, ``attributes.region``)
+becomes a column in a ring buffer of the last ``capacity`` messages. Columns are
+compact typed arrays:
+
+- ``codes``: ``array('i')`` of dictionary codes; every distinct value is stored
+  once in the column's dictionary and -1 marks a missing value or null
+- ``numbers``: ``array('d')`` with the numeric value or NaN
+
+Queries are evaluated column-at-a-time: predicates are resolved against the
+dictionary once, then turned into a byte mask over the rows; masks are combined
+as big integers, and counting and grouping run through ``bytearray.count``,
+``itertools.compress`` and ``collections.Counter``, so no per-row Python code
+runs for the aggregation itself.
+
+Array paths (``items[].sku``) hold several values per message and are not
+stored as columns.
+"""
+
+import json
+import operator
+import os
+import re
+import sys
+import threading
+import time
+from array import array
+from collections import Counter
+from itertools import compress, repeat
+
+from app.stats import iter_field_values
+
+# Opt-in: the buffer costs memory per subscription even when nobody queries it
+DEFAULT_QUERY_BUFFER_SIZE = int(os.environ.get("QUERY_BUFFER_SIZE", "0"))
+DEFAULT_QUERY_MAX_COLUMNS = int(os.environ.get("QUERY_MAX_COLUMNS", "64"))
+
+MISSING = -1
+NAN = float("nan")
+
+# Longest operators first so ">=" is not parsed as ">"
+_CONDITION_RE = re.compile(r"^\s*(?P<path>[^!=<>]+?)\s*(?P<op>!=|>=|<=|=|>|<)\s*(?P<value>.*?)\s*$")
+
+_NUMERIC_OPS = {
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+}
+
+
+class QueryError(ValueError):
+    """Raised for malformed queries or unknown columns."""
+
+
+def parse_condition(condition):
+    """Parse ``path<op>value`` into ``(path, op, value, text)``.
+
+    The value is read as JSON when possible (numbers, booleans, null, quoted
+    strings) and as a plain string otherwise; ``text`` is the value as typed.
+    """
+    match = _CONDITION_RE.match(condition)
+    if not match:
+        raise QueryError(f"Invalid condition: {condition!r}. Use path=value, path>value, ...")
+    raw_value = match.group("value")
+    try:
+        value = json.loads(raw_value)
+    except json.JSONDecodeError:
+        value = raw_value
+    return match.group("path"), match.group("op"), value, raw_value
+
+
+class Column:
+    """Dictionary-encoded values and numeric view of one field path."""
+
+    def __init__(self, rows):
+        self.codes = array("i", [MISSING]) * rows
+        self.numbers = array("d", [NAN]) * rows
+        self.values = []
+        self.lookup = {}
+
+    def encode(self, value):
+        if value is None:
+            return MISSING
+        # Keep 1, 1.0 and True apart in the dictionary
+        key = (type(value).__name__, value)
+        code = self.lookup.get(key)
+        if code is None:
+            code = self.lookup[key] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def set(self, row, value):
+        self.codes[row] = self.encode(value)
+        is_number = isinstance(value, (int, float)) and not isinstance(value, bool)
+        self.numbers[row] = value if is_number else NAN
+
+    def append(self, value):
+        self.codes.append(self.encode(value))
+        is_number = isinstance(value, (int, float)) and not isinstance(value, bool)
+        self.numbers.append(value if is_number else NAN)
+
+    def compact(self):
+        """Drop dictionary entries no longer referenced by any row."""
+        used = sorted(set(self.codes) - {MISSING})
+        remap = {old: new for new, old in enumerate(used)}
+        self.values = [self.values[old] for old in used]
+        self.lookup = {(type(value).__name__, value): code for code, value in enumerate(self.values)}
+        self.codes = array("i", (remap.get(code, MISSING) for code in self.codes))
+
+
+class ColumnStore:
+    """Thread-safe ring buffer of the last ``capacity`` messages, stored by column."""
+
+    def __init__(self, capacity=DEFAULT_QUERY_BUFFER_SIZE, max_columns=DEFAULT_QUERY_MAX_COLUMNS):
+        self.capacity = max(capacity, 1)
+        self.max_columns = max_columns
+        self.columns = {}
+        self.rows = 0
+        self.total = 0
+        self.dropped_columns = set()
+        self._lock = threading.Lock()
+
+    def append(self, message_id, data, attributes=None):
+        """Add one message as a row, overwriting the oldest row once full."""
+        fields = {"message_id": message_id}
+        for path, value in iter_field_values(data):
+            if "[]" not in path and isinstance(value, (str, int, float, bool, type(None))):
+                fields[path] = value
+        for key, value in (attributes or {}).items():
+            fields[f"attributes.{key}"] = value
+
+        with self._lock:
+            for path in fields:
+                if path not in self.columns:
+                    if len(self.columns) >= self.max_columns:
+                        if len(self.dropped_columns) < 1000:
+                            self.dropped_columns.add(path)
+                        continue
+                    self.columns[path] = Column(self.rows)
+
+            if self.rows < self.capacity:
+                for path, column in self.columns.items():
+                    column.append(fields.get(path))
+                self.rows += 1
+            else:
+                row = self.total % self.capacity
+                for path, column in self.columns.items():
+                    column.set(row, fields.get(path))
+                    # Each row adds at most one dictionary entry, so this stays amortised O(1)
+                    if len(column.values) > 2 * self.capacity:
+                        column.compact()
+            self.total += 1
+
+    def _column(self, path):
+        column = self.columns.get(path)
+        if column is None:
+            raise QueryError(f"Unknown field: {path!r}")
+        return column
+
+    def _mask(self, path, op, value, text=None):
+        """Return a bytearray with 1 for every row matching the condition.
+
+        For ``=`` and ``!=``, a value typed without quotes also matches strings
+        with the same text, so ``zip=02139`` and ``id=123`` work on string columns.
+        """
+        column = self._column(path)
+
+        if op in _NUMERIC_OPS:
+            if not isinstance(value, (int, float)) or isinstance(value, bool):
+                raise QueryError(f"Operator {op} needs a numeric value, got {value!r}")
+            compare = _NUMERIC_OPS[op]
+            return bytearray(map(compare, column.numbers, repeat(value)))
+
+        if value is None:
+            matching = {MISSING}
+        else:
+            matching = {
+                code for code, candidate in enumerate(column.values)
+                if (candidate == value and isinstance(candidate, bool) == isinstance(value, bool))
+                or (text is not None and isinstance(candidate, str) and candidate == text)
+            }
+        mask = bytearray(map(matching.__contains__, column.codes))
+        if op == "!=":
+            mask = mask.translate(bytes([1, 0]) + bytes(254))
+        return mask
+
+    def query(self, where=None, group_by=None, limit=100, ids=0):
+        """Count rows matching all ``where`` conditions, optionally grouped.
+
+        ``where`` is a list of ``path<op>value`` strings, ``group_by`` a list of
+        paths. Up to ``ids`` matching message IDs are returned as samples.
+        """
+        start = time.perf_counter()
+        conditions = [parse_condition(condition) for condition in where or []]
+
+        with self._lock:
+            mask = None
+            for path, op, value, text in conditions:
+                condition_mask = self._mask(path, op, value, text)
+                if mask is None:
+                    mask = condition_mask
+                else:
+                    # AND the byte masks as big integers instead of row by row
+                    combined = int.from_bytes(mask, "little") & int.from_bytes(condition_mask, "little")
+                    mask = bytearray(combined.to_bytes(self.rows, "little"))
+
+            count = self.rows if mask is None else mask.count(1)
+            result = {"count": count, "rows": self.rows, "total_received": self.total}
+
+            if group_by:
+                group_columns = [self._column(path) for path in group_by]
+                code_arrays = [column.codes for column in group_columns]
+                if mask is not None:
+                    code_arrays = [compress(codes, mask) for codes in code_arrays]
+                counts = Counter(code_arrays[0]) if len(code_arrays) == 1 else Counter(zip(*code_arrays))
+
+                groups = []
+                for key, group_count in counts.most_common(limit):
+                    codes = (key,) if len(code_arrays) == 1 else key
+                    values = [
+                        None if code == MISSING else column.values[code]
+                        for column, code in zip(group_columns, codes)
+                    ]
+                    groups.append({"key": dict(zip(group_by, values)), "count": group_count})
+                result["groups"] = groups
+                result["group_count"] = len(counts)
+
+            id_column = self.columns.get("message_id")
+            if ids and id_column is not None:
+                codes = id_column.codes if mask is None else compress(id_column.codes, mask)
+                result["message_ids"] = []
+                for code in codes:
+                    if len(result["message_ids"]) >= ids:
+                        break
+                    result["message_ids"].append(id_column.values[code])
+
+        result["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 3)
+        return result
+
+    def memory_bytes(self):
+        """Approximate memory held by the columns and their dictionaries."""
+        with self._lock:
+            total = 0
+            for column in self.columns.values():
+                total += column.codes.itemsize * len(column.codes) + column.numbers.itemsize * len(column.numbers)
+                total += sys.getsizeof(column.values) + sys.getsizeof(column.lookup)
+                total += sum(sys.getsizeof(value) for value in column.values)
+            return total
+
+    def describe(self):
+        """Return the buffered fields and buffer usage."""
+        with self._lock:
+            return {
+                "rows": self.rows,
+                "capacity": self.capacity,
+                "total_received": self.total,
+                "fields": sorted(self.columns),
+                "dropped_fields": sorted(self.dropped_columns)[:100]
+            }
@@ -0,0 +1,410 @@
+"""
+Decoding of compressed and schema-encoded message bodies.
+
+``decode_body`` turns the raw bytes of a message into something the renderers
+can show, in up to three steps:
+
+1. Decompression: gzip or zstd, chosen by a ``content-encoding`` (or
+   ``compression``) attribute or by the magic bytes at the start of the body.
+   zstd needs the optional ``zstandard`` package.
+2. Schema decoding: messages published to a topic with a Pub/Sub schema carry
+   ``googclient_schemaname`` and ``googclient_schemaencoding`` attributes.
+   BINARY Avro bodies are decoded with the optional ``fastavro`` package;
+   BINARY protobuf bodies with a message class registered for the schema (see
+   ``PROTO_MESSAGE_TYPES`` and ``register_decoder``), or field by field from the
+   wire format when there is none. Avro object container files (``Obj\\x01``)
+   carry their own schema and are decoded without a schema name.
+3. Text: UTF-8 bodies become strings; anything else is shown as a hex preview
+   instead of failing.
+
+Decoders are compiled once per schema revision and kept in an LRU; a schema
+that cannot be fetched is retried after ``DECODER_RETRY_SECONDS``. Bodies
+that are expensive to decompress are handled on a bounded pool of threads by
+``submit``, so the Pub/Sub callback threads are not held up by them.
+"""
+
+import base64
+import io
+import json
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+DEFAULT_DECODER_CACHE_SIZE = int(os.environ.get("DECODER_CACHE_SIZE", "64"))
+# Seconds before a schema that failed to compile is tried again
+DEFAULT_DECODER_RETRY_SECONDS = float(os.environ.get("DECODER_RETRY_SECONDS", "30"))
+DEFAULT_DECODE_WORKERS = int(os.environ.get("DECODE_WORKERS", "4"))
+# Larger decompressed bodies are refused (protects against compression bombs)
+DEFAULT_DECODE_MAX_BYTES = int(os.environ.get("DECODE_MAX_BYTES", "104857600"))
+
+# Compressed bodies at least this large are decoded on the worker pool
+OFFLOAD_MIN_BYTES = 64 * 1024
+# Bytes shown in the preview of a binary body
+BINARY_PREVIEW_BYTES = 64
+
+COMPRESSION_ATTRIBUTES = ("content-encoding", "content_encoding", "compression")
+SCHEMA_NAME_ATTRIBUTE = "googclient_schemaname"
+SCHEMA_ENCODING_ATTRIBUTE = "googclient_schemaencoding"
+SCHEMA_REVISION_ATTRIBUTE = "googclient_schemarevisionid"
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+AVRO_CONTAINER_MAGIC = b"Obj\x01"
+
+
+class DecodeError(Exception):
+    """Raised when a body cannot be decoded as its attributes or magic bytes claim."""
+
+
+class Decoded:
+    """The result of ``decode_body``.
+
+    ``value`` is a string, or an already parsed object for schema-decoded bodies.
+    ``steps`` lists what was applied (e.g. ``["gzip", "avro"]``) and ``error``
+    says why a step failed, in which case ``value`` is what was left before it.
+    """
+
+    def __init__(self, value, steps=None, error=None):
+        self.value = value
+        self.steps = steps or []
+        self.error = error
+
+    def text(self):
+        """The decoded body as text, e.g. to keep it for expanding later."""
+        if isinstance(self.value, str):
+            return self.value
+        return json.dumps(self.value, default=str)
+
+
+class _Compilation:
+    """A decoder being compiled; other threads asking for it wait for ``done``."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.entry = None
+
+
+class DecoderCache:
+    """Thread-safe LRU of compiled decoders, keyed by schema name and revision.
+
+    Compiling can fetch the schema over the network, so it runs outside the
+    lock and only once per key at a time: concurrent callers for the same key
+    wait for that compilation instead of starting their own. Failures are kept
+    for ``retry_seconds``, so a missing schema is not fetched per message but is
+    picked up once it exists.
+    """
+
+    def __init__(self, max_size=DEFAULT_DECODER_CACHE_SIZE, retry_seconds=DEFAULT_DECODER_RETRY_SECONDS):
+        self.max_size = max(max_size, 1)
+        self.retry_seconds = retry_seconds
+        self.compiled = 0
+        # key -> (decoder, error, retry_at)
+        self._decoders = OrderedDict()
+        self._compiling = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, compile_decoder):
+        """Return the decoder for ``key``, compiling it with ``compile_decoder(key)`` once."""
+        with self._lock:
+            entry = self._decoders.get(key)
+            if entry is not None and (entry[0] is not None or time.monotonic() < entry[2]):
+                self._decoders.move_to_end(key)
+                compilation = None
+            else:
+                compilation = self._compiling.get(key)
+                owner = compilation is None
+                if owner:
+                    compilation = self._compiling[key] = _Compilation()
+
+        if compilation is not None:
+            if owner:
+                entry = self._compile(key, compile_decoder, compilation)
+            else:
+                compilation.done.wait()
+                entry = compilation.entry
+
+        decoder, error, _ = entry
+        if decoder is None:
+            raise DecodeError(error)
+        return decoder
+
+    def _compile(self, key, compile_decoder, compilation):
+        # Stands in if compiling is interrupted, so waiting threads are released
+        entry = (None, "Decoder compilation was interrupted", 0)
+        try:
+            entry = (compile_decoder(key), None, None)
+        except Exception as e:
+            entry = (None, str(e), time.monotonic() + self.retry_seconds)
+        finally:
+            with self._lock:
+                del self._compiling[key]
+                self.compiled += 1
+                self._decoders[key] = entry
+                self._decoders.move_to_end(key)
+                if len(self._decoders) > self.max_size:
+                    self._decoders.popitem(last=False)
+            compilation.entry = entry
+            compilation.done.set()
+        return entry
+
+    def stats(self):
+        with self._lock:
+            return {"cached": len(self._decoders), "compiled": self.compiled, "max_size": self.max_size}
+
+
+decoder_cache = DecoderCache()
+
+# Schema name -> decode(bytes) function, registered by the application
+_registered = {}
+_schema_client = None
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def register_decoder(schema_name, decode):
+    """Use ``decode(data)`` for BINARY bodies of ``schema_name`` instead of the built-in one."""
+    _registered[schema_name] = decode
+
+
+def _load_proto_types():
+    """Register the protobuf classes named in PROTO_MESSAGE_TYPES.
+
+    Format: ``projects/p/schemas/orders=mypackage.orders_pb2:Order``, comma separated.
+    """
+    for entry in filter(None, os.environ.get("PROTO_MESSAGE_TYPES", "").split(",")):
+        schema_name, _, target = entry.strip().partition("=")
+        module_name, _, class_name = target.partition(":")
+        if schema_name and module_name and class_name:
+            _registered.setdefault(schema_name, _ProtoClassDecoder(module_name, class_name))
+
+
+class _ProtoClassDecoder:
+    """Decodes with a generated protobuf class, imported on first use."""
+
+    def __init__(self, module_name, class_name):
+        self.module_name = module_name
+        self.class_name = class_name
+        self.message_class = None
+
+    def __call__(self, data):
+        from google.protobuf.json_format import MessageToDict
+
+        if self.message_class is None:
+            import importlib
+
+            self.message_class = getattr(importlib.import_module(self.module_name), self.class_name)
+        return MessageToDict(self.message_class.FromString(data))
+
+
+_load_proto_types()
+
+
+def _compression(data, attributes):
+    for name in COMPRESSION_ATTRIBUTES:
+        value = (attributes.get(name) or "").lower()
+        if value in ("gzip", "x-gzip"):
+            return "gzip"
+        if value in ("zstd", "zstandard"):
+            return "zstd"
+    if data.startswith(GZIP_MAGIC):
+        return "gzip"
+    if data.startswith(ZSTD_MAGIC):
+        return "zstd"
+    return None
+
+
+def _decompress(data, method, max_bytes):
+    if method == "gzip":
+        decompressor = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+        try:
+            result = decompressor.decompress(data, max_bytes)
+        except zlib.error as e:
+            raise DecodeError(f"Invalid gzip data: {e}")
+        if decompressor.unconsumed_tail:
+            raise DecodeError(f"Decompressed body is larger than {max_bytes} bytes")
+        if not decompressor.eof:
+            raise DecodeError("Truncated gzip data")
+        return result
+
+    try:
+        import zstandard
+    except ImportError:
+        raise DecodeError("zstd body, but the zstandard package is not installed")
+    try:
+        with zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data)) as reader:
+            result = reader.read(max_bytes + 1)
+    except zstandard.ZstdError as e:
+        raise DecodeError(f"Invalid zstd data: {e}")
+    if len(result) > max_bytes:
+        raise DecodeError(f"Decompressed body is larger than {max_bytes} bytes")
+    return result
+
+
+def _get_schema(schema_name):
+    global _schema_client
+    from google.cloud import pubsub_v1
+
+    if _schema_client is None:
+        _schema_client = pubsub_v1.SchemaServiceClient()
+    return _schema_client.get_schema(request={"name": schema_name})
+
+
+def _compile(key):
+    """Build the decode function for ``(schema_name, revision_id)``."""
+    schema_name, revision_id = key
+    if schema_name in _registered:
+        return _registered[schema_name]
+
+    from google.pubsub_v1.types import Schema
+
+    schema = _get_schema(f"{schema_name}@{revision_id}" if revision_id else schema_name)
+    if schema.type_ == Schema.Type.AVRO:
+        try:
+            import fastavro
+        except ImportError:
+            raise DecodeError("Avro body, but the fastavro package is not installed")
+        parsed = fastavro.parse_schema(json.loads(schema.definition))
+        return lambda data: fastavro.schemaless_reader(io.BytesIO(data), parsed)
+    if schema.type_ == Schema.Type.PROTOCOL_BUFFER:
+        # Generated classes cannot be built from the .proto text at runtime
+        return decode_protobuf_wire
+    raise DecodeError(f"Unsupported schema type for {schema_name}")
+
+
+def _decode_avro_container(data):
+    try:
+        import fastavro
+    except ImportError:
+        raise DecodeError("Avro container, but the fastavro package is not installed")
+    records = list(fastavro.reader(io.BytesIO(data)))
+    return records[0] if len(records) == 1 else records
+
+
+def decode_protobuf_wire(data):
+    """Decode protobuf without its schema, like ``protoc --decode_raw``.
+
+    Fields are keyed by number; repeated fields become lists; length-delimited
+    fields are shown as a string if they are printable text, otherwise as a
+    nested message, or else as base64 bytes.
+    """
+    fields = {}
+    pos = 0
+    while pos < len(data):
+        key, pos = _read_varint(data, pos)
+        number, wire_type = key >> 3, key & 7
+        if number == 0:
+            raise DecodeError("Invalid protobuf field number 0")
+        if wire_type == 0:
+            value, pos = _read_varint(data, pos)
+        elif wire_type == 1:
+            value, pos = int.from_bytes(data[pos:pos + 8], "little"), pos + 8
+        elif wire_type == 5:
+            value, pos = int.from_bytes(data[pos:pos + 4], "little"), pos + 4
+        elif wire_type == 2:
+            length, pos = _read_varint(data, pos)
+            value, pos = _length_delimited(data[pos:pos + length]), pos + length
+        else:
+            raise DecodeError(f"Unsupported protobuf wire type {wire_type}")
+        if pos > len(data):
+            raise DecodeError("Truncated protobuf message")
+        name = str(number)
+        if name in fields:
+            if not isinstance(fields[name], list):
+                fields[name] = [fields[name]]
+            fields[name].append(value)
+        else:
+            fields[name] = value
+    return fields
+
+
+def _read_varint(data, pos):
+    result = 0
+    shift = 0
+    while pos < len(data):
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+    raise DecodeError("Truncated protobuf varint")
+
+
+def _length_delimited(chunk):
+    try:
+        text = chunk.decode("utf-8")
+        if text.isprintable() or text.strip().isprintable():
+            return text
+    except UnicodeDecodeError:
+        pass
+    try:
+        return decode_protobuf_wire(chunk)
+    except DecodeError:
+        return base64.b64encode(chunk).decode("ascii")
+
+
+def binary_preview(data):
+    """Short description of a body that is not text."""
+    shown = data[:BINARY_PREVIEW_BYTES].hex(" ")
+    more = " …" if len(data) > BINARY_PREVIEW_BYTES else ""
+    return f"<binary, {len(data)} bytes> {shown}{more}"
+
+
+def decode_body(data, attributes=None, max_bytes=DEFAULT_DECODE_MAX_BYTES):
+    """Decompress and decode a message body; never raises for bad input."""
+    attributes = attributes or {}
+    steps = []
+
+    method = _compression(data, attributes)
+    if method is not None:
+        try:
+            data = _decompress(data, method, max_bytes)
+            steps.append(method)
+        except DecodeError as e:
+            return Decoded(binary_preview(data), steps, str(e))
+
+    schema_name = attributes.get(SCHEMA_NAME_ATTRIBUTE)
+    encoding = (attributes.get(SCHEMA_ENCODING_ATTRIBUTE) or "").upper()
+    try:
+        if schema_name and encoding != "JSON":
+            decoder = decoder_cache.get((schema_name, attributes.get(SCHEMA_REVISION_ATTRIBUTE)), _compile)
+            value = decoder(data)
+            return Decoded(value, steps + [schema_name.rsplit("/", 1)[-1]])
+        if data.startswith(AVRO_CONTAINER_MAGIC):
+            return Decoded(_decode_avro_container(data), steps + ["avro"])
+    except Exception as e:
+        # Show the undecoded body rather than nothing
+        error = str(e) or type(e).__name__
+    else:
+        error = None
+
+    try:
+        return Decoded(data.decode("utf-8"), steps, error)
+    except UnicodeDecodeError:
+        return Decoded(binary_preview(data), steps + ["binary"], error)
+
+
+def _log_failure(future):
+    if future.exception() is not None:
+        print(f"Error processing message on decode pool: {future.exception()}")
+
+
+def submit(data, attributes, task):
+    """Run ``task()`` now, or on the decode pool if ``data`` is large and compressed.
+
+    ``task`` decodes, handles and acks the message. Pub/Sub flow control limits
+    the unacked messages per subscriber, which bounds the pool's backlog.
+    """
+    if len(data) < OFFLOAD_MIN_BYTES or _compression(data, attributes or {}) is None:
+        task()
+        return
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Imported here: concurrent.futures is slow to import and the CLI may never need it
+            from concurrent.futures import ThreadPoolExecutor
+
+            _pool = ThreadPoolExecutor(max_workers=max(DEFAULT_DECODE_WORKERS, 1), thread_name_prefix="decode")
+    _pool.submit(task).add_done_callback(_log_failure)
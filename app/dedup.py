@@ -0,0 +1,70 @@
+"""
+Bounded message-ID deduplication.
+
+Pub/Sub delivers at least once, so the same message can arrive again after a
+redelivery. ``MessageDeduplicator`` remembers the most recently seen message IDs
+in an LRU of fixed size, optionally forgetting IDs older than a time window, and
+counts how many duplicates it has dropped.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_DEDUP_CACHE_SIZE = int(os.environ.get("DEDUP_CACHE_SIZE", "10000"))
+# 0 disables the time window; IDs are then only evicted by size
+DEFAULT_DEDUP_WINDOW_SECONDS = float(os.environ.get("DEDUP_WINDOW_SECONDS", "0"))
+
+
+class MessageDeduplicator:
+    """Thread-safe LRU of recently seen message IDs."""
+
+    def __init__(self, max_size=DEFAULT_DEDUP_CACHE_SIZE, window_seconds=DEFAULT_DEDUP_WINDOW_SECONDS):
+        self.max_size = max_size
+        self.window_seconds = window_seconds
+        self.duplicates = 0
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+
+    def is_duplicate(self, message_id):
+        """Record ``message_id`` and return True if it was already seen."""
+        if self.max_size <= 0:
+            return False
+
+        now = time.monotonic()
+        with self._lock:
+            if self.window_seconds > 0:
+                # Entries are kept in last-seen order, so expired ones are at the front
+                cutoff = now - self.window_seconds
+                while self._seen and next(iter(self._seen.values())) < cutoff:
+                    self._seen.popitem(last=False)
+
+            if message_id in self._seen:
+                self._seen[message_id] = now
+                self._seen.move_to_end(message_id)
+                self.duplicates += 1
+                return True
+
+            self._seen[message_id] = now
+            if len(self._seen) > self.max_size:
+                self._seen.popitem(last=False)
+            return False
+
+    def memory_bytes(self):
+        """Approximate memory held by the index."""
+        with self._lock:
+            return sys.getsizeof(self._seen) + sum(
+                sys.getsizeof(message_id) + sys.getsizeof(seen_at) for message_id, seen_at in self._seen.items()
+            )
+
+    def stats(self):
+        """Return the duplicate count and current index size."""
+        with self._lock:
+            return {
+                "duplicates": self.duplicates,
+                "tracked_ids": len(self._seen),
+                "max_size": self.max_size,
+                "window_seconds": self.window_seconds
+            }
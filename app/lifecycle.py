@@ -0,0 +1,212 @@
+"""
+Ownership of the Pub/Sub listeners started by the web interface.
+
+Each subscription's listener is a thread running ``create_subscription_listener``
+with a streaming pull future, a ``SubscriberClient`` (gRPC channel) and a pool of
+callback threads. ``SubscriptionManager`` keeps a ``ManagedListener`` for each of
+them so that:
+
+- disconnecting cancels the streaming pull, waits for it to finish and closes
+  the client, instead of leaving it acking messages nobody reads
+- a listener is never started twice for the same subscription
+- the threads, streams and buffered memory of every subscription can be reported
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Callback threads per subscription (the Pub/Sub client's default)
+CALLBACK_THREADS = 10
+# Seconds to wait for a cancelled stream to shut down
+STOP_TIMEOUT = 5
+# Queued messages sampled to estimate their memory use
+MEMORY_SAMPLE_SIZE = 100
+
+
+class ManagedListener:
+    """The resources of one running subscription listener."""
+
+    def __init__(self, client_id):
+        self.client_id = client_id
+        self.thread_prefix = f"pubsub-{client_id}"
+        self.started_at = time.time()
+        self.thread = None
+        self.subscriber = None
+        self.future = None
+        self.stopping = threading.Event()
+
+    def make_scheduler(self):
+        """Callback scheduler whose threads are named after this subscription."""
+        from google.cloud.pubsub_v1.subscriber.scheduler import ThreadScheduler
+
+        executor = ThreadPoolExecutor(max_workers=CALLBACK_THREADS, thread_name_prefix=self.thread_prefix)
+        return ThreadScheduler(executor=executor)
+
+    def attach(self, subscriber, future):
+        """Called by the listener once it is streaming."""
+        self.subscriber = subscriber
+        self.future = future
+        # A stop requested while the stream was being opened
+        if self.stopping.is_set():
+            future.cancel()
+
+    def is_alive(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def stop(self, timeout=STOP_TIMEOUT):
+        """Cancel the stream and wait for the listener thread to close its client."""
+        self.stopping.set()
+        if self.future is not None:
+            self.future.cancel()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(timeout)
+        return not self.is_alive()
+
+    def report(self):
+        callback_threads = sum(
+            1 for thread in threading.enumerate() if thread.name.startswith(self.thread_prefix + "_")
+        )
+        return {
+            "listener_alive": self.is_alive(),
+            "stopping": self.stopping.is_set(),
+            "streams": 1 if self.future is not None and not self.future.done() else 0,
+            "callback_threads": callback_threads,
+            "uptime_seconds": round(time.time() - self.started_at, 1)
+        }
+
+
+class SubscriptionManager:
+    """Starts, reuses, stops and reports subscription listeners."""
+
+    def __init__(self):
+        self.listeners = {}
+        self.lock = threading.Lock()
+
+    def get(self, client_id):
+        """Return the running listener for ``client_id``, or None."""
+        with self.lock:
+            listener = self.listeners.get(client_id)
+        if listener is not None and listener.is_alive() and not listener.stopping.is_set():
+            return listener
+        return None
+
+    def start(self, client_id, target, *args):
+        """Run ``target(*args, lifecycle=listener)`` in a thread, unless already running.
+
+        Returns ``(listener, created)``; ``created`` is False when a live
+        listener for ``client_id`` was already running.
+        """
+        existing = self.get(client_id)
+        if existing is not None:
+            return existing, False
+        with self.lock:
+            listener = self.listeners.get(client_id)
+
+        if listener is not None:
+            # Let a listener that is shutting down release its stream first
+            listener.stop()
+
+        listener = ManagedListener(client_id)
+        listener.thread = threading.Thread(
+            target=target,
+            args=args,
+            kwargs={"lifecycle": listener},
+            name=f"{listener.thread_prefix}-listener",
+            daemon=True
+        )
+        with self.lock:
+            self.listeners[client_id] = listener
+        listener.thread.start()
+        return listener, True
+
+    def stop(self, client_id):
+        """Stop and forget a listener; True if it shut down in time."""
+        with self.lock:
+            listener = self.listeners.pop(client_id, None)
+        if listener is None:
+            return True
+        stopped = listener.stop()
+        if not stopped:
+            print(f"Listener for {client_id} did not stop within {STOP_TIMEOUT}s")
+        return stopped
+
+    def stop_all(self):
+        for client_id in list(self.listeners):
+            self.stop(client_id)
+
+    def report(self, queues_by_client=None):
+        """Return threads, streams and memory per subscription and for the process."""
+        queues_by_client = queues_by_client or {}
+        with self.lock:
+            listeners = dict(self.listeners)
+
+        subscriptions = {}
+        for client_id in listeners.keys() | queues_by_client.keys():
+            listener = listeners.get(client_id)
+            entry = listener.report() if listener is not None else {"listener_alive": False, "streams": 0, "callback_threads": 0}
+            if client_id in queues_by_client:
+                entry["memory"] = queue_memory(queues_by_client[client_id])
+            subscriptions[client_id] = entry
+
+        return {
+            "subscriptions": subscriptions,
+            "process": {
+                "pid": os.getpid(),
+                "threads": threading.active_count(),
+                "streams": sum(entry["streams"] for entry in subscriptions.values()),
+                "rss_bytes": process_rss_bytes()
+            }
+        }
+
+
+def queue_memory(queues):
+    """Estimate the memory held by one subscription's buffers, in bytes."""
+    result = {}
+
+    messages = queues.get("messages")
+    if messages is not None:
+        with messages.mutex:
+            pending = len(messages.queue)
+            sample = [messages.queue[i] for i in range(min(pending, MEMORY_SAMPLE_SIZE))]
+        average = sum(len(json.dumps(item)) for item in sample) / len(sample) if sample else 0
+        result["pending_messages"] = pending
+        result["pending_bytes"] = int(average * pending)
+
+    dedup = queues.get("dedup")
+    if dedup is not None:
+        result["dedup_bytes"] = dedup.memory_bytes()
+
+    columns = queues.get("columns")
+    if columns is not None:
+        result["query_buffer_bytes"] = columns.memory_bytes()
+
+    replay = queues.get("replay")
+    if replay is not None:
+        result["replay_bytes"] = replay.memory_bytes()
+
+    bodies = queues.get("bodies")
+    if bodies is not None:
+        result["stored_bodies_bytes"] = bodies.memory_bytes()
+
+    result["total_bytes"] = sum(value for key, value in result.items() if key.endswith("_bytes"))
+    return result
+
+
+def process_rss_bytes():
+    """Current resident set size of this process, or None if unknown."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # Peak rather than current, in KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
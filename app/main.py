@@ -1,5 +1,4 @@
 import os
-import uvicorn
 from fastapi import FastAPI, Request
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
@@ -28,9 +27,8 @@ app.include_router(views_router)
 app.include_router(api_router, prefix="/api")
 
 if __name__ == "__main__":
-    uvicorn.run(
-        "app.main:app", 
-        host="0.0.0.0", 
+    from app.server import run_server
+    run_server(
         port=int(os.getenv("PORT", "8000")),
-        reload=True
+        workers=int(os.getenv("WEB_WORKERS", "1"))
     ) 
\ No newline at end of file
@@ -0,0 +1,197 @@
+"""
+Bounded, adaptive outbound queues for WebSocket clients.
+
+Every socket gets a ``SocketWriter``: a bounded queue drained by its own writer
+task, so the endpoint loops never wait on a slow browser and messages are taken
+off ``message_queues`` at the rate they arrive. The time spent in each send is
+measured, and a client that falls behind is degraded step by step:
+
+- ``FULL``: every message is sent as is
+- ``PREVIEW``: message data is replaced by a short preview of its JSON
+- ``SAMPLE``: only one message in ``WS_SAMPLE_RATE`` is sent, as a preview
+- ``SKIP``: no messages are sent, only ``{"type": "skipped", "count": N}`` markers
+
+The level follows how long the queued frames will take to send and how long a
+single send takes, and goes back down once the client catches up. The queue
+never holds more than ``WS_SEND_QUEUE_SIZE`` frames; beyond that messages are
+skipped at any level. Status and control frames are never degraded.
+"""
+
+import asyncio
+import json
+import os
+import time
+from collections import Counter, deque
+
+from fastapi import WebSocketDisconnect
+
+DEFAULT_WS_SEND_QUEUE_SIZE = int(os.environ.get("WS_SEND_QUEUE_SIZE", "200"))
+# A client whose average send takes longer than this is treated as slow
+DEFAULT_WS_SLOW_SEND_MS = float(os.environ.get("WS_SLOW_SEND_MS", "50"))
+DEFAULT_WS_SAMPLE_RATE = int(os.environ.get("WS_SAMPLE_RATE", "10"))
+
+FULL, PREVIEW, SAMPLE, SKIP = range(4)
+LEVEL_NAMES = ["full", "preview", "sample", "skip"]
+
+PREVIEW_LENGTH = 200
+# Skipped markers are sent at most this often per socket
+SKIP_MARKER_INTERVAL = 1.0
+# Queued work (in seconds of sending) at which a client starts being degraded
+LAG_BUDGET = 0.25
+# Weight of the latest send in the moving average of send times
+SEND_TIME_SMOOTHING = 0.2
+
+
+def make_preview(message):
+    """Replace a message's data with the start of its JSON text."""
+    text = message["data"] if isinstance(message["data"], str) else json.dumps(message["data"])
+    if len(text) <= PREVIEW_LENGTH:
+        return message
+    preview = dict(message)
+    preview["data"] = text[:PREVIEW_LENGTH] + "…"
+    preview["preview"] = True
+    return preview
+
+
+class SocketWriter:
+    """Bounded outbound queue and writer task for one WebSocket."""
+
+    def __init__(self, websocket, max_size=DEFAULT_WS_SEND_QUEUE_SIZE,
+                 slow_send_ms=DEFAULT_WS_SLOW_SEND_MS, sample_rate=DEFAULT_WS_SAMPLE_RATE):
+        self.websocket = websocket
+        self.max_size = max(max_size, 4)
+        self.slow_send = slow_send_ms / 1000
+        self.sample_rate = max(sample_rate, 1)
+        self.level = FULL
+        self.closed = False
+        self.sent = 0
+        self.send_time_avg = 0.0
+        self.send_time_max = 0.0
+        self.skipped = Counter()  # client_id -> messages not sent since the last marker
+        self.skipped_total = 0
+        self.degraded_total = 0
+        self._frames = deque()
+        self._offered = 0
+        self._last_marker = 0.0
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        self.closed = True
+        if self._task is not None:
+            self._task.cancel()
+
+    def send(self, frame):
+        """Queue a status or control frame; these are never degraded."""
+        if self.closed:
+            raise WebSocketDisconnect(code=1006)
+        self._frames.append(frame)
+        self._wakeup.set()
+
+    def offer(self, client_id, frame):
+        """Queue a message frame, degrading or dropping it if the client is behind."""
+        if self.closed:
+            raise WebSocketDisconnect(code=1006)
+        self._update_level()
+        self._offered += 1
+
+        if self.level == SKIP or len(self._frames) >= self.max_size:
+            self._skip(client_id)
+            return False
+        if self.level == SAMPLE and self._offered % self.sample_rate:
+            self._skip(client_id)
+            return False
+        if self.level != FULL:
+            frame = dict(frame, data=make_preview(frame["data"]))
+            self.degraded_total += 1
+
+        self._frames.append(frame)
+        self._wakeup.set()
+        return True
+
+    def _skip(self, client_id):
+        self.skipped[client_id] += 1
+        self.skipped_total += 1
+        self._wakeup.set()
+
+    def lag(self):
+        """Estimated seconds until everything queued has been sent."""
+        return len(self._frames) * self.send_time_avg
+
+    def _update_level(self):
+        # Judge by time to drain rather than queue length, so a burst queued
+        # within one event loop tick does not degrade a fast client
+        lag = self.lag()
+        if lag >= 4 * LAG_BUDGET:
+            level = SKIP
+        elif lag >= 2 * LAG_BUDGET:
+            level = SAMPLE
+        elif lag >= LAG_BUDGET or self.send_time_avg > self.slow_send:
+            level = PREVIEW
+        else:
+            level = FULL
+
+        if level > self.level:
+            self.level = level
+        elif level < self.level and lag < LAG_BUDGET / 4:
+            # Recover one step at a time, once the queue has drained
+            self.level -= 1
+
+    async def _run(self):
+        try:
+            while True:
+                if not self._frames:
+                    self._wakeup.clear()
+                    if not self.skipped:
+                        await self._wakeup.wait()
+                    else:
+                        # Let the marker interval elapse unless new frames arrive
+                        try:
+                            await asyncio.wait_for(self._wakeup.wait(), SKIP_MARKER_INTERVAL)
+                        except asyncio.TimeoutError:
+                            pass
+
+                if self.skipped and time.monotonic() - self._last_marker >= SKIP_MARKER_INTERVAL:
+                    # Taken one by one: messages skipped while a marker is being
+                    # sent go into the next marker instead of being lost
+                    for client_id in list(self.skipped):
+                        count = self.skipped.pop(client_id)
+                        await self._send({"type": "skipped", "client_id": client_id, "count": count})
+                    self._last_marker = time.monotonic()
+
+                if self._frames:
+                    await self._send(self._frames.popleft())
+                    self._update_level()
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            # The endpoint notices on its next send or receive
+            print(f"WebSocket writer stopped: {str(e)}")
+        finally:
+            self.closed = True
+            self._frames.clear()
+
+    async def _send(self, frame):
+        start = time.perf_counter()
+        await self.websocket.send_json(frame)
+        elapsed = time.perf_counter() - start
+        self.sent += 1
+        self.send_time_max = max(self.send_time_max, elapsed)
+        self.send_time_avg += SEND_TIME_SMOOTHING * (elapsed - self.send_time_avg)
+
+    def stats(self):
+        """Return the queue and send-time figures for this socket."""
+        return {
+            "level": LEVEL_NAMES[self.level],
+            "queued": len(self._frames),
+            "max_queue": self.max_size,
+            "sent": self.sent,
+            "degraded": self.degraded_total,
+            "skipped": self.skipped_total,
+            "send_ms_avg": round(self.send_time_avg * 1000, 3),
+            "send_ms_max": round(self.send_time_max * 1000, 3),
+            "lag_ms": round(self.lag() * 1000, 3)
+        }
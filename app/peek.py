@@ -0,0 +1,148 @@
+"""
+Look at a subscription's backlog without consuming it.
+
+``peek_subscription`` drains up to ``max_messages`` with batched synchronous
+pulls running on ``concurrency`` threads. Pulled messages are held (not acked)
+while the peek runs, so they are not handed out again, and at the end their ack
+deadline is reset to zero: Pub/Sub redelivers all of them to the regular
+subscribers, and nothing is consumed.
+
+If a peek outlives the subscription's ack deadline, some messages may be
+delivered twice; they are dropped by message ID.
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_PEEK_CONCURRENCY = int(os.environ.get("PEEK_CONCURRENCY", "4"))
+MAX_PEEK_MESSAGES = int(os.environ.get("PEEK_MAX_MESSAGES", "50000"))
+MAX_PEEK_CONCURRENCY = int(os.environ.get("PEEK_MAX_CONCURRENCY", "32"))
+
+# Pub/Sub returns at most 1000 messages per pull
+PULL_BATCH_SIZE = 1000
+# How long one pull waits for messages before the backlog is considered drained
+PULL_TIMEOUT = 5
+# Empty pulls in a row before an empty-looking subscription is given up on
+EMPTY_PULLS_TO_STOP = 2
+# Ack IDs per ModifyAckDeadline request
+RELEASE_BATCH_SIZE = 1000
+
+
+def peek_subscription(project_id, subscription_id, max_messages, concurrency=DEFAULT_PEEK_CONCURRENCY, subscriber=None):
+    """Pull up to ``max_messages`` without consuming them.
+
+    Returns ``(messages, report)``: the ``PubsubMessage`` objects in pull order
+    and a dict with the pull throughput. A subscriber client created here is
+    closed before returning; one passed in is left open.
+    """
+    from google.cloud import pubsub_v1
+
+    if subscriber is not None:
+        return _peek(subscriber, project_id, subscription_id, max_messages, concurrency)
+    subscriber = pubsub_v1.SubscriberClient()
+    try:
+        return _peek(subscriber, project_id, subscription_id, max_messages, concurrency)
+    finally:
+        # Releases the gRPC channel
+        subscriber.close()
+
+
+def _peek(subscriber, project_id, subscription_id, max_messages, concurrency):
+    from google.api_core import exceptions
+
+    max_messages = max(0, min(max_messages, MAX_PEEK_MESSAGES))
+    concurrency = max(1, min(concurrency, MAX_PEEK_CONCURRENCY))
+    subscription_path = subscriber.subscription_path(project_id, subscription_id)
+
+    messages = []
+    seen_ids = set()
+    ack_ids = []
+    counters = {"pull_requests": 0, "duplicates": 0, "bytes": 0, "in_flight": 0}
+    lock = threading.Lock()
+    drained = threading.Event()
+
+    def pull_worker():
+        try:
+            pull_until_drained()
+        except Exception:
+            # Stop the other workers too; the error is raised from peek_subscription
+            drained.set()
+            raise
+
+    def pull_until_drained():
+        empty_pulls = 0
+        while not drained.is_set():
+            # Only ask for what other in-flight pulls will not already bring back
+            with lock:
+                batch = min(PULL_BATCH_SIZE, max_messages - len(messages) - counters["in_flight"])
+                if batch > 0:
+                    counters["in_flight"] += batch
+            if batch <= 0:
+                if len(messages) >= max_messages or not counters["in_flight"]:
+                    return
+                # Wait and see whether the in-flight pulls come back short
+                time.sleep(0.01)
+                continue
+            try:
+                response = subscriber.pull(
+                    request={"subscription": subscription_path, "max_messages": batch},
+                    retry=None,
+                    timeout=PULL_TIMEOUT
+                )
+                received = response.received_messages
+            except exceptions.DeadlineExceeded:
+                received = []
+            finally:
+                with lock:
+                    counters["in_flight"] -= batch
+
+            with lock:
+                counters["pull_requests"] += 1
+                for item in received:
+                    # Every pulled message is released at the end, including extras
+                    ack_ids.append(item.ack_id)
+                    message = item.message
+                    if message.message_id in seen_ids:
+                        counters["duplicates"] += 1
+                    elif len(messages) < max_messages:
+                        seen_ids.add(message.message_id)
+                        messages.append(message)
+                        counters["bytes"] += len(message.data)
+            if received:
+                empty_pulls = 0
+                continue
+            empty_pulls += 1
+            # Once messages have flowed, one empty pull means the backlog is drained
+            if messages or empty_pulls >= EMPTY_PULLS_TO_STOP:
+                drained.set()
+
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for future in [executor.submit(pull_worker) for _ in range(concurrency)]:
+                future.result()
+        elapsed = time.perf_counter() - start
+    finally:
+        # Hand everything back to the subscription, even if a pull failed
+        for i in range(0, len(ack_ids), RELEASE_BATCH_SIZE):
+            subscriber.modify_ack_deadline(request={
+                "subscription": subscription_path,
+                "ack_ids": ack_ids[i:i + RELEASE_BATCH_SIZE],
+                "ack_deadline_seconds": 0
+            })
+
+    report = {
+        "subscription": subscription_path,
+        "messages": len(messages),
+        "duplicates": counters["duplicates"],
+        "released": len(ack_ids),
+        "pull_requests": counters["pull_requests"],
+        "concurrency": concurrency,
+        "bytes": counters["bytes"],
+        "elapsed_seconds": round(elapsed, 3),
+        "messages_per_second": round(len(messages) / elapsed, 1) if elapsed else 0.0,
+        "bytes_per_second": round(counters["bytes"] / elapsed, 1) if elapsed else 0.0
+    }
+    return messages, report
@@ -0,0 +1,492 @@
+"""
+Bounded-cost summaries of large JSON payloads.
+
+A message can be many megabytes; printing or rendering all of it freezes the
+terminal or the browser. ``summarize_body`` returns a copy that respects
+``RenderLimits``:
+
+- containers deeper than ``max_depth`` become ``"{…N keys}"`` / ``"[…N items]"``
+- only the first ``max_items`` array items or object keys are kept, followed by
+  an ``"…N more items"`` entry (or an ``"…"`` key for objects)
+- strings longer than ``max_string`` are cut, with ``"…(N more chars)"``
+- once about ``max_bytes`` of output has been produced, everything else is
+  summarised the same way
+
+Bodies larger than ``max_bytes`` are not loaded with ``json.loads``: they are
+scanned as text, and only the parts that are shown are turned into Python
+objects. Skipped containers and strings are jumped over with regular
+expressions, and after ``max_scan`` bytes have been skipped the scan stops
+altogether and the rest is marked as not scanned, so the cost follows the size
+of the summary rather than the size of the message.
+
+A ``path`` such as ``orders[2].items`` selects a sub-tree to summarise instead
+of the whole document, which is how a chosen part is expanded on demand. The
+web interface keeps the raw bodies of truncated messages in a ``BodyStore`` so
+they can be expanded later.
+"""
+
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+
+DEFAULT_RENDER_MAX_DEPTH = int(os.environ.get("RENDER_MAX_DEPTH", "8"))
+DEFAULT_RENDER_MAX_ITEMS = int(os.environ.get("RENDER_MAX_ITEMS", "50"))
+DEFAULT_RENDER_MAX_STRING = int(os.environ.get("RENDER_MAX_STRING", "1000"))
+DEFAULT_RENDER_MAX_BYTES = int(os.environ.get("RENDER_MAX_BYTES", "65536"))
+DEFAULT_RENDER_MAX_SCAN = int(os.environ.get("RENDER_MAX_SCAN", "1048576"))
+# Raw bodies of truncated messages kept per subscription for expanding
+DEFAULT_RENDER_BODY_CACHE_BYTES = int(os.environ.get("RENDER_BODY_CACHE_BYTES", "4194304"))
+# Largest body parsed whole for field statistics, query columns and shapes
+DEFAULT_ANALYZE_MAX_BYTES = int(os.environ.get("ANALYZE_MAX_BYTES", "262144"))
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+# Unrolled loop: much faster than (?:[^"\\]|\\.)* on long strings
+_STRING = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+_SCALAR = re.compile(r"-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?|true|false|null")
+# Tokens that matter when jumping over a value: strings (which may contain
+# brackets and commas), brackets and commas
+_STRUCTURE = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|[\[\]{},]', re.DOTALL)
+_PATH_PART = re.compile(r"\[(\d+)\]|([^.\[\]]+)")
+
+
+class RenderLimits:
+    """Limits on what a summary may contain."""
+
+    def __init__(self, max_depth=DEFAULT_RENDER_MAX_DEPTH, max_items=DEFAULT_RENDER_MAX_ITEMS,
+                 max_string=DEFAULT_RENDER_MAX_STRING, max_bytes=DEFAULT_RENDER_MAX_BYTES,
+                 max_scan=DEFAULT_RENDER_MAX_SCAN):
+        self.max_depth = max_depth
+        self.max_items = max_items
+        self.max_string = max_string
+        self.max_bytes = max_bytes
+        self.max_scan = max_scan
+
+
+class Marker(str):
+    """A placeholder for content left out of a summary."""
+
+
+class PathError(ValueError):
+    """Raised when a path does not exist in the document."""
+
+
+def parse_path(path):
+    """Split ``a.b[2].c`` into ``["a", "b", 2, "c"]``."""
+    parts = []
+    for match in _PATH_PART.finditer(path or ""):
+        index, key = match.groups()
+        parts.append(int(index) if index is not None else key)
+    return parts
+
+
+def _truncate_string(value, limits):
+    if len(value) <= limits.max_string:
+        return value
+    return f"{value[:limits.max_string]}…({len(value) - limits.max_string} more chars)"
+
+
+class _Budget:
+    def __init__(self, limits):
+        self.limits = limits
+        self.remaining = limits.max_bytes
+        self.truncated = False
+
+    def spend(self, size):
+        self.remaining -= size
+
+    def marker(self, text):
+        self.truncated = True
+        return Marker(text)
+
+
+def _summarize_value(value, budget, depth):
+    limits = budget.limits
+    if isinstance(value, dict):
+        if depth >= limits.max_depth or budget.remaining <= 0:
+            return budget.marker(f"{{…{len(value)} keys}}")
+        result = {}
+        for key, item in value.items():
+            if len(result) >= limits.max_items or budget.remaining <= 0:
+                result["…"] = budget.marker(f"{len(value) - len(result)} more keys")
+                break
+            budget.spend(len(key) + 4)
+            result[key] = _summarize_value(item, budget, depth + 1)
+        return result
+    if isinstance(value, list):
+        if depth >= limits.max_depth or budget.remaining <= 0:
+            return budget.marker(f"[…{len(value)} items]")
+        result = []
+        for item in value:
+            if len(result) >= limits.max_items or budget.remaining <= 0:
+                result.append(budget.marker(f"…{len(value) - len(result)} more items"))
+                break
+            result.append(_summarize_value(item, budget, depth + 1))
+        return result
+    if isinstance(value, str):
+        shown = _truncate_string(value, limits)
+        if shown is not value:
+            budget.truncated = True
+        budget.spend(len(shown) + 2)
+        return shown
+    budget.spend(len(str(value)))
+    return value
+
+
+def _select(value, path):
+    for part in parse_path(path):
+        try:
+            value = value[part]
+        except (KeyError, IndexError, TypeError):
+            raise PathError(f"Path not found: {path}")
+    return value
+
+
+def summarize(value, limits=None, path=None):
+    """Summarise an already parsed JSON value; returns ``(summary, truncated)``."""
+    budget = _Budget(limits or RenderLimits())
+    summary = _summarize_value(_select(value, path), budget, 0)
+    return summary, budget.truncated
+
+
+class _TextSummarizer:
+    """Builds a summary straight from JSON text, skipping what is not shown."""
+
+    def __init__(self, text, limits):
+        self.text = text
+        self.budget = _Budget(limits)
+        self.limits = limits
+        self.scan_remaining = limits.max_scan
+        # Set once the scan limit is hit; everything after that is left out
+        self.stopped = False
+
+    def ws(self, pos):
+        return _WHITESPACE.match(self.text, pos).end()
+
+    def error(self, pos, expected):
+        raise ValueError(f"Invalid JSON at offset {pos}: expected {expected}")
+
+    def skip_rest(self, pos):
+        """Jump to just after the close of the container ``pos`` is inside.
+
+        Returns ``(end, commas)`` where ``commas`` counts separators at that
+        level, or ``(None, None)`` if the scan limit was reached first.
+        """
+        depth = 0
+        commas = 0
+        limit = pos + self.scan_remaining
+        for match in _STRUCTURE.finditer(self.text, pos):
+            if match.start() > limit:
+                self.scan_remaining = 0
+                self.stopped = True
+                self.budget.truncated = True
+                return None, None
+            token = match.group()
+            if token in "[{":
+                depth += 1
+            elif token in "]}":
+                if depth == 0:
+                    self.scan_remaining -= match.end() - pos
+                    return match.end(), commas
+                depth -= 1
+            elif token == "," and depth == 0:
+                commas += 1
+        self.error(len(self.text), "end of container")
+
+    def skip_container(self, pos):
+        """Jump over the container starting at ``pos``; returns ``(end, children)``."""
+        inner = self.ws(pos + 1)
+        if self.text[inner:inner + 1] in ("]", "}"):
+            return inner + 1, 0
+        end, commas = self.skip_rest(inner)
+        return end, commas if commas is None else commas + 1
+
+    def skip_value(self, pos):
+        pos = self.ws(pos)
+        char = self.text[pos:pos + 1]
+        if char in ("{", "["):
+            return self.skip_container(pos)[0]
+        if char == '"':
+            match = _STRING.match(self.text, pos)
+            if not match:
+                self.error(pos, "string")
+            return match.end()
+        match = _SCALAR.match(self.text, pos)
+        if not match:
+            self.error(pos, "value")
+        return match.end()
+
+    def string(self, pos, truncate=True):
+        match = _STRING.match(self.text, pos)
+        if not match:
+            self.error(pos, "string")
+        start, end = pos + 1, match.end() - 1
+        max_string = self.limits.max_string
+        if not truncate or end - start <= max_string:
+            return json.loads(match.group()), match.end()
+
+        if self.text.find("\\", start, end) != -1:
+            # Escapes make the decoded length differ from the raw one; decoding
+            # the whole string in C is faster than counting them
+            value = json.loads(match.group())
+            shown = _truncate_string(value, self.limits)
+            if shown is not value:
+                self.budget.truncated = True
+            return shown, match.end()
+
+        self.budget.truncated = True
+        return f"{self.text[start:start + max_string]}…({end - start - max_string} more chars)", match.end()
+
+    def not_scanned(self, pos):
+        return self.budget.marker(f"…{len(self.text) - pos} bytes not scanned")
+
+    def value(self, pos, depth):
+        """Return ``(summary, end)`` for the value at ``pos``."""
+        pos = self.ws(pos)
+        char = self.text[pos:pos + 1]
+        if char == "{":
+            return self.object(pos, depth)
+        if char == "[":
+            return self.array(pos, depth)
+        if char == '"':
+            value, end = self.string(pos)
+            self.budget.spend(len(value) + 2)
+            return value, end
+        match = _SCALAR.match(self.text, pos)
+        if not match:
+            self.error(pos, "value")
+        self.budget.spend(match.end() - pos)
+        return json.loads(match.group()), match.end()
+
+    def object(self, pos, depth):
+        if depth >= self.limits.max_depth or self.budget.remaining <= 0:
+            end, count = self.skip_container(pos)
+            if end is None:
+                return self.not_scanned(pos), len(self.text)
+            return self.budget.marker(f"{{…{count} keys}}"), end
+
+        result = {}
+        pos = self.ws(pos + 1)
+        if self.text[pos:pos + 1] == "}":
+            return result, pos + 1
+        while True:
+            if len(result) >= self.limits.max_items or self.budget.remaining <= 0:
+                end, commas = self.skip_rest(pos)
+                if end is None:
+                    result["…"] = self.not_scanned(pos)
+                    return result, len(self.text)
+                result["…"] = self.budget.marker(f"{commas + 1} more keys")
+                return result, end
+            key, pos = self.string(self.ws(pos), truncate=False)
+            pos = self.ws(pos)
+            if self.text[pos:pos + 1] != ":":
+                self.error(pos, "':'")
+            self.budget.spend(len(key) + 4)
+            result[key], pos = self.value(pos + 1, depth + 1)
+            if self.stopped:
+                return result, pos
+            pos = self.ws(pos)
+            char = self.text[pos:pos + 1]
+            if char == "}":
+                return result, pos + 1
+            if char != ",":
+                self.error(pos, "',' or '}'")
+            pos += 1
+
+    def array(self, pos, depth):
+        if depth >= self.limits.max_depth or self.budget.remaining <= 0:
+            end, count = self.skip_container(pos)
+            if end is None:
+                return self.not_scanned(pos), len(self.text)
+            return self.budget.marker(f"[…{count} items]"), end
+
+        result = []
+        pos = self.ws(pos + 1)
+        if self.text[pos:pos + 1] == "]":
+            return result, pos + 1
+        while True:
+            if len(result) >= self.limits.max_items or self.budget.remaining <= 0:
+                end, commas = self.skip_rest(pos)
+                if end is None:
+                    result.append(self.not_scanned(pos))
+                    return result, len(self.text)
+                result.append(self.budget.marker(f"…{commas + 1} more items"))
+                return result, end
+            item, pos = self.value(pos, depth + 1)
+            result.append(item)
+            if self.stopped:
+                return result, pos
+            pos = self.ws(pos)
+            char = self.text[pos:pos + 1]
+            if char == "]":
+                return result, pos + 1
+            if char != ",":
+                self.error(pos, "',' or ']'")
+            pos += 1
+
+    def find(self, pos, path):
+        """Return the offset of the value at ``path`` below the value at ``pos``."""
+        # Reaching an explicitly requested path is not limited by max_scan
+        self.scan_remaining = len(self.text)
+        for part in parse_path(path):
+            pos = self.ws(pos)
+            opening = self.text[pos:pos + 1]
+            if isinstance(part, int) and opening == "[":
+                pos = self.ws(pos + 1)
+                for _ in range(part):
+                    if self.text[pos:pos + 1] == "]":
+                        raise PathError(f"Path not found: {path}")
+                    pos = self.ws(self.skip_value(pos))
+                    if self.text[pos:pos + 1] != ",":
+                        raise PathError(f"Path not found: {path}")
+                    pos = self.ws(pos + 1)
+                if self.text[pos:pos + 1] == "]":
+                    raise PathError(f"Path not found: {path}")
+            elif isinstance(part, str) and opening == "{":
+                pos = self.ws(pos + 1)
+                while True:
+                    if self.text[pos:pos + 1] == "}":
+                        raise PathError(f"Path not found: {path}")
+                    key, pos = self.string(pos, truncate=False)
+                    pos = self.ws(pos)
+                    if self.text[pos:pos + 1] != ":":
+                        self.error(pos, "':'")
+                    pos = self.ws(pos + 1)
+                    if key == part:
+                        break
+                    pos = self.ws(self.skip_value(pos))
+                    if self.text[pos:pos + 1] != ",":
+                        raise PathError(f"Path not found: {path}")
+                    pos = self.ws(pos + 1)
+            else:
+                raise PathError(f"Path not found: {path}")
+        return pos
+
+
+def summarize_text(text, limits=None, path=None):
+    """Summarise JSON text without parsing the parts that are not shown.
+
+    Returns ``(summary, truncated)``; raises ValueError for invalid JSON.
+    """
+    summarizer = _TextSummarizer(text, limits or RenderLimits())
+    if path:
+        start = summarizer.find(0, path)
+        summarizer.scan_remaining = summarizer.limits.max_scan
+    else:
+        start = 0
+    summary, end = summarizer.value(start, 0)
+    if not path and not summarizer.stopped and summarizer.ws(end) != len(text):
+        summarizer.error(summarizer.ws(end), "end of document")
+    return summary, summarizer.budget.truncated
+
+
+def summarize_body(body, limits=None, path=None):
+    """Summarise a message body (bytes or str).
+
+    Returns ``(value, is_json, truncated)``. Small bodies are parsed with
+    ``json.loads``; bodies over ``max_bytes`` are summarised from the text.
+    Bodies that are not JSON come back as a (possibly cut) string. An already
+    decoded body (e.g. an Avro record) is summarised as it is.
+    """
+    limits = limits or RenderLimits()
+    if not isinstance(body, (bytes, str)):
+        summary, truncated = summarize(body, limits, path)
+        return summary, True, truncated
+    text = body.decode("utf-8", errors="replace") if isinstance(body, bytes) else body
+
+    if len(text) <= limits.max_bytes:
+        try:
+            value = json.loads(text)
+        except json.JSONDecodeError:
+            if path:
+                raise PathError(f"Path not found: {path}")
+            shown = _truncate_string(text, limits)
+            return shown, False, shown is not text
+        summary, truncated = summarize(value, limits, path)
+        return summary, True, truncated
+
+    try:
+        summary, truncated = summarize_text(text, limits, path)
+        return summary, True, truncated
+    except PathError:
+        raise
+    except ValueError:
+        if path:
+            raise PathError(f"Path not found: {path}")
+        return _truncate_string(text, limits), False, True
+
+
+def analysable(body, size=0, max_bytes=DEFAULT_ANALYZE_MAX_BYTES):
+    """Whether a decoded body is small enough to be parsed and walked whole.
+
+    Walking every field of a parsed body costs much more than summarising it,
+    so bodies over ``max_bytes`` are left out of the consumers that need every
+    field. ``size`` is the size of the message as received; it stands in for
+    bodies that were decoded to objects.
+    """
+    length = len(body) if isinstance(body, (bytes, str)) else size
+    return length <= max_bytes
+
+
+def parse_body(body):
+    """Parse a whole message body: JSON text as JSON, other text as a string.
+
+    Unlike ``summarize_body`` nothing is cut, for consumers that need every
+    field (statistics, query columns, shapes) rather than a preview.
+    """
+    if not isinstance(body, (bytes, str)):
+        return body
+    text = body.decode("utf-8", errors="replace") if isinstance(body, bytes) else body
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return text
+
+
+class BodyStore:
+    """Thread-safe LRU of raw message bodies, bounded by their total size."""
+
+    def __init__(self, max_bytes=DEFAULT_RENDER_BODY_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._bodies = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def put(self, message_id, body):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._bodies.pop(message_id, None)
+            if old is not None:
+                self._size -= len(old)
+            self._bodies[message_id] = body
+            self._size += len(body)
+            while self._size > self.max_bytes:
+                _, evicted = self._bodies.popitem(last=False)
+                self._size -= len(evicted)
+
+    def get(self, message_id):
+        """Return the body of ``message_id``, or None if it was evicted or never stored."""
+        with self._lock:
+            body = self._bodies.get(message_id)
+            if body is not None:
+                self._bodies.move_to_end(message_id)
+            return body
+
+    def memory_bytes(self):
+        with self._lock:
+            return self._size
+
+
+def expand_body(body_store, message_id, path, limits=None):
+    """Summarise ``path`` of a body kept in ``body_store``.
+
+    Raises KeyError if the body is not stored and PathError if the path does
+    not exist.
+    """
+    body = body_store.get(message_id) if body_store is not None else None
+    if body is None:
+        raise KeyError(message_id)
+    data, _, truncated = summarize_body(body, limits, path)
+    return {"message_id": message_id, "path": path or "", "data": data, "truncated": truncated, "size": len(body)}
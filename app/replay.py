@@ -0,0 +1,71 @@
+"""
+Numbered replay log for Server-Sent Events streams.
+
+Every message sent on ``/api/stream/{client_id}`` gets an increasing event ID
+and is kept in a bounded log. When the browser reconnects it sends the last ID
+it received (``Last-Event-ID``), and the stream first replays everything after
+that ID, so a dropped connection does not lose the messages that were in
+flight.
+
+Event IDs look like ``<epoch>-<number>``; the epoch changes whenever the log is
+recreated (new subscription, server restart), so a stale ID from an earlier log
+is not mistaken for a position in the current one.
+
+The log lives in the worker process that serves the stream. With several web
+workers a reconnect can land on another worker, whose log has a different
+epoch, and the stream then continues with new messages without replaying the
+missed ones: resuming is only guaranteed with a single worker (or with sticky
+sessions in front of the workers).
+"""
+
+import json
+import os
+import threading
+import uuid
+from collections import deque
+
+DEFAULT_SSE_REPLAY_SIZE = int(os.environ.get("SSE_REPLAY_SIZE", "1000"))
+
+
+class ReplayLog:
+    """Thread-safe ring of the last ``max_size`` ``(event_id, message)`` pairs."""
+
+    def __init__(self, max_size=DEFAULT_SSE_REPLAY_SIZE):
+        self.epoch = uuid.uuid4().hex[:8]
+        self.last_id = 0
+        self._entries = deque(maxlen=max(max_size, 1))
+        self._lock = threading.Lock()
+
+    def append(self, message):
+        """Number and remember a message; return its event ID."""
+        with self._lock:
+            self.last_id += 1
+            self._entries.append((self.last_id, message))
+            return self.last_id
+
+    def format_id(self, number):
+        return f"{self.epoch}-{number}"
+
+    def parse_id(self, event_id):
+        """Return the position of an event ID in this log, None if it is from another log."""
+        epoch, _, number = (event_id or "").partition("-")
+        if epoch != self.epoch or not number.isdigit():
+            return None
+        return int(number)
+
+    def memory_bytes(self):
+        """Approximate memory held by the logged messages."""
+        with self._lock:
+            return sum(len(json.dumps(message)) for _, message in self._entries)
+
+    def since(self, event_id):
+        """Return ``(missed, entries)`` for everything after ``event_id``.
+
+        ``missed`` counts messages that were already evicted from the log.
+        """
+        with self._lock:
+            if event_id >= self.last_id:
+                return 0, []
+            oldest = self._entries[0][0] if self._entries else self.last_id + 1
+            missed = max(oldest - event_id - 1, 0)
+            return missed, [entry for entry in self._entries if entry[0] > event_id]
@@ -1,17 +1,32 @@
-from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks, WebSocket, WebSocketDisconnect
+from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks, WebSocket, WebSocketDisconnect, Query, Request
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 import json
 import asyncio
+import anyio
 from typing import List, Dict, Any, Optional, Union
 import os
 from google.cloud import pubsub_v1
-from google.cloud.resourcemanager_v3 import ProjectsClient, ListProjectsRequest, Project
 from dotenv import load_dotenv
-import threading
 import queue
 import time
 import subprocess
 import re
+import threading
+from collections import Counter
+
+from app.broker import BrokerClient
+from app.dedup import MessageDeduplicator
+from app.stats import SubscriptionStats
+from app.columnar import ColumnStore, QueryError, DEFAULT_QUERY_BUFFER_SIZE
+from app.outbound import SocketWriter
+from app.replay import ReplayLog
+from app.peek import peek_subscription, DEFAULT_PEEK_CONCURRENCY
+from app.lifecycle import SubscriptionManager
+from app.decoders import decode_body, submit
+from app.render import BodyStore, PathError, RenderLimits, analysable, expand_body, parse_body, summarize_body
+from app.shapes import ShapeTracker, limit_changes
 
 # Load environment variables
 load_dotenv()
@@ -23,6 +38,16 @@ message_queues = {}
 active_connections = set()
 # Use a dictionary para rastrear qué client_id corresponde a cada WebSocket
 websocket_to_client = {}
+# Multiplexed session sockets (/ws) and the client_ids each one is subscribed to
+websocket_subscriptions = {}
+
+# Listeners started by this process (single-process mode; the broker has its own)
+subscription_manager = SubscriptionManager()
+
+# Messages a multiplexed socket sends per subscription before moving to the next one
+MUX_QUANTUM = int(os.environ.get("MUX_QUANTUM", "10"))
+# Seconds between keep-alive comments on idle Server-Sent Events streams
+SSE_KEEPALIVE_SECONDS = 15
 
 # Models
 class PubSubConfig(BaseModel):
@@ -59,32 +84,105 @@ class PublishRequest(BaseModel):
     attributes: Optional[Dict[str, str]] = None
 
 # WebSocket connection manager
+# Every socket is written by its own SocketWriter task, so a slow browser
+# only ever delays (and degrades) its own stream
 class ConnectionManager:
     def __init__(self):
         self.active_connections: List[WebSocket] = []
+        self.writers: Dict[WebSocket, SocketWriter] = {}
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
         self.active_connections.append(websocket)
+        writer = self.writers[websocket] = SocketWriter(websocket)
+        writer.start()
         return len(self.active_connections) - 1  # Return the index
 
     def disconnect(self, websocket: WebSocket):
         if websocket in self.active_connections:
             self.active_connections.remove(websocket)
+        writer = self.writers.pop(websocket, None)
+        if writer is not None:
+            writer.stop()
 
     async def send_message(self, message: dict, websocket: WebSocket):
-        await websocket.send_json(message)
+        """Queue a status or control frame for the socket."""
+        self.writers[websocket].send(message)
+
+    async def send_data(self, client_id: str, message: dict, websocket: WebSocket):
+        """Queue a Pub/Sub message frame; it may be degraded if the socket is slow."""
+        return self.writers[websocket].offer(client_id, message)
 
     async def broadcast(self, message: dict):
-        for connection in self.active_connections:
+        for connection in list(self.active_connections):
             try:
-                await connection.send_json(message)
-            except Exception:
+                self.writers[connection].send(message)
+            except (KeyError, WebSocketDisconnect):
                 # Remove connection if it's closed
                 self.disconnect(connection)
 
+    def stats(self):
+        """Return per-socket send statistics."""
+        return [writer.stats() for writer in self.writers.values()]
+
 manager = ConnectionManager()
 
+def _on_broker_subscription_closed(client_id):
+    """Drop local queues when another worker disconnects a shared subscription."""
+    message_queues.pop(client_id, None)
+
+# Shared broker connection when running with multiple workers, None otherwise
+broker = BrokerClient.from_env(on_closed=_on_broker_subscription_closed)
+
+# Sockets and event streams reading each client_id's queues in this worker
+stream_consumers = Counter()
+_consumers_lock = threading.Lock()
+
+def ensure_client_queues(client_id):
+    """Return True if client_id has local queues, attaching to the broker if needed.
+
+    With multiple workers the request that created a subscription may have been
+    served by another worker, so unknown client IDs are looked up in the broker,
+    which then routes every message of the subscription to this worker. Only
+    endpoints that read the messages should call this; the others ask the broker.
+    """
+    if client_id in message_queues:
+        return True
+    if broker is None:
+        return False
+    
+    queues = {"messages": queue.Queue(), "status": queue.Queue()}
+    try:
+        attached = broker.attach(client_id, queues)
+    except (EOFError, OSError) as e:
+        print(f"Error attaching {client_id} to message broker: {str(e)}")
+        return False
+    if attached:
+        message_queues[client_id] = queues
+    return attached
+
+def acquire_client_queues(client_id):
+    """Like ensure_client_queues, for a socket or stream that reads until it is released."""
+    with _consumers_lock:
+        if not ensure_client_queues(client_id):
+            return False
+        stream_consumers[client_id] += 1
+        return True
+
+def release_client_queues(client_id):
+    """Forget a consumer; after the last one this worker detaches from the broker."""
+    with _consumers_lock:
+        stream_consumers[client_id] -= 1
+        if stream_consumers[client_id] > 0:
+            return
+        del stream_consumers[client_id]
+        if broker is None or message_queues.pop(client_id, None) is None:
+            return
+        try:
+            broker.detach(client_id)
+        except (EOFError, OSError) as e:
+            print(f"Error detaching {client_id} from message broker: {str(e)}")
+
 def convert_to_json_serializable(obj):
     """Convert a object to a JSON serializable format."""
     if isinstance(obj, dict):
@@ -98,51 +196,114 @@ def convert_to_json_serializable(obj):
         # Convert all other types to their native Python equivalent
         return str(obj) if not isinstance(obj, (str, int, float, bool, type(None))) else obj
 
-def create_subscription_listener(project_id, subscription_id, msg_queue, status_queue):
-    """Create a Pub/Sub subscriber and listen for messages in a separate thread."""
+# Parts of a message's "shape" that only clients showing compact messages need
+SHAPE_CHANGE_KEYS = ("changes", "removed", "more_changes")
+
+def shape_for_client(message, compact):
+    """Return ``message`` as sent to a client: without the shape's changed fields unless ``compact``."""
+    shape = message.get("shape")
+    if compact or not shape or "changes" not in shape:
+        return message
+    message = dict(message)
+    message["shape"] = {key: value for key, value in shape.items() if key not in SHAPE_CHANGE_KEYS}
+    return message
+
+def message_to_dict(message, body_store=None, decoded=None):
+    """Convert a Pub/Sub message to the dict sent to the browser.
+    
+    Compressed and schema-encoded data is decoded first; the steps applied are
+    listed in "encoding" and a failure in "decode_error". The data is then
+    summarised within the render limits (raw string if it is not JSON); a
+    shortened message is flagged with "truncated" and its full "size", and its
+    decoded body is kept in ``body_store`` for expanding. ``decoded`` is the
+    result of ``decode_body`` if the caller already has it.
+    """
+    if decoded is None:
+        decoded = decode_body(message.data, message.attributes)
+    data, _, truncated = summarize_body(decoded.value)
+    
+    # Create a message object with all JSON serializable data
+    msg_obj = {
+        "data": data,
+        "attributes": dict(message.attributes) if message.attributes else {},
+        "message_id": message.message_id,
+        "publish_time": str(message.publish_time)
+    }
+    if decoded.steps:
+        msg_obj["encoding"] = decoded.steps
+    if decoded.error:
+        msg_obj["decode_error"] = decoded.error
+    if truncated:
+        msg_obj["truncated"] = True
+        msg_obj["size"] = len(message.data)
+        if body_store is not None:
+            body_store.put(message.message_id, decoded.text())
+    return msg_obj
+
+def create_subscription_listener(project_id, subscription_id, msg_queue, status_queue, deduplicator=None, stats=None, column_store=None, body_store=None, shape_tracker=None, lifecycle=None):
+    """Create a Pub/Sub subscriber and listen for messages in a separate thread.
+
+    If a deduplicator is given, redelivered messages are acknowledged but not queued.
+    If stats or a column store are given, every message is also added to them,
+    except shortened messages larger than ANALYZE_MAX_BYTES.
+    If a body store is given, the raw data of truncated messages is kept in it.
+    If a shape tracker is given, each message gets a "shape" with its structural
+    fingerprint, the count for that shape and the fields changed since the last
+    message of the same shape.
+    If a lifecycle (ManagedListener) is given, it receives the subscriber and the
+    streaming pull future so the listener can be stopped from outside.
+    """
     print(f"Starting Pub/Sub listener for project={project_id}, subscription={subscription_id}")
     
     def callback(message):
         """Process received Pub/Sub message."""
-        try:
-            # Decode message from bytes to string
-            message_data = message.data.decode("utf-8")
-            print(f"Received message: ID={message.message_id}, size={len(message_data)} bytes")
-            
-            # Try to parse the message data as JSON
+        if deduplicator is not None and deduplicator.is_duplicate(message.message_id):
+            print(f"Dropping duplicate message {message.message_id}")
+            message.ack()
+            return
+        
+        def process():
             try:
-                json_data = json.loads(message_data)
-            except json.JSONDecodeError:
-                # If not valid JSON, use as raw string
-                print(f"Message is not valid JSON, using as raw string")
-                json_data = message_data
-            
-            # Convert attributes to a regular Python dict
-            attrs = {}
-            if message.attributes:
-                for key, value in message.attributes.items():
-                    attrs[key] = value
-            
-            # Create a message object with all JSON serializable data
-            msg_obj = {
-                "data": json_data,
-                "attributes": attrs,
-                "message_id": message.message_id,
-                "publish_time": str(message.publish_time)
-            }
+                print(f"Received message: ID={message.message_id}, size={len(message.data)} bytes")
+                decoded = decode_body(message.data, message.attributes)
+                msg_obj = message_to_dict(message, body_store, decoded)
+                # A shortened summary has markers in place of the parts it cut,
+                # so the consumers below get the whole body instead, unless it is
+                # over ANALYZE_MAX_BYTES and too costly to walk for every message
+                if not msg_obj.get("truncated"):
+                    analysed = True
+                    data = msg_obj["data"]
+                elif analysable(decoded.value, len(message.data)):
+                    analysed = True
+                    data = parse_body(decoded.value)
+                else:
+                    analysed = False
+                    print(f"Message {message.message_id} is too large for statistics, query columns and shapes")
+                
+                if analysed:
+                    if shape_tracker is not None:
+                        msg_obj["shape"] = limit_changes(shape_tracker.observe(data, msg_obj["attributes"]))
+                    if stats is not None:
+                        stats.add_message(data, msg_obj["attributes"])
+                    if column_store is not None:
+                        column_store.append(message.message_id, data, msg_obj["attributes"])
             
-            # Add to queue
-            msg_queue.put(convert_to_json_serializable(msg_obj))
-            print(f"Added message {message.message_id} to queue")
-        except Exception as e:
-            print(f"Error processing message: {str(e)}")
-            import traceback
-            traceback.print_exc()
-            status_queue.put({"error": f"Error processing message: {str(e)}"})
+                # Add to queue
+                msg_queue.put(convert_to_json_serializable(msg_obj))
+                print(f"Added message {message.message_id} to queue")
+            except Exception as e:
+                print(f"Error processing message: {str(e)}")
+                import traceback
+                traceback.print_exc()
+                status_queue.put({"error": f"Error processing message: {str(e)}"})
         
-        message.ack()  # Acknowledge the message
-        print(f"Acknowledged message {message.message_id}")
+            message.ack()  # Acknowledge the message
+            print(f"Acknowledged message {message.message_id}")
+
+        # Large compressed bodies are decompressed off the callback thread
+        submit(message.data, message.attributes, process)
 
+    subscriber = None
     try:
         print(f"Creating Pub/Sub subscriber client")
         subscriber = pubsub_v1.SubscriberClient()
@@ -155,8 +316,11 @@ def create_subscription_listener(project_id, subscription_id, msg_queue, status_
         # Subscribe to the subscription
         print(f"Subscribing to Pub/Sub")
         streaming_pull_future = subscriber.subscribe(
-            subscription_path, callback=callback
+            subscription_path, callback=callback,
+            scheduler=lifecycle.make_scheduler() if lifecycle is not None else None
         )
+        if lifecycle is not None:
+            lifecycle.attach(subscriber, streaming_pull_future)
         
         status_queue.put({"status": "connected", "subscription": subscription_path})
         print(f"Put 'connected' status in queue")
@@ -166,19 +330,30 @@ def create_subscription_listener(project_id, subscription_id, msg_queue, status_
         try:
             streaming_pull_future.result()
         except Exception as e:
-            print(f"Subscription error: {str(e)}")
-            import traceback
-            traceback.print_exc()
-            status_queue.put({"error": f"Subscription error: {str(e)}"})
+            if lifecycle is None or not lifecycle.stopping.is_set():
+                print(f"Subscription error: {str(e)}")
+                import traceback
+                traceback.print_exc()
+                status_queue.put({"error": f"Subscription error: {str(e)}"})
+        print(f"Stopped listening on subscription {subscription_id}")
     except Exception as e:
         print(f"Failed to connect to Pub/Sub: {str(e)}")
         import traceback
         traceback.print_exc()
         status_queue.put({"error": f"Failed to connect: {str(e)}"})
+    finally:
+        # The stream has ended (or never started): release the gRPC channel
+        if subscriber is not None:
+            subscriber.close()
 
 def get_gcp_projects_api():
     """Get available GCP projects using the Google Cloud Resource Manager API"""
     try:
+        # Imported lazily: the Resource Manager client is slow to import and only
+        # needed for this endpoint
+        from google.cloud.resourcemanager_v3 import Project as ResourceProject
+        from google.cloud.resourcemanager_v3 import ProjectsClient
+        
         # Create a Resource Manager client using the credentials
         client = ProjectsClient()
         
@@ -187,7 +362,7 @@ def get_gcp_projects_api():
         
         projects = []
         for project in projects_iterator:
-            if project.state == Project.State.ACTIVE:
+            if project.state == ResourceProject.State.ACTIVE:
                 projects.append({
                     "id": project.project_id,
                     "name": project.display_name or project.project_id
@@ -383,7 +558,7 @@ async def connect_to_pubsub(config: PubSubConfig, background_tasks: BackgroundTa
     client_id = f"{config.project_id}:{config.subscription_id}"
     print(f"Generated client_id: {client_id}")
     
-    # Check if already connected
+    # Check if already connected (the broker reports subscriptions made by other workers)
     if client_id in message_queues:
         print(f"Client {client_id} is already connected")
         return {"status": "already_connected", "client_id": client_id}
@@ -392,21 +567,46 @@ async def connect_to_pubsub(config: PubSubConfig, background_tasks: BackgroundTa
     # Create message queues
     message_queues[client_id] = {
         "messages": queue.Queue(),
-        "status": queue.Queue()
+        "status": queue.Queue(),
+        "dedup": MessageDeduplicator(),
+        "stats": SubscriptionStats(),
+        "columns": ColumnStore() if DEFAULT_QUERY_BUFFER_SIZE > 0 else None,
+        "bodies": BodyStore(),
+        "shapes": ShapeTracker()
     }
     
+    if broker is not None:
+        # The broker process owns the listener and fans messages out to every worker
+        print(f"Subscribing {client_id} through the message broker")
+        try:
+            reply = await run_in_threadpool(
+                broker.subscribe, config.project_id, config.subscription_id, message_queues[client_id]
+            )
+        except (EOFError, OSError) as e:
+            del message_queues[client_id]
+            raise HTTPException(status_code=503, detail=f"Message broker unavailable: {str(e)}")
+        
+        if "error" in reply:
+            del message_queues[client_id]
+            raise HTTPException(status_code=reply.get("code", 400), detail=reply["error"])
+        
+        return {"status": reply["status"], "client_id": client_id}
+    
     print(f"Starting Pub/Sub listener thread for {client_id}")
-    # Start listener in a background thread
-    threading.Thread(
-        target=create_subscription_listener,
-        args=(
-            config.project_id,
-            config.subscription_id,
-            message_queues[client_id]["messages"],
-            message_queues[client_id]["status"]
-        ),
-        daemon=True
-    ).start()
+    # Start listener in a background thread owned by the subscription manager
+    subscription_manager.start(
+        client_id,
+        create_subscription_listener,
+        config.project_id,
+        config.subscription_id,
+        message_queues[client_id]["messages"],
+        message_queues[client_id]["status"],
+        message_queues[client_id]["dedup"],
+        message_queues[client_id]["stats"],
+        message_queues[client_id]["columns"],
+        message_queues[client_id]["bodies"],
+        message_queues[client_id]["shapes"]
+    )
     
     # Wait for initial connection status
     try:
@@ -417,6 +617,8 @@ async def connect_to_pubsub(config: PubSubConfig, background_tasks: BackgroundTa
         if "error" in status:
             print(f"Error in status for {client_id}: {status['error']}")
             del message_queues[client_id]
+            # Waits for the stream to shut down, so keep it off the event loop
+            await run_in_threadpool(subscription_manager.stop, client_id)
             raise HTTPException(status_code=400, detail=status["error"])
         
         print(f"Connection successful for {client_id}")
@@ -424,12 +626,20 @@ async def connect_to_pubsub(config: PubSubConfig, background_tasks: BackgroundTa
     except queue.Empty:
         print(f"Connection timeout for {client_id} - no status received within timeout")
         del message_queues[client_id]
+        await run_in_threadpool(subscription_manager.stop, client_id)
         raise HTTPException(status_code=408, detail="Connection timeout")
 
 @router.get("/status")
 def get_connection_status():
     """Get status of all active connections."""
     connections = {}
+    broker_status = {}
+    if broker is not None:
+        try:
+            broker_status = broker.status()
+        except (EOFError, OSError) as e:
+            print(f"Error fetching message broker status: {str(e)}")
+    
     for client_id in message_queues:
         project_id, subscription_id = client_id.split(":", 1)
         
@@ -439,6 +649,14 @@ def get_connection_status():
         
         # Count active websockets for this client_id
         active_ws_count = sum(1 for ws, cid in websocket_to_client.items() if cid == client_id)
+        active_ws_count += sum(1 for cids in websocket_subscriptions.values() if client_id in cids)
+        
+        # Duplicates are dropped wherever the listener runs: here or in the broker
+        dedup = message_queues[client_id].get("dedup")
+        if dedup is not None and client_id not in broker_status:
+            duplicate_count = dedup.stats()["duplicates"]
+        else:
+            duplicate_count = broker_status.get(client_id, {}).get("duplicates", 0)
         
         connections[client_id] = {
             "project_id": project_id,
@@ -446,15 +664,20 @@ def get_connection_status():
             "connected": True,
             "message_count": message_count,
             "status_count": status_count,
-            "active_websockets": active_ws_count
+            "active_websockets": active_ws_count,
+            "duplicate_count": duplicate_count
         }
     
     # Add debug info
     debug_info = {
         "active_websocket_connections": len(active_connections),
         "tracked_websocket_connections": len(websocket_to_client),
+        "multiplexed_websocket_connections": len(websocket_subscriptions),
+        "websocket_writers": manager.stats(),
         "message_queue_count": len(message_queues),
-        "application_credentials": os.environ.get("GOOGLE_APPLICATION_CREDENTIALS", "Not set")
+        "application_credentials": os.environ.get("GOOGLE_APPLICATION_CREDENTIALS", "Not set"),
+        "worker_pid": os.getpid(),
+        "broker_address": broker.address if broker is not None else None
     }
     
     return {"connections": connections, "debug_info": debug_info}
@@ -462,7 +685,16 @@ def get_connection_status():
 @router.delete("/disconnect/{client_id}")
 def disconnect_from_pubsub(client_id: str):
     """Disconnect from a Pub/Sub subscription."""
-    if client_id in message_queues:
+    found = client_id in message_queues
+    
+    # Stop the shared subscription so the other workers close their sockets too
+    if broker is not None:
+        try:
+            found = "error" not in broker.unsubscribe(client_id) or found
+        except (EOFError, OSError) as e:
+            print(f"Error unsubscribing {client_id} from message broker: {str(e)}")
+    
+    if found:
         # Close all websockets associated with this client_id
         for ws, cid in list(websocket_to_client.items()):
             if cid == client_id:
@@ -474,18 +706,23 @@ def disconnect_from_pubsub(client_id: str):
                     active_connections.remove(ws)
                 del websocket_to_client[ws]
         
-        # Clean up queues
-        del message_queues[client_id]
+        # Stop the listener (stream, callback threads, client) and clean up queues
+        message_queues.pop(client_id, None)
+        subscription_manager.stop(client_id)
         return {"status": "disconnected", "client_id": client_id}
     else:
         raise HTTPException(status_code=404, detail="Client ID not found")
 
 @router.websocket("/ws/{client_id}")
-async def websocket_endpoint(websocket: WebSocket, client_id: str):
-    """WebSocket endpoint for receiving Pub/Sub messages in real-time."""
+async def websocket_endpoint(websocket: WebSocket, client_id: str, compact: bool = False):
+    """WebSocket endpoint for receiving Pub/Sub messages in real-time.
+    
+    With compact=true, message shapes include the fields changed since the last
+    message of the same shape.
+    """
     print(f"WebSocket connection attempt for client_id: {client_id}")
     
-    if client_id not in message_queues:
+    if not await run_in_threadpool(acquire_client_queues, client_id):
         print(f"Invalid client_id: {client_id}, available IDs: {list(message_queues.keys())}")
         await websocket.close(code=1008, reason="Invalid client ID")
         return
@@ -526,14 +763,14 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str):
                 break
             
             try:
-                # Non-blocking check for new messages
-                if not message_queues[client_id]["messages"].empty():
+                # Non-blocking check for new messages; queuing never waits on the client
+                while not message_queues[client_id]["messages"].empty():
                     message = message_queues[client_id]["messages"].get_nowait()
                     print(f"Sending message {message_count} to client {client_id}")
                     # Send the message with subscription information
-                    await manager.send_message({
+                    await manager.send_data(client_id, {
                         "type": "message", 
-                        "data": message,
+                        "data": shape_for_client(message, compact),
                         "subscription": subscription_info  # Include subscription details
                     }, websocket)
                     message_count += 1
@@ -566,6 +803,382 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str):
         # Also remove the association
         if websocket in websocket_to_client:
             del websocket_to_client[websocket]
+    finally:
+        await run_in_threadpool(release_client_queues, client_id)
+
+@router.get("/stats/{client_id}")
+def get_field_stats(client_id: str, top_k: int = 10):
+    """Get incremental per-field statistics for a subscription."""
+    # The statistics live wherever the listener runs
+    if broker is not None:
+        try:
+            snapshot = broker.field_stats(client_id, top_k)
+        except (EOFError, OSError) as e:
+            raise HTTPException(status_code=503, detail=f"Message broker unavailable: {str(e)}")
+        if snapshot is None:
+            raise HTTPException(status_code=404, detail="Client ID not found")
+    elif client_id in message_queues:
+        snapshot = message_queues[client_id]["stats"].snapshot(top_k)
+    else:
+        raise HTTPException(status_code=404, detail="Client ID not found")
+    
+    return {"client_id": client_id, **snapshot}
+
+@router.get("/query/{client_id}")
+def query_messages(
+    client_id: str,
+    where: List[str] = Query(default=[]),
+    group_by: List[str] = Query(default=[]),
+    limit: int = 100,
+    ids: int = 0
+):
+    """Filter, group and count the buffered messages of a subscription.
+    
+    Example: /api/query/{client_id}?where=amount>100&where=attributes.region=eu&group_by=type
+    """
+    if broker is not None:
+        try:
+            result = broker.query(client_id, where, group_by, limit, ids)
+        except (EOFError, OSError) as e:
+            raise HTTPException(status_code=503, detail=f"Message broker unavailable: {str(e)}")
+        if "error" in result:
+            raise HTTPException(status_code=result.get("code", 400), detail=result["error"])
+        return {"client_id": client_id, **result}
+    
+    if client_id not in message_queues:
+        raise HTTPException(status_code=404, detail="Client ID not found")
+    column_store = message_queues[client_id].get("columns")
+    if column_store is None:
+        raise HTTPException(status_code=400, detail="Query buffer is disabled (QUERY_BUFFER_SIZE=0)")
+    
+    try:
+        result = column_store.query(where, group_by, limit, ids)
+    except QueryError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"client_id": client_id, **result}
+
+@router.get("/query/{client_id}/fields")
+def get_query_fields(client_id: str):
+    """List the fields available for queries on a subscription's buffer."""
+    if broker is not None:
+        try:
+            result = broker.query_fields(client_id)
+        except (EOFError, OSError) as e:
+            raise HTTPException(status_code=503, detail=f"Message broker unavailable: {str(e)}")
+        if "error" in result:
+            raise HTTPException(status_code=result.get("code", 400), detail=result["error"])
+        return {"client_id": client_id, **result}
+    
+    if client_id not in message_queues:
+        raise HTTPException(status_code=404, detail="Client ID not found")
+    column_store = message_queues[client_id].get("columns")
+    if column_store is None:
+        raise HTTPException(status_code=400, detail="Query buffer is disabled (QUERY_BUFFER_SIZE=0)")
+    return {"client_id": client_id, **column_store.describe()}
+
+@router.get("/expand/{client_id}/{message_id}")
+def expand_message(
+    client_id: str,
+    message_id: str,
+    path: Optional[str] = None,
+    max_depth: Optional[int] = None,
+    max_items: Optional[int] = None,
+    max_string: Optional[int] = None
+):
+    """Summarise part of a truncated message, e.g. ?path=orders[2].items.
+    
+    The render limits apply from the chosen path down; any of them can be raised
+    for this request.
+    """
+    limits = RenderLimits()
+    for name, value in (("max_depth", max_depth), ("max_items", max_items), ("max_string", max_string)):
+        if value is not None:
+            setattr(limits, name, max(value, 0))
+    
+    if broker is not None:
+        try:
+            result = broker.expand(client_id, message_id, path, limits)
+        except (EOFError, OSError) as e:
+            raise HTTPException(status_code=503, detail=f"Message broker unavailable: {str(e)}")
+        if "error" in result:
+            raise HTTPException(status_code=result.get("code", 400), detail=result["error"])
+        return {"client_id": client_id, **result}
+    
+    if client_id not in message_queues:
+        raise HTTPException(status_code=404, detail="Client ID not found")
+    body_store = message_queues[client_id].get("bodies")
+    try:
+        result = expand_body(body_store, message_id, path, limits)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Message body is no longer available")
+    except PathError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"client_id": client_id, **result}
+
+@router.get("/shapes/{client_id}")
+def get_message_shapes(client_id: str):
+    """Count the messages of each structural shape seen on a subscription."""
+    if broker is not None:
+        try:
+            result = broker.shapes(client_id)
+        except (EOFError, OSError) as e:
+            raise HTTPException(status_code=503, detail=f"Message broker unavailable: {str(e)}")
+        if result is None:
+            raise HTTPException(status_code=404, detail="Client ID not found")
+        return {"client_id": client_id, **result}
+    
+    if client_id not in message_queues:
+        raise HTTPException(status_code=404, detail="Client ID not found")
+    tracker = message_queues[client_id]["shapes"]
+    return {"client_id": client_id, "messages": tracker.messages, "shapes": tracker.counts()}
+
+def get_subscription_info(client_id):
+    """Build the subscription details sent along with each message."""
+    project_id, subscription_id = client_id.split(":", 1)
+    return {
+        "client_id": client_id,
+        "project_id": project_id,
+        "subscription_id": subscription_id
+    }
+
+@router.websocket("/ws")
+async def multiplexed_websocket_endpoint(websocket: WebSocket):
+    """Single WebSocket per browser session carrying any number of subscriptions.
+    
+    The browser sends control frames to choose what it receives:
+        {"action": "subscribe", "client_id": "project:subscription"}
+        {"action": "unsubscribe", "client_id": "project:subscription"}
+        {"action": "compact", "enabled": true}
+    The last one (or ?compact=true) asks for the fields changed since the last
+    message of the same shape, for showing messages compactly. Every outgoing frame carries the client_id it belongs to. Subscriptions are
+    served round-robin, at most MUX_QUANTUM messages each per turn, so one busy
+    topic cannot starve the others.
+    """
+    await manager.connect(websocket)
+    active_connections.add(websocket)
+    subscribed = {}  # client_id -> subscription info, in round-robin order
+    websocket_subscriptions[websocket] = subscribed
+    options = {"compact": websocket.query_params.get("compact", "").lower() in ("1", "true")}
+    print("Multiplexed WebSocket connected")
+    
+    # Replies to control frames, sent by the main loop so only one task writes
+    replies = []
+    
+    async def receive_control_frames():
+        while True:
+            try:
+                frame = json.loads(await websocket.receive_text())
+            except json.JSONDecodeError:
+                frame = None
+            if not isinstance(frame, dict) or not isinstance(frame.get("client_id", ""), str):
+                replies.append({"type": "error", "detail": "Control frames must be JSON objects with an action and a client_id"})
+                continue
+            action = frame.get("action")
+            client_id = frame.get("client_id", "")
+            
+            if action == "subscribe":
+                if client_id in subscribed or await run_in_threadpool(acquire_client_queues, client_id):
+                    subscribed[client_id] = get_subscription_info(client_id)
+                    replies.append({"type": "subscribed", "client_id": client_id})
+                else:
+                    replies.append({"type": "error", "client_id": client_id, "detail": "Invalid client ID"})
+            elif action == "unsubscribe":
+                if subscribed.pop(client_id, None) is not None:
+                    await run_in_threadpool(release_client_queues, client_id)
+                replies.append({"type": "unsubscribed", "client_id": client_id})
+            elif action == "compact":
+                options["compact"] = bool(frame.get("enabled"))
+                replies.append({"type": "compact", "enabled": options["compact"]})
+            else:
+                replies.append({"type": "error", "detail": f"Unknown action: {action}"})
+    
+    receiver = asyncio.create_task(receive_control_frames())
+    try:
+        while not receiver.done():
+            sent = 0
+            while replies:
+                await manager.send_message(replies.pop(0), websocket)
+            
+            for client_id, subscription_info in list(subscribed.items()):
+                # Subscription disconnected externally (via API endpoint)
+                if client_id not in message_queues:
+                    subscribed.pop(client_id, None)
+                    await run_in_threadpool(release_client_queues, client_id)
+                    await manager.send_message({
+                        "type": "unsubscribed",
+                        "client_id": client_id,
+                        "reason": "Subscription disconnected"
+                    }, websocket)
+                    continue
+                
+                queues = message_queues[client_id]
+                while not queues["status"].empty():
+                    status = queues["status"].get_nowait()
+                    await manager.send_message({"type": "status", "client_id": client_id, "data": status}, websocket)
+                
+                for _ in range(MUX_QUANTUM):
+                    try:
+                        message = queues["messages"].get_nowait()
+                    except queue.Empty:
+                        break
+                    await manager.send_data(client_id, {
+                        "type": "message",
+                        "client_id": client_id,
+                        "data": shape_for_client(message, options["compact"]),
+                        "subscription": subscription_info
+                    }, websocket)
+                    sent += 1
+            
+            # Only sleep when every subscription is drained
+            await asyncio.sleep(0 if sent else 0.1)
+        
+        # Surface the receiver's exception (usually WebSocketDisconnect)
+        receiver.result()
+    except WebSocketDisconnect:
+        print("Multiplexed WebSocket disconnected")
+    except Exception as e:
+        print(f"Multiplexed WebSocket error: {str(e)}")
+        import traceback
+        traceback.print_exc()
+    finally:
+        receiver.cancel()
+        manager.disconnect(websocket)
+        active_connections.discard(websocket)
+        websocket_subscriptions.pop(websocket, None)
+        for client_id in list(subscribed):
+            await run_in_threadpool(release_client_queues, client_id)
+
+def format_sse(data, event=None, event_id=None):
+    """Format one Server-Sent Events frame."""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event is not None:
+        lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data)}")
+    return "\n".join(lines) + "\n\n"
+
+@router.get("/stream/{client_id}")
+async def stream_messages(client_id: str, request: Request, last_event_id: Optional[str] = None, compact: bool = False):
+    """Server-Sent Events stream of a subscription's messages.
+    
+    A fallback for networks where WebSockets are blocked. Each message event has
+    an ID; on reconnect the browser sends the last one it received in the
+    Last-Event-ID header (or the last_event_id query parameter), and the stream
+    replays what came after it before continuing with new messages. The replay
+    log is kept per worker, so resuming is only guaranteed with one worker.
+    With compact=true, message shapes include the fields changed since the last
+    message of the same shape.
+    """
+    if not await run_in_threadpool(acquire_client_queues, client_id):
+        raise HTTPException(status_code=404, detail="Client ID not found")
+    
+    queues = message_queues[client_id]
+    if "replay" not in queues:
+        queues["replay"] = ReplayLog()
+    replay = queues["replay"]
+    
+    resume_id = request.headers.get("last-event-id") or last_event_id
+    resume_from = replay.parse_id(resume_id)
+    if resume_id and resume_from is None:
+        # From an earlier log, or from another worker's log when running several
+        print(f"SSE stream for {client_id} cannot resume from {resume_id}, continuing with new messages")
+    subscription_info = get_subscription_info(client_id)
+    
+    async def events():
+        try:
+            async for event in stream_events():
+                yield event
+        finally:
+            # Runs when the browser goes away, which cancels the response
+            with anyio.CancelScope(shield=True):
+                await run_in_threadpool(release_client_queues, client_id)
+    
+    async def stream_events():
+        # Tell the browser how long to wait before reconnecting
+        yield "retry: 3000\n\n"
+        
+        if resume_from is not None:
+            missed, entries = replay.since(resume_from)
+            if missed:
+                yield format_sse({"client_id": client_id, "count": missed}, event="skipped")
+            for number, message in entries:
+                yield format_sse(
+                    {"client_id": client_id, "data": shape_for_client(message, compact), "subscription": subscription_info},
+                    event="message", event_id=replay.format_id(number)
+                )
+            print(f"SSE stream for {client_id} resumed after {resume_from}, replayed {len(entries)} messages")
+        
+        last_write = time.monotonic()
+        while not await request.is_disconnected():
+            # Subscription disconnected externally (via API endpoint)
+            if client_id not in message_queues:
+                yield format_sse({"client_id": client_id, "reason": "Subscription disconnected"}, event="closed")
+                break
+            
+            sent = 0
+            while not queues["status"].empty():
+                status = queues["status"].get_nowait()
+                yield format_sse({"client_id": client_id, "data": status}, event="status")
+                sent += 1
+            
+            for _ in range(MUX_QUANTUM):
+                try:
+                    message = queues["messages"].get_nowait()
+                except queue.Empty:
+                    break
+                number = replay.append(message)
+                yield format_sse(
+                    {"client_id": client_id, "data": shape_for_client(message, compact), "subscription": subscription_info},
+                    event="message", event_id=replay.format_id(number)
+                )
+                sent += 1
+            
+            if sent:
+                last_write = time.monotonic()
+            elif time.monotonic() - last_write >= SSE_KEEPALIVE_SECONDS:
+                # Comment line so proxies do not close an idle stream
+                yield ": keepalive\n\n"
+                last_write = time.monotonic()
+            
+            await asyncio.sleep(0 if sent else 0.1)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/peek/{project_id}/{subscription_id}")
+def peek_messages(project_id: str, subscription_id: str, max_messages: int = 100, concurrency: int = DEFAULT_PEEK_CONCURRENCY):
+    """Return up to max_messages from a subscription's backlog without consuming them.
+    
+    Messages are pulled in batches on several threads and handed back to the
+    subscription (ack deadline reset to zero) once the peek is done.
+    """
+    try:
+        messages, report = peek_subscription(project_id, subscription_id, max_messages, concurrency)
+    except Exception as e:
+        print(f"Error peeking at {project_id}:{subscription_id}: {str(e)}")
+        raise HTTPException(status_code=400, detail=f"Error peeking at subscription: {str(e)}")
+    
+    return {
+        "messages": [convert_to_json_serializable(message_to_dict(message)) for message in messages],
+        "subscription_info": get_subscription_info(f"{project_id}:{subscription_id}"),
+        "report": report
+    }
+
+@router.get("/resources")
+def get_resource_usage():
+    """Report live threads, streams and buffered memory per subscription."""
+    if broker is not None:
+        # The listeners run in the broker process
+        try:
+            listeners = broker.resources()
+        except (EOFError, OSError) as e:
+            raise HTTPException(status_code=503, detail=f"Message broker unavailable: {str(e)}")
+        return {"broker": listeners, "worker": subscription_manager.report(message_queues)}
+    return subscription_manager.report(message_queues)
 
 @router.get("/health")
 def health_check():
@@ -581,9 +1194,9 @@ def get_default_config():
     }
 
 @router.get("/messages/{client_id}")
-def get_messages(client_id: str, limit: int = 10):
+def get_messages(client_id: str, limit: int = 10, compact: bool = False):
     """Get recent messages for a client without using WebSocket."""
-    if client_id not in message_queues:
+    if not ensure_client_queues(client_id):
         raise HTTPException(status_code=404, detail="Client ID not found")
     
     # Parse subscription details from client_id
@@ -613,7 +1226,7 @@ def get_messages(client_id: str, limit: int = 10):
             message_queues[client_id]["messages"].put(temp_queue.get())
         
         return {
-            "messages": messages, 
+            "messages": [shape_for_client(message, compact) for message in messages], 
             "total_available": queue_size,
             "subscription_info": subscription_info  # Include subscription info
         }
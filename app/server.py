@@ -0,0 +1,48 @@
+"""
+Launcher for the web interface.
+
+A single worker runs with hot reloading, as before. With more than one worker,
+a broker process is started first so every Pub/Sub subscription is pulled
+once and shared by all workers (see ``app.broker``).
+"""
+
+import multiprocessing
+import os
+import shutil
+
+import uvicorn
+
+from app.broker import (
+    BROKER_ADDRESS_ENV,
+    BROKER_AUTHKEY_ENV,
+    broker_family,
+    new_broker_address,
+    run_broker,
+)
+
+
+def run_server(port, workers=1, host="0.0.0.0"):
+    """Run the FastAPI app with uvicorn using the given number of workers."""
+    if workers <= 1:
+        uvicorn.run("app.main:app", host=host, port=port, reload=True)
+        return
+
+    address = new_broker_address()
+    authkey = os.urandom(16)
+    broker_process = multiprocessing.Process(
+        target=run_broker, args=(address, authkey), name="pubsub-broker", daemon=True
+    )
+    broker_process.start()
+
+    # Workers inherit the environment and connect to the broker on first use
+    os.environ[BROKER_ADDRESS_ENV] = address
+    os.environ[BROKER_AUTHKEY_ENV] = authkey.hex()
+
+    print(f"Started message broker (pid {broker_process.pid}) for {workers} workers")
+    try:
+        uvicorn.run("app.main:app", host=host, port=port, workers=workers)
+    finally:
+        broker_process.terminate()
+        broker_process.join(timeout=5)
+        if broker_family() == "AF_UNIX":
+            shutil.rmtree(os.path.dirname(address), ignore_errors=True)
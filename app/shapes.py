@@ -0,0 +1,195 @@
+"""
+Structural fingerprints of messages, for collapsing repetitive output.
+
+On busy topics most messages share a handful of shapes (the same keys, nested
+the same way) and differ only in a few values. ``ShapeTracker`` gives every
+message the ID of its shape and remembers the last message of each shape, so
+compact output can show just the fields that changed since then:
+
+- the shape is the nested key structure of the data, plus the attribute names;
+  array lengths and values do not matter
+- the ID is a short hash, computed once per distinct structure and then looked
+  up; at most ``max_shapes`` shapes are remembered (least recently seen first
+  out)
+- the first message of a shape is reported as new, so unusual messages still
+  stand out in compact mode
+- only a fingerprint (a hash) of each field of the last message is kept, and
+  messages with more than ``SHAPE_MAX_FIELDS`` fields are counted but not
+  compared, so a shape costs little memory however large its messages are
+- flat messages are looked up by their top-level keys, without building the
+  nested structure; other structures are hashed once per message
+
+Fields are named by paths such as ``order.items[0].sku``; attributes are
+prefixed with ``@``.
+"""
+
+import os
+import threading
+import zlib
+from collections import OrderedDict
+
+from app.render import RenderLimits, summarize
+
+DEFAULT_SHAPE_CACHE_SIZE = int(os.environ.get("SHAPE_CACHE_SIZE", "1000"))
+# Messages with more fields than this are not compared with the last one
+DEFAULT_SHAPE_MAX_FIELDS = int(os.environ.get("SHAPE_MAX_FIELDS", "500"))
+
+# Sample keys reported per shape
+SHAPE_SAMPLE_KEYS = 8
+
+
+def structure(value):
+    """Hashable key structure of a JSON value; list items are assumed alike."""
+    if isinstance(value, dict):
+        return tuple(sorted((key, structure(item)) for key, item in value.items()))
+    if isinstance(value, list):
+        return ("[]", structure(value[0]) if value else None)
+    return None
+
+
+def flatten(value, prefix="", into=None, limit=None):
+    """Map each leaf path of a JSON value to its value, stopping after ``limit`` paths."""
+    into = {} if into is None else into
+    if isinstance(value, dict) and value:
+        for key, item in value.items():
+            if limit is not None and len(into) >= limit:
+                break
+            flatten(item, f"{prefix}.{key}" if prefix else str(key), into, limit)
+    elif isinstance(value, list) and value:
+        for index, item in enumerate(value):
+            if limit is not None and len(into) >= limit:
+                break
+            flatten(item, f"{prefix}[{index}]", into, limit)
+    else:
+        into[prefix] = value
+    return into
+
+
+def fingerprint(value):
+    """Hash of a leaf value, telling apart equal values of different types (1 and True)."""
+    if isinstance(value, (dict, list)):
+        # Only empty containers are leaves
+        return type(value).__name__
+    return hash((type(value).__name__, value))
+
+
+class _StructureKey:
+    """A structure with its hash computed once, for repeated dict lookups."""
+
+    __slots__ = ("value", "hash")
+
+    def __init__(self, value):
+        self.value = value
+        self.hash = hash(value)
+
+    def __hash__(self):
+        return self.hash
+
+    def __eq__(self, other):
+        return self.hash == other.hash and self.value == other.value
+
+
+class _Shape:
+    def __init__(self, shape_id, keys):
+        self.id = shape_id
+        self.keys = keys
+        self.count = 0
+        # Field path -> fingerprint for the last message compared
+        self.last = None
+
+
+class ShapeTracker:
+    """Thread-safe registry of message shapes and the last message of each."""
+
+    def __init__(self, max_shapes=DEFAULT_SHAPE_CACHE_SIZE, max_fields=DEFAULT_SHAPE_MAX_FIELDS):
+        self.max_shapes = max(max_shapes, 1)
+        self.max_fields = max(max_fields, 1)
+        self.messages = 0
+        self._shapes = OrderedDict()
+        # (top-level keys, attribute names) -> key, for messages without nesting
+        self._flat_keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, data, names):
+        """The shape key of a message; cached for flat messages, built otherwise."""
+        flat = isinstance(data, dict) and not any(isinstance(item, (dict, list)) for item in data.values())
+        if not flat:
+            return _StructureKey((structure(data), names))
+        pre_key = (tuple(data), names)
+        with self._lock:
+            key = self._flat_keys.get(pre_key)
+            if key is not None:
+                self._flat_keys.move_to_end(pre_key)
+                return key
+        key = _StructureKey((structure(data), names))
+        with self._lock:
+            self._flat_keys[pre_key] = key
+            if len(self._flat_keys) > self.max_shapes:
+                self._flat_keys.popitem(last=False)
+        return key
+
+    def observe(self, data, attributes=None):
+        """Record a message and compare it with the last one of its shape.
+
+        Returns a dict with the shape ``id``, its message ``count``, whether the
+        shape is ``new`` and, for shapes seen before, the ``changes`` as a list
+        of ``[path, value]`` pairs and the ``removed`` paths. Messages with more
+        than ``max_fields`` fields get no ``changes``.
+        """
+        attributes = attributes or {}
+        key = self._key(data, tuple(sorted(attributes)))
+        fields = flatten(data, limit=self.max_fields + 1)
+        for name, value in attributes.items():
+            fields[f"@{name}"] = value
+        compared = len(fields) <= self.max_fields
+        fingerprints = {path: fingerprint(value) for path, value in fields.items()} if compared else {}
+
+        with self._lock:
+            self.messages += 1
+            shape = self._shapes.get(key)
+            if shape is None:
+                # Only a label: shapes are told apart by their structure, not by this ID
+                shape_id = format(zlib.crc32(repr(key.value).encode()), "08x")
+                keys = list(data)[:SHAPE_SAMPLE_KEYS] if isinstance(data, dict) else []
+                shape = self._shapes[key] = _Shape(shape_id, keys)
+                if len(self._shapes) > self.max_shapes:
+                    self._shapes.popitem(last=False)
+            else:
+                self._shapes.move_to_end(key)
+            shape.count += 1
+            new = shape.count == 1
+            previous, shape.last = shape.last, fingerprints if compared else None
+            result = {"id": shape.id, "count": shape.count, "new": new}
+
+        if not new and compared and previous is not None:
+            result["changes"] = [[path, fields[path]] for path, value in fingerprints.items()
+                                 if previous.get(path) != value]
+            result["removed"] = [path for path in previous if path not in fingerprints]
+        return result
+
+    def counts(self):
+        """Shapes with their message counts, most frequent first."""
+        with self._lock:
+            shapes = [
+                {"id": shape.id, "count": shape.count, "keys": shape.keys}
+                for shape in self._shapes.values()
+            ]
+        return sorted(shapes, key=lambda shape: shape["count"], reverse=True)
+
+
+def limit_changes(shape, limits=None):
+    """Cut the changes of an ``observe`` result down to the render limits, in place.
+
+    Shapes are tracked on whole messages, so a changed field can hold a large
+    value: each value is summarised, at most ``max_items`` changes are kept and
+    the number left out is reported as ``more_changes``.
+    """
+    changes = shape.get("changes")
+    if not changes:
+        return shape
+    limits = limits or RenderLimits()
+    if len(changes) > limits.max_items:
+        shape["more_changes"] = len(changes) - limits.max_items
+        changes = changes[:limits.max_items]
+    shape["changes"] = [[path, summarize(value, limits)[0]] for path, value in changes]
+    return shape
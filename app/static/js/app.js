@@ -19,10 +19,16 @@ const app = createApp({
             subscription_id: ''
         });
         const messages = ref([]);
+        // Index of displayed messages for O(1) duplicate checks across transports,
+        // keyed by client_id and message ID since IDs are only unique per subscription
+        const messageIds = new Set();
+        const messageKey = (message, subscription) =>
+            `${subscription ? subscription.client_id : ''}:${message.message_id}`;
+        // Messages the server did not send because this page fell behind
+        const skippedMessages = ref(0);
         const expandedMessages = ref({});
         const isConnecting = ref(false);
         const connectionError = ref('');
-        const socketInstances = ref({});  // Map of client_id to WebSocket instance
         const activeSubscriptions = ref([]); // Array of subscription objects
         const autoScroll = ref(true);
         const pauseMessages = ref(false);
@@ -31,6 +37,13 @@ const app = createApp({
         const sidebarVisible = ref(true);
         const messagesContainer = ref(null);
         const jsonEditors = ref({});
+        // Paths typed for messages the server shortened, and the part shown for each
+        const expandPaths = ref({});
+        const expandedParts = ref({});
+        // Compact mode shows only the fields that changed since the last message of the same shape
+        const compactMode = ref(localStorage.getItem('compactMode') === 'true');
+        // client_id -> shape id -> messages of that shape (as counted by the server)
+        const shapeCounts = ref({});
         const currentMessageIndex = ref(0);
         const darkMode = ref(false);
         
@@ -531,11 +544,9 @@ const app = createApp({
                     
                     showToast('Connected', 'Successfully connected to Pub/Sub', 'fa-check-circle');
                     
-                    // Try WebSocket first
-                    initWebSocket(client_id, subscription);
-                    
-                    // Also start polling as a fallback
-                    startMessagePolling(client_id, subscription);
+                    // Receive over the shared WebSocket, streaming over SSE if it does not confirm
+                    subscribeOverSocket(client_id);
+                    scheduleFallbackStream(client_id, subscription);
                     
                     // Hide the form after successful connection
                     showNewSubscriptionForm.value = false;
@@ -563,11 +574,10 @@ const app = createApp({
 
         const disconnectSubscription = async (client_id) => {
             try {
-                // Close WebSocket if it exists
-                if (socketInstances.value[client_id]) {
-                    socketInstances.value[client_id].close();
-                    delete socketInstances.value[client_id];
-                }
+                // Stop receiving this subscription on the shared WebSocket
+                sendControlFrame('unsubscribe', client_id);
+                socketSubscribed.delete(client_id);
+                stopFallbackStream(client_id);
                 
                 // Call the disconnect API
                 const response = await fetch(`/api/disconnect/${client_id}`, {
@@ -593,121 +603,222 @@ const app = createApp({
             }
         };
 
-        const initWebSocket = (client_id, subscription) => {
-            if (socketInstances.value[client_id]) {
-                console.log(`Closing existing WebSocket connection for ${client_id}`);
-                socketInstances.value[client_id].close();
+        // Single multiplexed WebSocket shared by all subscriptions of this page
+        let sessionSocket = null;
+        let sessionReconnectTimer = null;
+        const socketSubscribed = new Set();  // client_ids confirmed by the server on the socket
+        
+        const sendControlFrame = (action, client_id) => {
+            if (sessionSocket && sessionSocket.readyState === WebSocket.OPEN) {
+                sessionSocket.send(JSON.stringify({ action, client_id }));
+                return true;
+            }
+            return false;
+        };
+        
+        const findSubscription = (client_id) => {
+            return activeSubscriptions.value.find(sub => sub.client_id === client_id);
+        };
+        
+        const initSessionSocket = () => {
+            if (sessionSocket && sessionSocket.readyState <= WebSocket.OPEN) {
+                return;  // Already connecting or connected
             }
             
             const wsProtocol = window.location.protocol === 'https:' ? 'wss' : 'ws';
-            const wsUrl = `${wsProtocol}://${window.location.host}/api/ws/${client_id}`;
+            const wsUrl = `${wsProtocol}://${window.location.host}/api/ws`;
             console.log(`Connecting to WebSocket URL: ${wsUrl}`);
             
             const socket = new WebSocket(wsUrl);
+            sessionSocket = socket;
             
             socket.onopen = () => {
-                console.log(`WebSocket connected successfully for ${client_id}`);
+                console.log('Session WebSocket connected');
                 connectionError.value = ''; // Clear any previous error
                 
-                // Update subscription status
-                const index = activeSubscriptions.value.findIndex(sub => sub.client_id === client_id);
-                if (index !== -1) {
-                    activeSubscriptions.value[index].connected = true;
+                // Shape changes are only sent to pages showing compact messages
+                if (compactMode.value) {
+                    socket.send(JSON.stringify({ action: 'compact', enabled: true }));
                 }
-                
-                showToast('WebSocket Connected', 'Successfully established WebSocket connection', 'fa-check-circle');
-                
-                // WebSocket is working, we can stop the polling fallback
-                stopMessagePolling(client_id);
+                // (Re)subscribe everything this page is showing
+                activeSubscriptions.value.forEach(sub => sendControlFrame('subscribe', sub.client_id));
             };
             
             socket.onmessage = (event) => {
                 try {
                     const data = JSON.parse(event.data);
+                    const client_id = data.client_id;
+                    const sub = client_id ? findSubscription(client_id) : null;
                     
                     if (data.type === 'message') {
-                        console.log(`Received Pub/Sub message for ${client_id}:`, data.data);
                         if (!pauseMessages.value) {
                             // Use the subscription info sent from the backend if available
-                            const messageSubscription = data.subscription || subscription;
-                            addMessage(data.data, messageSubscription);
-                        } else {
-                            console.log('Message paused, not displaying');
+                            addMessage(data.data, data.subscription || sub);
+                        }
+                    } else if (data.type === 'skipped') {
+                        console.warn(`Server skipped ${data.count} messages for ${client_id}, page is falling behind`);
+                        skippedMessages.value += data.count;
+                    } else if (data.type === 'subscribed') {
+                        console.log(`WebSocket subscribed to ${client_id}`);
+                        socketSubscribed.add(client_id);
+                        if (sub) {
+                            sub.connected = true;
+                            delete sub.error;
+                        }
+                        // WebSocket is working, we can stop the SSE fallback
+                        stopFallbackStream(client_id);
+                    } else if (data.type === 'unsubscribed') {
+                        console.log(`WebSocket unsubscribed from ${client_id}`, data.reason || '');
+                        socketSubscribed.delete(client_id);
+                        if (sub && data.reason) {
+                            sub.connected = false;
+                            sub.error = data.reason;
                         }
                     } else if (data.type === 'status') {
-                        console.log(`Received status update for ${client_id}:`, data.data);
-                        
-                        // Update subscription status based on received status
-                        const index = activeSubscriptions.value.findIndex(sub => sub.client_id === client_id);
-                        
-                        if (data.data.error) {
-                            console.error(`Status contains error for ${client_id}:`, data.data.error);
-                            if (index !== -1) {
-                                activeSubscriptions.value[index].connected = false;
-                                activeSubscriptions.value[index].error = data.data.error;
-                            }
-                            showToast('Connection Error', data.data.error, 'fa-exclamation-circle');
-                        } else if (data.data.status === 'connected') {
-                            console.log(`Status confirms connection for ${client_id}`);
-                            if (index !== -1) {
-                                activeSubscriptions.value[index].connected = true;
-                                delete activeSubscriptions.value[index].error;
-                            }
+                        applyStatus(client_id, data.data);
+                    } else if (data.type === 'error') {
+                        console.error(`WebSocket error frame for ${client_id}:`, data.detail);
+                        if (sub) {
+                            sub.error = data.detail;
                         }
                     }
                 } catch (error) {
-                    console.error(`Error processing WebSocket message for ${client_id}:`, error, event.data);
+                    console.error('Error processing WebSocket message:', error, event.data);
                 }
             };
             
             socket.onclose = (event) => {
-                console.log(`WebSocket disconnected for ${client_id}:`, event.code, event.reason);
-                
-                // Update subscription status
-                const index = activeSubscriptions.value.findIndex(sub => sub.client_id === client_id);
-                if (index !== -1) {
-                    activeSubscriptions.value[index].connected = false;
+                console.log('Session WebSocket disconnected:', event.code, event.reason);
+                if (sessionSocket === socket) {
+                    sessionSocket = null;
                 }
+                socketSubscribed.clear();
                 
-                // Only show notification if it was not a clean disconnect (e.g. user-initiated)
-                if (event.code !== 1000) {
+                activeSubscriptions.value.forEach(sub => {
+                    sub.connected = false;
+                });
+                
+                // Reconnect and fall back to SSE while subscriptions are still open
+                if (event.code !== 1000 && activeSubscriptions.value.length > 0) {
                     showToast('Disconnected', `Connection to Pub/Sub was closed: ${event.reason || 'Unknown reason'}`, 'fa-times-circle');
-                    // Try to reconnect after a brief delay
-                    setTimeout(() => retryConnection(client_id, subscription), 3000);
+                    activeSubscriptions.value.forEach(sub => startFallbackStream(sub.client_id, sub));
+                    clearTimeout(sessionReconnectTimer);
+                    sessionReconnectTimer = setTimeout(initSessionSocket, 3000);
                 }
             };
             
             socket.onerror = (error) => {
-                console.error(`WebSocket error for ${client_id}:`, error);
-                
-                // Update subscription status
-                const index = activeSubscriptions.value.findIndex(sub => sub.client_id === client_id);
-                if (index !== -1) {
-                    activeSubscriptions.value[index].error = 'WebSocket connection error';
-                }
-                
-                // We don't set connected to false here as onclose will be called anyway
+                console.error('Session WebSocket error:', error);
+                // onclose will be called next and takes care of reconnecting
                 showToast('WebSocket Error', 'Error in WebSocket connection, will retry automatically', 'fa-exclamation-circle');
             };
-            
-            socketInstances.value[client_id] = socket;
         };
         
-        const retryConnection = (client_id, subscription) => {
-            console.log(`Attempting to reconnect WebSocket for ${client_id}...`);
+        // Update a subscription from a status update received on any transport
+        const applyStatus = (client_id, status) => {
+            console.log(`Received status update for ${client_id}:`, status);
+            const sub = findSubscription(client_id);
             
-            const index = activeSubscriptions.value.findIndex(sub => sub.client_id === client_id);
-            if (index !== -1 && !activeSubscriptions.value[index].connected) {
-                initWebSocket(client_id, subscription);
-                // Also poll for messages as a fallback
+            if (status.error) {
+                console.error(`Status contains error for ${client_id}:`, status.error);
+                if (sub) {
+                    sub.connected = false;
+                    sub.error = status.error;
+                }
+                showToast('Connection Error', status.error, 'fa-exclamation-circle');
+            } else if (status.status === 'connected' && sub) {
+                sub.connected = true;
+                delete sub.error;
+            }
+        };
+        
+        const subscribeOverSocket = (client_id) => {
+            // If the socket is not open yet, onopen subscribes all active subscriptions
+            if (!sendControlFrame('subscribe', client_id)) {
+                initSessionSocket();
+            }
+        };
+
+        // Server-Sent Events fallback for networks where WebSockets are blocked
+        const eventSources = {};  // Map of client_id to EventSource
+        const lastEventIds = {};  // Map of client_id to the last SSE event ID received
+        const fallbackTimers = {};
+        
+        // Give the WebSocket a few seconds to confirm before streaming over SSE
+        const scheduleFallbackStream = (client_id, subscription) => {
+            clearTimeout(fallbackTimers[client_id]);
+            fallbackTimers[client_id] = setTimeout(() => {
+                delete fallbackTimers[client_id];
+                if (findSubscription(client_id) && !socketSubscribed.has(client_id)) {
+                    startFallbackStream(client_id, subscription);
+                }
+            }, 3000);
+        };
+        
+        const startFallbackStream = (client_id, subscription) => {
+            if (!window.EventSource) {
                 startMessagePolling(client_id, subscription);
+                return;
+            }
+            if (eventSources[client_id]) return;
+            
+            // Resume after the last event seen, even across separate fallback periods
+            const params = new URLSearchParams();
+            if (lastEventIds[client_id]) {
+                params.set('last_event_id', lastEventIds[client_id]);
+            }
+            if (compactMode.value) {
+                params.set('compact', 'true');
+            }
+            const url = params.toString() ? `/api/stream/${client_id}?${params}` : `/api/stream/${client_id}`;
+            console.log(`Starting SSE fallback stream for ${client_id}`);
+            
+            const source = new EventSource(url);
+            eventSources[client_id] = source;
+            
+            source.addEventListener('message', (event) => {
+                // The browser resends this as Last-Event-ID when it reconnects by itself
+                lastEventIds[client_id] = event.lastEventId;
+                const data = JSON.parse(event.data);
+                if (!pauseMessages.value) {
+                    addMessage(data.data, data.subscription || subscription);
+                }
+            });
+            source.addEventListener('status', (event) => {
+                const data = JSON.parse(event.data);
+                applyStatus(client_id, data.data);
+            });
+            source.addEventListener('skipped', (event) => {
+                const data = JSON.parse(event.data);
+                console.warn(`SSE stream missed ${data.count} messages for ${client_id}`);
+                skippedMessages.value += data.count;
+            });
+            source.addEventListener('closed', () => {
+                stopFallbackStream(client_id);
+            });
+            source.onerror = () => {
+                // EventSource reconnects on its own unless the server refused the stream
+                if (source.readyState === EventSource.CLOSED) {
+                    console.error(`SSE stream for ${client_id} was refused`);
+                    delete eventSources[client_id];
+                }
+            };
+        };
+        
+        const stopFallbackStream = (client_id) => {
+            clearTimeout(fallbackTimers[client_id]);
+            delete fallbackTimers[client_id];
+            if (eventSources[client_id]) {
+                console.log(`Stopping SSE fallback stream for ${client_id}`);
+                eventSources[client_id].close();
+                delete eventSources[client_id];
             }
+            stopMessagePolling(client_id);
         };
 
-        // Map of client_id to polling interval
+        // Polling is only used by browsers without EventSource support
         const pollingIntervals = {};
         
-        // Fallback polling for messages if WebSocket fails
         const startMessagePolling = async (client_id, subscription) => {
             if (pollingIntervals[client_id]) clearInterval(pollingIntervals[client_id]);
             
@@ -716,7 +827,7 @@ const app = createApp({
             // Poll every 2 seconds
             pollingIntervals[client_id] = setInterval(async () => {
                 try {
-                    const response = await fetch(`/api/messages/${client_id}`);
+                    const response = await fetch(`/api/messages/${client_id}?compact=${compactMode.value}`);
                     const data = await response.json();
                     
                     // Process messages if available
@@ -730,18 +841,10 @@ const app = createApp({
                             subscription_id: client_id.split(":")[1]
                         };
                         
-                        // Only display if not paused
+                        // Only display if not paused; addMessage skips IDs already shown
                         if (!pauseMessages.value) {
                             data.messages.forEach(message => {
-                                // Check if we already have this message by ID
-                                const messageId = message.message_id;
-                                const exists = messages.value.some(m => 
-                                    m.data && m.data.message_id === messageId
-                                );
-                                
-                                if (!exists) {
-                                    addMessage(message, subscriptionInfo);
-                                }
+                                addMessage(message, subscriptionInfo);
                             });
                         }
                     }
@@ -760,6 +863,15 @@ const app = createApp({
         };
 
         const addMessage = (message, subscription = null) => {
+            // Skip messages already shown, e.g. delivered by both WebSocket and polling
+            if (message.message_id) {
+                const key = messageKey(message, subscription);
+                if (messageIds.has(key)) {
+                    return;
+                }
+                messageIds.add(key);
+            }
+            
             // Ensure we're using the correct subscription for this message
             // The subscription should come from the client_id that received the message
             let messageSubscription = subscription;
@@ -771,6 +883,11 @@ const app = createApp({
                 subscription: messageSubscription // Use the correct subscription information
             };
             
+            if (message.shape && messageSubscription) {
+                const counts = shapeCounts.value[messageSubscription.client_id] || (shapeCounts.value[messageSubscription.client_id] = {});
+                counts[message.shape.id] = Math.max(counts[message.shape.id] || 0, message.shape.count);
+            }
+            
             // Add message to the beginning of the array
             messages.value.unshift(newMessage);
             
@@ -783,6 +900,7 @@ const app = createApp({
                 // Also remove the editor if it exists
                 const removed = messages.value.splice(maxMessages.value);
                 removed.forEach(msg => {
+                    messageIds.delete(messageKey(msg.data, msg.subscription));
                     // Find the global index for this message
                     for (let i = 0; i < finalFilteredMessages.value.length; i++) {
                         if (finalFilteredMessages.value[i].data.message_id === msg.data.message_id) {
@@ -797,9 +915,11 @@ const app = createApp({
             }
             
             // Initialize JSON editor for the new message after DOM update
-            nextTick(() => {
-                initJsonEditor(index, message.data);
-            });
+            if (!isCompact(newMessage)) {
+                nextTick(() => {
+                    initJsonEditor(index, message.data);
+                });
+            }
             
             // Auto-scroll if enabled
             if (autoScroll.value) {
@@ -820,6 +940,11 @@ const app = createApp({
             });
             
             messages.value = [];
+            messageIds.clear();
+            skippedMessages.value = 0;
+            expandPaths.value = {};
+            expandedParts.value = {};
+            shapeCounts.value = {};
             expandedMessages.value = {};
             jsonEditors.value = {};
         };
@@ -942,6 +1067,83 @@ const app = createApp({
             }
         };
 
+        // Messages of an already seen shape are shown as their changed fields only
+        // (messages received before compact mode was turned on have no changes to show)
+        const isCompact = (msg) => compactMode.value && !!msg.data.shape && !msg.data.shape.new && !!msg.data.shape.changes;
+
+        const formatChangeValue = (value) => {
+            return typeof value === 'string' || typeof value === 'object' ? JSON.stringify(value) : String(value);
+        };
+
+        // Most frequent shapes across subscriptions, for the sidebar
+        const shapeSummary = computed(() => {
+            const rows = [];
+            Object.entries(shapeCounts.value).forEach(([client_id, counts]) => {
+                Object.entries(counts).forEach(([id, count]) => rows.push({ client_id, id, count }));
+            });
+            return rows.sort((a, b) => b.count - a.count).slice(0, 10);
+        });
+
+        watch(compactMode, (enabled) => {
+            localStorage.setItem('compactMode', enabled ? 'true' : 'false');
+            // Ask the server to start (or stop) sending the changed fields
+            if (sessionSocket && sessionSocket.readyState === WebSocket.OPEN) {
+                sessionSocket.send(JSON.stringify({ action: 'compact', enabled }));
+            }
+            Object.keys(eventSources).forEach(client_id => {
+                const sub = findSubscription(client_id);
+                stopFallbackStream(client_id);
+                if (sub) startFallbackStream(client_id, sub);
+            });
+            if (enabled) return;
+            // Full cards are back: give them their JSON editors
+            nextTick(() => {
+                finalFilteredMessages.value.forEach((msg, index) => {
+                    const container = document.getElementById(`json-${index}`);
+                    if (container && container.childElementCount === 0) {
+                        initJsonEditor(index, msg.data.data);
+                    }
+                });
+            });
+        });
+
+        const formatSize = (bytes) => {
+            if (bytes >= 1024 * 1024) return `${(bytes / (1024 * 1024)).toFixed(1)} MB`;
+            if (bytes >= 1024) return `${(bytes / 1024).toFixed(1)} KB`;
+            return `${bytes} B`;
+        };
+
+        // Fetch one part of a shortened message (e.g. "orders[2].items") and show it
+        const expandMessagePart = async (client_id, msg, index) => {
+            const message_id = msg.data.message_id;
+            const path = (expandPaths.value[message_id] || '').trim();
+            try {
+                const response = await fetch(`/api/expand/${encodeURIComponent(client_id)}/${encodeURIComponent(message_id)}?path=${encodeURIComponent(path)}`);
+                const result = await response.json();
+                if (!response.ok) {
+                    showToast('Error', result.detail || 'Failed to expand message', 'fa-exclamation-circle');
+                    return;
+                }
+                expandedParts.value[message_id] = path;
+                if (jsonEditors.value[index]) {
+                    jsonEditors.value[index].set(result.data);
+                } else {
+                    initJsonEditor(index, result.data);
+                }
+            } catch (error) {
+                console.error('Error expanding message:', error);
+            }
+        };
+
+        const showMessageSummary = (msg, index) => {
+            delete expandedParts.value[msg.data.message_id];
+            if (jsonEditors.value[index]) {
+                jsonEditors.value[index].set(msg.data.data);
+            } else {
+                initJsonEditor(index, msg.data.data);
+            }
+        };
+
         const copyMessageToClipboard = (msg) => {
             try {
                 const jsonStr = JSON.stringify(msg.data, null, 2);
@@ -1041,6 +1243,59 @@ const app = createApp({
         // Add subscription filter feature
         const selectedSubscription = ref(null);
         
+        // Field statistics panel
+        const showStatsPanel = ref(false);
+        const statsClientId = ref('');
+        const fieldStats = ref(null);
+        const loadingStats = ref(false);
+        let statsInterval = null;
+        
+        const fetchFieldStats = async () => {
+            if (!statsClientId.value) {
+                fieldStats.value = null;
+                return;
+            }
+            
+            loadingStats.value = true;
+            try {
+                const response = await fetch(`/api/stats/${statsClientId.value}`);
+                const data = await response.json();
+                if (response.ok) {
+                    fieldStats.value = data;
+                } else {
+                    fieldStats.value = null;
+                    showToast('Error', data.detail || 'Failed to load field statistics', 'fa-exclamation-circle');
+                }
+            } catch (error) {
+                console.error('Error fetching field statistics:', error);
+            } finally {
+                loadingStats.value = false;
+            }
+        };
+        
+        const toggleStatsPanel = () => {
+            showStatsPanel.value = !showStatsPanel.value;
+        };
+        
+        // Refresh the statistics every 5 seconds while the panel is open
+        watch(showStatsPanel, (visible) => {
+            clearInterval(statsInterval);
+            statsInterval = null;
+            if (visible) {
+                if (!statsClientId.value && activeSubscriptions.value.length > 0) {
+                    statsClientId.value = activeSubscriptions.value[0].client_id;
+                }
+                fetchFieldStats();
+                statsInterval = setInterval(fetchFieldStats, 5000);
+            }
+        });
+        watch(statsClientId, fetchFieldStats);
+        
+        const formatStatNumber = (value) => {
+            if (value === null || value === undefined) return '';
+            return Number.isInteger(value) ? value.toString() : Number(value).toPrecision(4);
+        };
+        
         // Filtered messages by both text filter and subscription filter
         const finalFilteredMessages = computed(() => {
             // First apply text filter
@@ -1233,6 +1488,7 @@ const app = createApp({
         return {
             config,
             messages,
+            skippedMessages,
             isConnecting,
             connectionError,
             autoScroll,
@@ -1274,6 +1530,14 @@ const app = createApp({
             loadingTopics,
             selectedTopicIndex,
             selectedSubscription,
+            // Field statistics panel
+            showStatsPanel,
+            statsClientId,
+            fieldStats,
+            loadingStats,
+            fetchFieldStats,
+            toggleStatsPanel,
+            formatStatNumber,
             // Autocomplete state
             projects,
             subscriptions,
@@ -1292,6 +1556,15 @@ const app = createApp({
             getMessageType,
             formatTimestamp,
             copyMessageToClipboard,
+            expandPaths,
+            expandedParts,
+            compactMode,
+            shapeSummary,
+            isCompact,
+            formatChangeValue,
+            expandMessagePart,
+            showMessageSummary,
+            formatSize,
             toggleSidebar,
             showToast,
             hideToast,
@@ -0,0 +1,297 @@
+"""
+Incremental per-field statistics for a subscription.
+
+Every JSON field path in the message data (``customer.id``, ``items[].amount``)
+and every attribute (``attributes.region``) gets a ``FieldStats`` holding
+fixed-size streaming sketches:
+
+- ``HyperLogLog`` for the number of distinct values
+- ``TopK`` (Space-Saving) for the most frequent values
+- ``QuantileSketch`` (a compact KLL sketch) for numeric quantiles
+- plain counters for the null rate
+
+Memory is bounded per field, and the number of tracked paths is capped. Stats
+cover a sliding window made of two generations: the current one and the
+previous one, rotated every ``window_seconds``.
+"""
+
+import hashlib
+import math
+import os
+import random
+import threading
+import time
+
+DEFAULT_STATS_MAX_FIELDS = int(os.environ.get("STATS_MAX_FIELDS", "200"))
+DEFAULT_STATS_WINDOW_SECONDS = float(os.environ.get("STATS_WINDOW_SECONDS", "300"))
+
+# Deeper paths than this are not tracked individually
+MAX_PATH_DEPTH = 8
+
+# Longer values are truncated before they are counted as top values
+MAX_TOP_VALUE_LENGTH = 200
+
+
+def _hash64(value):
+    """Stable 64-bit hash of a value's string form."""
+    return int.from_bytes(hashlib.blake2b(str(value).encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HyperLogLog:
+    """Distinct-count estimator using 2**precision one-byte registers."""
+
+    def __init__(self, precision=10):
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(self.size)
+
+    def add(self, value):
+        h = _hash64(value)
+        index = h >> (64 - self.precision)
+        rest = h & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+
+    def count(self):
+        alpha = 0.7213 / (1 + 1.079 / self.size)
+        estimate = alpha * self.size * self.size / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.size and zeros:
+            # Linear counting is more accurate for small cardinalities
+            estimate = self.size * math.log(self.size / zeros)
+        return int(round(estimate))
+
+
+class TopK:
+    """Space-Saving heavy hitters with a fixed number of counters."""
+
+    def __init__(self, capacity=32):
+        self.capacity = capacity
+        self.counters = {}
+
+    def add(self, value, count=1):
+        if value in self.counters:
+            self.counters[value] += count
+        elif len(self.counters) < self.capacity:
+            self.counters[value] = count
+        else:
+            # Replace the smallest counter; the newcomer inherits its count
+            smallest = min(self.counters, key=self.counters.get)
+            self.counters[value] = self.counters.pop(smallest) + count
+
+    def merge(self, other):
+        for value, count in other.counters.items():
+            self.add(value, count)
+
+    def top(self, k=10):
+        return sorted(self.counters.items(), key=lambda item: item[1], reverse=True)[:k]
+
+
+class QuantileSketch:
+    """KLL-style quantile sketch.
+
+    Values are buffered in levels; when a level fills up it is sorted and every
+    other item (from a random offset) is promoted to the next level, where each
+    item stands for twice as many values.
+    """
+
+    def __init__(self, k=128):
+        self.k = k
+        self.levels = [[]]
+        self.count = 0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.count += 1
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self.levels[0].append(value)
+        self._compress()
+
+    def _compress(self):
+        for level, items in enumerate(self.levels):
+            if len(items) < self.k:
+                continue
+            items.sort()
+            promoted = items[random.randint(0, 1)::2]
+            self.levels[level] = []
+            if level + 1 == len(self.levels):
+                self.levels.append([])
+            self.levels[level + 1].extend(promoted)
+
+    def merge(self, other):
+        while len(self.levels) < len(other.levels):
+            self.levels.append([])
+        for level, items in enumerate(other.levels):
+            self.levels[level].extend(items)
+        self.count += other.count
+        if other.count:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+        self._compress()
+
+    def quantiles(self, qs):
+        weighted = sorted(
+            (value, 1 << level) for level, items in enumerate(self.levels) for value in items
+        )
+        total = sum(weight for _, weight in weighted)
+        if not total:
+            return {}
+
+        result = {}
+        for q in qs:
+            target = q * total
+            cumulative = 0
+            for value, weight in weighted:
+                cumulative += weight
+                if cumulative >= target:
+                    result[q] = value
+                    break
+        return result
+
+
+class FieldStats:
+    """Sketches for one field path."""
+
+    def __init__(self):
+        self.count = 0
+        self.nulls = 0
+        self.distinct = HyperLogLog()
+        self.top_values = TopK()
+        self.numbers = QuantileSketch()
+
+    def add(self, value):
+        self.count += 1
+        if value is None:
+            self.nulls += 1
+            return
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            if math.isfinite(value):
+                self.numbers.add(value)
+        if not isinstance(value, (str, int, float, bool)):
+            value = str(value)
+        # Keys carry the type so that True, 1 and 1.0 (equal in Python) stay apart
+        kind = type(value).__name__
+        self.distinct.add((kind, value))
+        if isinstance(value, str) and len(value) > MAX_TOP_VALUE_LENGTH:
+            # Keeps the counters small when a field holds large blobs
+            value = value[:MAX_TOP_VALUE_LENGTH] + "…"
+        self.top_values.add((kind, value))
+
+    def merge(self, other):
+        self.count += other.count
+        self.nulls += other.nulls
+        self.distinct.merge(other.distinct)
+        self.top_values.merge(other.top_values)
+        self.numbers.merge(other.numbers)
+
+    def snapshot(self, top_k=10):
+        result = {
+            "count": self.count,
+            "null_rate": self.nulls / self.count if self.count else 0.0,
+            "distinct": self.distinct.count(),
+            "top_values": [{"value": value, "count": count} for (_, value), count in self.top_values.top(top_k)]
+        }
+        if self.numbers.count:
+            quantiles = self.numbers.quantiles([0.5, 0.9, 0.99])
+            result["numeric"] = {
+                "count": self.numbers.count,
+                "min": self.numbers.min,
+                "max": self.numbers.max,
+                "p50": quantiles.get(0.5),
+                "p90": quantiles.get(0.9),
+                "p99": quantiles.get(0.99)
+            }
+        return result
+
+
+def iter_field_values(value, path="", depth=0):
+    """Yield ``(path, leaf_value)`` for every scalar in a JSON document.
+
+    Array elements share a path ending in ``[]`` so that all items of a list are
+    summarised together.
+    """
+    if isinstance(value, dict):
+        if depth >= MAX_PATH_DEPTH:
+            return
+        for key, item in value.items():
+            yield from iter_field_values(item, f"{path}.{key}" if path else str(key), depth + 1)
+    elif isinstance(value, list):
+        if depth >= MAX_PATH_DEPTH:
+            return
+        for item in value:
+            yield from iter_field_values(item, f"{path}[]", depth + 1)
+    else:
+        yield path or "$", value
+
+
+class SubscriptionStats:
+    """Thread-safe per-field statistics for one subscription."""
+
+    def __init__(self, max_fields=DEFAULT_STATS_MAX_FIELDS, window_seconds=DEFAULT_STATS_WINDOW_SECONDS):
+        self.max_fields = max_fields
+        self.window_seconds = window_seconds
+        self.messages = 0
+        # Distinct paths seen after the cap was reached
+        self.dropped_fields = HyperLogLog()
+        self._current = {}
+        self._previous = {}
+        # Paths in either generation, kept up to date instead of recounted per value
+        self._tracked = 0
+        self._window_start = time.time()
+        self._lock = threading.Lock()
+
+    def _rotate(self, now):
+        if self.window_seconds > 0 and now - self._window_start >= self.window_seconds:
+            # Skip straight to an empty window if nothing arrived for a whole period
+            recent = now - self._window_start < 2 * self.window_seconds
+            self._previous = self._current if recent else {}
+            self._current = {}
+            self._tracked = len(self._previous)
+            self._window_start = now
+
+    def add_message(self, data, attributes=None):
+        """Update the sketches with one message's data and attributes."""
+        fields = list(iter_field_values(data))
+        for key, value in (attributes or {}).items():
+            fields.append((f"attributes.{key}", value))
+
+        with self._lock:
+            self._rotate(time.time())
+            self.messages += 1
+            for path, value in fields:
+                field = self._current.get(path)
+                if field is None:
+                    if path not in self._previous:
+                        if self._tracked >= self.max_fields:
+                            self.dropped_fields.add(path)
+                            continue
+                        self._tracked += 1
+                    field = self._current[path] = FieldStats()
+                field.add(value)
+
+    def snapshot(self, top_k=10):
+        """Return the statistics for the current window, merged across generations."""
+        with self._lock:
+            self._rotate(time.time())
+            merged = {}
+            for generation in (self._previous, self._current):
+                for path, field in generation.items():
+                    if path not in merged:
+                        merged[path] = FieldStats()
+                    merged[path].merge(field)
+            window_start = self._window_start - (self.window_seconds if self._previous else 0)
+            return {
+                "messages": self.messages,
+                "window_start": window_start,
+                "window_seconds": self.window_seconds,
+                "tracked_fields": len(merged),
+                "max_fields": self.max_fields,
+                "dropped_fields": self.dropped_fields.count(),
+                "fields": {path: merged[path].snapshot(top_k) for path in sorted(merged)}
+            }
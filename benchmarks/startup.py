@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Startup time benchmark for the CLI entry point.
+
+Measures how long ``pubsub_logger`` takes to import and how long
+``pubsub_logger.py --help`` takes to run, and fails if either exceeds its
+budget or if the --help / --web launch path imports the gRPC subscription stack.
+
+Usage:
+    python benchmarks/startup.py [--runs 10] [--import-budget-ms 60] [--help-budget-ms 200]
+"""
+
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that must not be imported just to show --help or launch --web
+HEAVY_MODULES = [
+    "google.cloud.pubsub_v1",
+    "google.cloud.resourcemanager_v3",
+    "grpc",
+]
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Check CLI startup time against a budget.")
+    parser.add_argument("--runs", type=int, default=10, help="Number of runs per measurement (default: 10)")
+    parser.add_argument(
+        "--import-budget-ms",
+        type=float,
+        default=float(os.environ.get("STARTUP_IMPORT_BUDGET_MS", "60")),
+        help="Budget for the cumulative import time of pubsub_logger (default: 60)",
+    )
+    parser.add_argument(
+        "--help-budget-ms",
+        type=float,
+        default=float(os.environ.get("STARTUP_HELP_BUDGET_MS", "200")),
+        help="Budget for the wall time of 'pubsub_logger.py --help' (default: 200)",
+    )
+    return parser.parse_args()
+
+
+def run_python(*args):
+    return subprocess.run(
+        [sys.executable, *args], cwd=ROOT, capture_output=True, text=True, check=True
+    )
+
+
+def measure_import_ms():
+    """Return the cumulative import time of pubsub_logger reported by -X importtime."""
+    result = run_python("-X", "importtime", "-c", "import pubsub_logger")
+    for line in result.stderr.splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \| pubsub_logger$", line)
+        if match:
+            return int(match.group(1)) / 1000
+    raise RuntimeError("pubsub_logger not found in -X importtime output")
+
+
+def measure_help_ms():
+    start = time.perf_counter()
+    run_python("pubsub_logger.py", "--help")
+    return (time.perf_counter() - start) * 1000
+
+
+def find_heavy_imports():
+    """Return heavy modules loaded by importing the CLI and the web launcher."""
+    code = (
+        "import sys, pubsub_logger, app.server; "
+        f"print('\\n'.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    )
+    return [line for line in run_python("-c", code).stdout.splitlines() if line]
+
+
+def main():
+    args = parse_arguments()
+
+    # Warm the filesystem and bytecode caches before measuring
+    run_python("-c", "import pubsub_logger, app.server")
+
+    import_ms = statistics.median(measure_import_ms() for _ in range(args.runs))
+    help_ms = statistics.median(measure_help_ms() for _ in range(args.runs))
+    heavy = find_heavy_imports()
+
+    print(f"import pubsub_logger: {import_ms:7.1f} ms (budget {args.import_budget_ms:.0f} ms)")
+    print(f"pubsub_logger --help: {help_ms:7.1f} ms (budget {args.help_budget_ms:.0f} ms)")
+
+    failures = []
+    if import_ms > args.import_budget_ms:
+        failures.append("import time is over budget")
+    if help_ms > args.help_budget_ms:
+        failures.append("--help time is over budget")
+    if heavy:
+        failures.append(f"startup path imports heavy modules: {', '.join(heavy)}")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
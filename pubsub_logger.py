@@ -1,19 +1,28 @@
-from google.cloud import pubsub_v1
 import json
 import colorama
 from colorama import Fore, Style
 import argparse
 import os
-from dotenv import load_dotenv
 import sys
 import time
+import io
+import queue
+import threading
+import multiprocessing
 
-# Load environment variables from .env file if it exists
-load_dotenv()
+from app.decoders import decode_body, submit
+from app.render import Marker, RenderLimits, analysable, parse_body, summarize_body
+from app.shapes import ShapeTracker, limit_changes
+
+# google.cloud.pubsub_v1 (gRPC/protobuf) and python-dotenv are imported inside the
+# functions that need them, so --help and --web start without paying for them.
 
 # Initialize colorama
 colorama.init(autoreset=True)
 
+# Serializes writes of rendered messages to stdout
+_output_lock = threading.Lock()
+
 
 def parse_arguments():
     """Parse command line arguments."""
@@ -62,28 +71,98 @@ def parse_arguments():
         help="Port for web interface (default: from PORT env var or 8000)",
     )
 
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes. In CLI mode subscriptions are spread across them "
+        "(default: 1). In web mode more than 1 disables hot reload and shares subscriptions "
+        "through a local broker (default: from WEB_WORKERS env var or 1)",
+    )
+
+    parser.add_argument(
+        "--peek",
+        type=int,
+        metavar="N",
+        help="Print up to N messages from each subscription's backlog without consuming them, then exit",
+    )
+
+    parser.add_argument(
+        "--peek-concurrency",
+        type=int,
+        default=int(os.environ.get("PEEK_CONCURRENCY", "4")),
+        help="Number of parallel pulls used by --peek (default: from PEEK_CONCURRENCY env var or 4)",
+    )
+
+    parser.add_argument(
+        "--max-depth",
+        type=int,
+        default=int(os.environ.get("RENDER_MAX_DEPTH", "32")),
+        help="Deepest nesting level printed (default: from RENDER_MAX_DEPTH env var or 32)",
+    )
+
+    parser.add_argument(
+        "--max-items",
+        type=int,
+        default=int(os.environ.get("RENDER_MAX_ITEMS", "1000")),
+        help="Array items or object keys printed per level (default: from RENDER_MAX_ITEMS env var or 1000)",
+    )
+
+    parser.add_argument(
+        "--max-string",
+        type=int,
+        default=int(os.environ.get("RENDER_MAX_STRING", "10000")),
+        help="Characters printed per string value (default: from RENDER_MAX_STRING env var or 10000)",
+    )
+
+    parser.add_argument(
+        "--max-bytes",
+        type=int,
+        default=int(os.environ.get("RENDER_MAX_BYTES", "1048576")),
+        help="Approximate size of the printed data per message (default: from RENDER_MAX_BYTES env var or 1048576)",
+    )
+
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="Print only the fields that changed since the last message of the same shape",
+    )
+
+    parser.add_argument(
+        "--expand",
+        metavar="PATH",
+        help="Print only this part of each message, e.g. 'orders[2].items' (limits still apply below it)",
+    )
+
     return parser.parse_args()
 
 
-def print_json_field(field_name, value, indent=0, is_array_item=False):
+def print_json_field(field_name, value, indent=0, is_array_item=False, file=None):
     """Print a JSON field with proper formatting and indentation."""
     indent_str = "  " * indent
     prefix = "- " if is_array_item else ""
 
     # Handle different types of values
-    if isinstance(value, dict):
+    if isinstance(value, Marker):
+        # Content left out by the render limits
+        formatted_value = f"{Style.DIM}{value}{Style.RESET_ALL}"
+        if field_name:
+            print(f"{indent_str}{prefix}{Fore.YELLOW}{field_name}:{Style.RESET_ALL} {formatted_value}", file=file)
+        else:
+            print(f"{indent_str}{prefix}{formatted_value}", file=file)
+    elif isinstance(value, dict):
         if field_name:
-            print(f"{indent_str}{prefix}{Fore.YELLOW}{field_name}:{Style.RESET_ALL}")
+            print(f"{indent_str}{prefix}{Fore.YELLOW}{field_name}:{Style.RESET_ALL}", file=file)
         for k, v in value.items():
-            print_json_field(k, v, indent + 1)
+            print_json_field(k, v, indent + 1, file=file)
     elif isinstance(value, list):
         if field_name:
-            print(f"{indent_str}{prefix}{Fore.YELLOW}{field_name}:{Style.RESET_ALL}")
+            print(f"{indent_str}{prefix}{Fore.YELLOW}{field_name}:{Style.RESET_ALL}", file=file)
         for item in value:
-            if isinstance(item, (dict, list)):
-                print_json_field("", item, indent + 1, True)
+            if isinstance(item, (dict, list, Marker)):
+                print_json_field("", item, indent + 1, True, file=file)
             else:
-                print(f"{indent_str}  - {Fore.CYAN}{item}{Style.RESET_ALL}")
+                print(f"{indent_str}  - {Fore.CYAN}{item}{Style.RESET_ALL}", file=file)
     else:
         # Format the value based on its type
         if value is None:
@@ -97,9 +176,10 @@ def print_json_field(field_name, value, indent=0, is_array_item=False):
             try:
                 json_obj = json.loads(value)
                 print(
-                    f"{indent_str}{prefix}{Fore.YELLOW}{field_name}:{Style.RESET_ALL} (nested JSON)"
+                    f"{indent_str}{prefix}{Fore.YELLOW}{field_name}:{Style.RESET_ALL} (nested JSON)",
+                    file=file,
                 )
-                print_json_field("", json_obj, indent + 1)
+                print_json_field("", json_obj, indent + 1, file=file)
                 return
             except (json.JSONDecodeError, TypeError):
                 # Not JSON, treat as regular string
@@ -109,56 +189,179 @@ def print_json_field(field_name, value, indent=0, is_array_item=False):
 
         if field_name:
             print(
-                f"{indent_str}{prefix}{Fore.YELLOW}{field_name}:{Style.RESET_ALL} {formatted_value}"
+                f"{indent_str}{prefix}{Fore.YELLOW}{field_name}:{Style.RESET_ALL} {formatted_value}",
+                file=file,
             )
         else:
-            print(f"{indent_str}{prefix}{formatted_value}")
+            print(f"{indent_str}{prefix}{formatted_value}", file=file)
+
+
+def write_output(chunk):
+    """Write a rendered chunk to stdout without interleaving it with other threads."""
+    with _output_lock:
+        sys.stdout.write(chunk)
+        sys.stdout.flush()
+
 
+def create_callback(project_id, subscription_id, emit=write_output, limits=None, expand=None, shapes=None):
+    """Create a callback function for a specific subscription.
 
-def create_callback(project_id, subscription_id):
-    """Create a callback function for a specific subscription."""
+    Each message is rendered into a single chunk and handed to ``emit``, so output
+    from concurrent callbacks (or worker processes) never interleaves mid-message.
+    ``shapes`` is the subscription's ``ShapeTracker`` in compact mode.
+    """
     
     def callback(message):
+        def handle():
+            emit(render_message(project_id, subscription_id, message, limits=limits, expand=expand, shapes=shapes))
+            message.ack()  # Acknowledge the message
+
+        # Large compressed bodies are decompressed off the callback thread
+        submit(message.data, message.attributes, handle)
+        
+    return callback
+
+
+def render_message(project_id, subscription_id, message, heading="MESSAGE RECEIVED FROM SUBSCRIPTION",
+                   limits=None, expand=None, shapes=None):
+    """Render one Pub/Sub message to a string.
+
+    Compressed and schema-encoded data is decoded first (see ``app.decoders``).
+    The data is then cut down to ``limits`` (see ``app.render``), so a very large
+    message costs about as much to print as a small one. ``expand`` prints only
+    the value at that path.
+
+    With a ``ShapeTracker`` in ``shapes`` (compact mode), a message whose shape
+    was seen before is rendered as one line plus the fields that changed since
+    the last message of that shape.
+    """
+    out = io.StringIO()
+    try:
+        decoded = decode_body(message.data, message.attributes)
         try:
-            # Decode message from bytes to string
-            message_data = message.data.decode("utf-8")
-
-            # Print message header with subscription info
-            print(f"\n{Fore.CYAN}{'='*80}{Style.RESET_ALL}")
-            print(f"{Fore.GREEN}MESSAGE RECEIVED FROM SUBSCRIPTION:{Style.RESET_ALL}")
-            print(f"{Fore.MAGENTA}Project: {project_id}, Subscription: {subscription_id}{Style.RESET_ALL}")
-            print(f"{Fore.CYAN}{'='*80}{Style.RESET_ALL}")
-
-            # Print message attributes if any
-            if message.attributes:
-                print(f"{Fore.YELLOW}Message Attributes:{Style.RESET_ALL}")
-                for key, value in message.attributes.items():
-                    print(f"  {Fore.YELLOW}{key}:{Style.RESET_ALL} {value}")
-                print()
-
-            # Try to parse the message data as JSON
-            try:
-                json_data = json.loads(message_data)
-                print_json_field("Message Data", json_data)
-            except json.JSONDecodeError:
+            value, is_json, truncated = summarize_body(decoded.value, limits, expand)
+            error = None
+        except ValueError as e:
+            # Includes a missing --expand path
+            error = e
+
+        shape = None
+        whole = not (truncated or expand)
+        if shapes is not None and error is None and (whole or analysable(decoded.value, len(message.data))):
+            # Shapes are tracked on the whole body, not on the (shortened) part
+            # shown; bodies over ANALYZE_MAX_BYTES are not compacted
+            data = value if whole else parse_body(decoded.value)
+            shape = limit_changes(shapes.observe(data, dict(message.attributes or {})), limits)
+            if "changes" in shape:
+                render_compact(project_id, subscription_id, shape, out)
+                return out.getvalue()
+
+        # Print message header with subscription info
+        print(f"\n{Fore.CYAN}{'='*80}{Style.RESET_ALL}", file=out)
+        print(f"{Fore.GREEN}{heading}:{Style.RESET_ALL}", file=out)
+        print(f"{Fore.MAGENTA}Project: {project_id}, Subscription: {subscription_id}{Style.RESET_ALL}", file=out)
+        if shape is not None and shape["new"]:
+            print(f"{Fore.MAGENTA}New message shape: {shape['id']}{Style.RESET_ALL}", file=out)
+        print(f"{Fore.CYAN}{'='*80}{Style.RESET_ALL}", file=out)
+
+        # Print message attributes if any
+        if message.attributes:
+            print(f"{Fore.YELLOW}Message Attributes:{Style.RESET_ALL}", file=out)
+            for key, attribute in message.attributes.items():
+                print(f"  {Fore.YELLOW}{key}:{Style.RESET_ALL} {attribute}", file=out)
+            print(file=out)
+
+        if decoded.steps:
+            print(f"{Style.DIM}Decoded: {' → '.join(decoded.steps)}{Style.RESET_ALL}", file=out)
+        if decoded.error:
+            print(f"{Fore.RED}Could not decode message: {decoded.error}{Style.RESET_ALL}", file=out)
+
+        # Print the data, parsed as JSON within the render limits
+        if error is not None:
+            print(f"{Fore.YELLOW}Message Data:{Style.RESET_ALL} {Style.DIM}{error}{Style.RESET_ALL}", file=out)
+        else:
+            if is_json:
+                print_json_field(f"Message Data ({expand})" if expand else "Message Data", value, file=out)
+            else:
                 # If not valid JSON, print as raw data
-                print(f"{Fore.YELLOW}Raw Message Data:{Style.RESET_ALL}")
-                print(message_data)
+                print(f"{Fore.YELLOW}Raw Message Data:{Style.RESET_ALL}", file=out)
+                print(value, file=out)
+            if truncated:
+                print(f"{Style.DIM}({len(message.data)} bytes, shortened by the render limits){Style.RESET_ALL}", file=out)
+
+        print(f"{Fore.CYAN}{'='*80}{Style.RESET_ALL}\n", file=out)
+
+    except Exception as e:
+        print(f"{Fore.RED}Error processing message: {e}{Style.RESET_ALL}", file=out)
+        print(f"Original message: {message.data}", file=out)
+
+    return out.getvalue()
 
-            print(f"{Fore.CYAN}{'='*80}{Style.RESET_ALL}\n")
 
+def render_compact(project_id, subscription_id, shape, out):
+    """Render a message of an already seen shape as the fields that changed."""
+    changes = shape["changes"]
+    removed = shape["removed"]
+    changed = len(changes) + shape.get("more_changes", 0)
+    if removed:
+        summary = f"{changed} changed, {len(removed)} removed"
+    else:
+        summary = f"{changed} changed" if changed else "no changes"
+    print(
+        f"{Fore.CYAN}--{Style.RESET_ALL} {Fore.MAGENTA}{project_id}:{subscription_id}{Style.RESET_ALL} "
+        f"shape {shape['id']} #{shape['count']}: {summary}",
+        file=out,
+    )
+    for path, value in changes:
+        print_json_field(path, value, 1, file=out)
+    if shape.get("more_changes"):
+        print(f"  {Style.DIM}…{shape['more_changes']} more changed fields{Style.RESET_ALL}", file=out)
+    for path in removed:
+        print(f"  {Fore.YELLOW}{path}:{Style.RESET_ALL} {Style.DIM}(removed){Style.RESET_ALL}", file=out)
+
+
+def render_shape_counts(project_id, subscription_id, shapes):
+    """Render the number of messages per shape seen on a subscription."""
+    out = io.StringIO()
+    print(f"\n{Fore.GREEN}Message shapes on {project_id}:{subscription_id} "
+          f"({shapes.messages} messages):{Style.RESET_ALL}", file=out)
+    for shape in shapes.counts():
+        keys = ", ".join(shape["keys"])
+        print(f"  {Fore.MAGENTA}{shape['id']}{Style.RESET_ALL} {Fore.BLUE}{shape['count']}{Style.RESET_ALL} "
+              f"{Style.DIM}{keys}{Style.RESET_ALL}", file=out)
+    return out.getvalue()
+
+
+def run_peek(subscriptions, count, concurrency, limits=None, expand=None, compact=False):
+    """Print the first messages of each subscription's backlog without acking them."""
+    from app.peek import peek_subscription
+
+    for project_id, subscription_id in subscriptions:
+        print(f"\n{Fore.GREEN}Peeking at up to {count} messages from:{Style.RESET_ALL} "
+              f"projects/{project_id}/subscriptions/{subscription_id}")
+        try:
+            messages, report = peek_subscription(project_id, subscription_id, count, concurrency)
         except Exception as e:
-            print(f"{Fore.RED}Error processing message: {e}{Style.RESET_ALL}")
-            print(f"Original message: {message.data}")
+            print(f"{Fore.RED}Error peeking at {project_id}:{subscription_id}: {e}{Style.RESET_ALL}")
+            continue
 
-        message.ack()  # Acknowledge the message
-        
-    return callback
+        shapes = ShapeTracker() if compact else None
+        for message in messages:
+            write_output(render_message(
+                project_id, subscription_id, message, heading="MESSAGE PEEKED (NOT ACKNOWLEDGED)",
+                limits=limits, expand=expand, shapes=shapes
+            ))
+        if shapes is not None:
+            write_output(render_shape_counts(project_id, subscription_id, shapes))
 
+        print(f"{Fore.GREEN}Peeked {report['messages']} messages in {report['elapsed_seconds']}s "
+              f"({report['messages_per_second']} msg/s, {report['bytes_per_second'] / 1e6:.2f} MB/s) "
+              f"with {report['pull_requests']} pulls on {report['concurrency']} threads; "
+              f"{report['released']} returned to the subscription{Style.RESET_ALL}")
 
-def start_web_server(port):
+
+def start_web_server(port, workers=1):
     """Start the web interface with FastAPI."""
-    import uvicorn
     import importlib.util
     
     # Check if app module exists
@@ -168,13 +371,125 @@ def start_web_server(port):
         return
 
     print(f"{Fore.GREEN}Starting web interface on http://127.0.0.1:{port}{Style.RESET_ALL}")
+    if workers > 1:
+        print(f"{Fore.GREEN}Using {workers} worker processes with a shared message broker{Style.RESET_ALL}")
     print(f"{Fore.YELLOW}Press Ctrl+C to exit{Style.RESET_ALL}")
     
     # Start uvicorn server
-    uvicorn.run("app.main:app", host="0.0.0.0", port=port, reload=True)
+    from app.server import run_server
+    run_server(port, workers)
+
+
+def disable_colors():
+    """Turn off colored output for this process."""
+    colorama.deinit()
+    # Override Fore colors with empty strings
+    for color in dir(Fore):
+        if color.isupper():
+            setattr(Fore, color, "")
+
+
+def run_subscription_worker(subscriptions, output_queue, no_color=False, limits=None, expand=None, compact=False):
+    """Listen to a shard of subscriptions in a worker process.
+
+    Messages are parsed and rendered here, and each rendered message is sent to
+    the parent as one chunk on ``output_queue``. A subscription always lives in a
+    single worker, so its messages keep their order in the merged output.
+    """
+    if no_color:
+        disable_colors()
+
+    from google.cloud import pubsub_v1
+
+    subscriber = pubsub_v1.SubscriberClient()
+    futures = []
+    shapes = {subscription: ShapeTracker() for subscription in subscriptions} if compact else {}
+    try:
+        for project_id, subscription_id in subscriptions:
+            subscription_path = subscriber.subscription_path(project_id, subscription_id)
+            subscription_callback = create_callback(
+                project_id, subscription_id, emit=output_queue.put, limits=limits, expand=expand,
+                shapes=shapes.get((project_id, subscription_id))
+            )
+            futures.append(subscriber.subscribe(subscription_path, callback=subscription_callback))
+
+        # Keep the worker alive while any of its subscriptions is still running
+        while any(not future.done() for future in futures):
+            time.sleep(1)
+
+        for future, (project_id, subscription_id) in zip(futures, subscriptions):
+            if future.exception() is not None:
+                output_queue.put(
+                    f"{Fore.RED}Subscription {project_id}:{subscription_id} stopped: "
+                    f"{future.exception()}{Style.RESET_ALL}\n"
+                )
+    except KeyboardInterrupt:
+        for (project_id, subscription_id), tracker in shapes.items():
+            output_queue.put(render_shape_counts(project_id, subscription_id, tracker))
+    finally:
+        for future in futures:
+            future.cancel()
+        # Wait for the streams to shut down before closing the channel
+        for future in futures:
+            try:
+                future.result(timeout=5)
+            except Exception:
+                pass
+        subscriber.close()
+
+
+def run_sharded_listeners(subscriptions, workers, no_color=False, limits=None, expand=None, compact=False):
+    """Spread subscriptions across worker processes and merge their output to stdout."""
+    shards = [subscriptions[i::workers] for i in range(workers)]
+    shards = [shard for shard in shards if shard]
+
+    # Spawn rather than fork so no gRPC state is shared with the children
+    context = multiprocessing.get_context("spawn")
+    output_queue = context.Queue()
+    processes = [
+        context.Process(
+            target=run_subscription_worker,
+            args=(shard, output_queue, no_color, limits, expand, compact),
+            name=f"pubsub-worker-{i}",
+            daemon=True,
+        )
+        for i, shard in enumerate(shards)
+    ]
+
+    print(f"\n{Fore.GREEN}Listening on {len(subscriptions)} subscriptions with {len(processes)} worker processes...{Style.RESET_ALL}")
+    for process in processes:
+        process.start()
+
+    try:
+        while any(process.is_alive() for process in processes) or not output_queue.empty():
+            try:
+                chunk = output_queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            write_output(chunk)
+    except KeyboardInterrupt:
+        print(f"\n{Fore.YELLOW}Stopping worker processes...{Style.RESET_ALL}")
+    finally:
+        # Keep printing while the workers shut down: a worker cannot exit while
+        # its output is still queued, so joining without draining could hang
+        deadline = time.monotonic() + 5
+        while any(process.is_alive() for process in processes) and time.monotonic() < deadline:
+            try:
+                write_output(output_queue.get(timeout=0.1))
+            except queue.Empty:
+                pass
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+    print(f"{Fore.GREEN}Goodbye!{Style.RESET_ALL}")
 
 
 def main():
+    from dotenv import load_dotenv
+
+    # Load environment variables from .env file if it exists
+    load_dotenv()
+
     # Parse command line arguments
     args = parse_arguments()
 
@@ -186,20 +501,14 @@ def main():
 
     # Check if web interface mode is requested
     if args.web:
-        start_web_server(args.port)
+        workers = args.workers or int(os.environ.get("WEB_WORKERS", "1"))
+        start_web_server(args.port, workers)
         return
 
     # Disable colors if requested
     if args.no_color:
-        colorama.deinit()
-        # Override Fore colors with empty strings
-        for color in dir(Fore):
-            if color.isupper():
-                setattr(Fore, color, "")
+        disable_colors()
 
-    # Create subscriber client
-    subscriber = pubsub_v1.SubscriberClient()
-    
     # Define subscriptions to listen to
     subscriptions = []
     
@@ -226,12 +535,40 @@ def main():
         print(f"{Fore.RED}Error: No valid subscriptions provided. Use --subscription-id or --subscriptions.{Style.RESET_ALL}")
         sys.exit(1)
 
+    limits = RenderLimits(
+        max_depth=args.max_depth,
+        max_items=args.max_items,
+        max_string=args.max_string,
+        max_bytes=args.max_bytes,
+    )
+
+    if args.peek is not None:
+        run_peek(subscriptions, args.peek, args.peek_concurrency, limits, args.expand, args.compact)
+        return
+
     print(f"{Fore.GREEN}Starting Pub/Sub listener with {len(subscriptions)} subscription(s){Style.RESET_ALL}")
     print(f"{Fore.YELLOW}Environment file:{Style.RESET_ALL} {args.env_file}")
     print(f"{Fore.YELLOW}Press Ctrl+C to exit{Style.RESET_ALL}")
     
+    workers = min(args.workers or 1, len(subscriptions))
+    if workers > 1:
+        for project_id, subscription_id in subscriptions:
+            print(f"\n{Fore.GREEN}Starting listener for:{Style.RESET_ALL}")
+            print(f"{Fore.YELLOW}Project ID:{Style.RESET_ALL} {project_id}")
+            print(f"{Fore.YELLOW}Subscription ID:{Style.RESET_ALL} {subscription_id}")
+            print(f"{Fore.BLUE}Path: projects/{project_id}/subscriptions/{subscription_id}{Style.RESET_ALL}")
+        run_sharded_listeners(subscriptions, workers, args.no_color, limits, args.expand, args.compact)
+        return
+
+    from google.cloud import pubsub_v1
+
+    # Create subscriber client
+    subscriber = pubsub_v1.SubscriberClient()
+    
     # Store futures for later cleanup
     futures = []
+    # Per-subscription message shapes in compact mode
+    shapes = {subscription: ShapeTracker() for subscription in subscriptions} if args.compact else {}
 
     try:
         # Subscribe to each subscription
@@ -247,7 +584,10 @@ def main():
             print(f"{Fore.BLUE}Path: {subscription_path}{Style.RESET_ALL}")
             
             # Create a callback specific to this subscription
-            subscription_callback = create_callback(project_id, subscription_id)
+            subscription_callback = create_callback(
+                project_id, subscription_id, limits=limits, expand=args.expand,
+                shapes=shapes.get((project_id, subscription_id))
+            )
             
             # Subscribe to the subscription
             streaming_pull_future = subscriber.subscribe(
@@ -274,6 +614,8 @@ def main():
         for i, future in enumerate(futures):
             print(f"Cancelling subscription {i+1}/{len(futures)}...")
             future.cancel()
+        for (project_id, subscription_id), tracker in shapes.items():
+            write_output(render_shape_counts(project_id, subscription_id, tracker))
         print(f"{Fore.GREEN}Goodbye!{Style.RESET_ALL}")
     except Exception as e:
         print(f"{Fore.RED}Error in Pub/Sub listener: {e}{Style.RESET_ALL}")
@@ -5,16 +5,21 @@ This is a convenience script to start the web interface directly.
 """
 
 import os
-import uvicorn
 from dotenv import load_dotenv
 
+from app.server import run_server
+
 # Load environment variables
 load_dotenv()
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", "8000"))
+    workers = int(os.environ.get("WEB_WORKERS", "1"))
     print(f"Starting Pub/Sub Pretty Logger web interface on http://127.0.0.1:{port}")
     print("Press Ctrl+C to exit")
     
+    if workers > 1:
+        print(f"Using {workers} worker processes with a shared message broker")
+    
     # Start web server
-    uvicorn.run("app.main:app", host="0.0.0.0", port=port, reload=True) 
\ No newline at end of file
+    run_server(port, workers) 
\ No newline at end of file
@@ -0,0 +1,122 @@
+import os
+import queue
+import threading
+import time
+
+import pytest
+
+from app.broker import BrokerClient, BrokerServer, new_broker_address
+from app.dedup import MessageDeduplicator
+from app.routes import api
+from app.stats import SubscriptionStats
+
+CLIENT_ID = "project:subscription"
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+@pytest.fixture
+def server():
+    address = new_broker_address()
+    server = BrokerServer(address, b"secret")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    assert wait_for(lambda: os.path.exists(address))
+    # Stands in for a running listener
+    entry = {
+        "messages": queue.Queue(),
+        "status": queue.Queue(),
+        "dedup": MessageDeduplicator(),
+        "stats": SubscriptionStats(),
+        "workers": set(),
+    }
+    server.subscriptions[CLIENT_ID] = entry
+    threading.Thread(target=server._pump, args=(CLIENT_ID, entry), daemon=True).start()
+    yield server
+    server.subscriptions.clear()
+
+
+def publish(server, count):
+    for number in range(count):
+        server.subscriptions[CLIENT_ID]["messages"].put({"n": number})
+
+
+def test_attached_worker_receives_messages_until_detached(server):
+    client = BrokerClient(server.address, server.authkey)
+    queues = {"messages": queue.Queue(), "status": queue.Queue()}
+    assert client.attach(CLIENT_ID, queues)
+    publish(server, 3)
+    assert wait_for(lambda: queues["messages"].qsize() == 3)
+
+    assert client.detach(CLIENT_ID)
+    assert server.subscriptions[CLIENT_ID]["workers"] == set()
+    publish(server, 3)
+    assert wait_for(lambda: server.subscriptions[CLIENT_ID]["messages"].empty())
+    time.sleep(0.1)
+    assert queues["messages"].qsize() == 3
+    assert not client.attach("project:unknown", queues)
+
+
+def test_routed_messages_are_bounded(server):
+    client = BrokerClient(server.address, server.authkey, queue_size=5)
+    queues = {"messages": queue.Queue(), "status": queue.Queue()}
+    client.attach(CLIENT_ID, queues)
+    publish(server, 20)
+    assert wait_for(lambda: server.subscriptions[CLIENT_ID]["messages"].empty())
+    assert wait_for(lambda: queues["messages"].qsize() == 5 and queues["messages"].queue[-1] == {"n": 19})
+    assert [message["n"] for message in queues["messages"].queue] == [15, 16, 17, 18, 19]
+
+
+def test_read_only_endpoints_do_not_attach(server, monkeypatch):
+    client = BrokerClient(server.address, server.authkey)
+    monkeypatch.setattr(api, "broker", client)
+    monkeypatch.setattr(api, "message_queues", {})
+
+    assert api.get_field_stats(CLIENT_ID)["client_id"] == CLIENT_ID
+    with pytest.raises(api.HTTPException) as error:
+        api.get_field_stats("project:unknown")
+    assert error.value.status_code == 404
+    assert api.message_queues == {}
+    assert server.subscriptions[CLIENT_ID]["workers"] == set()
+
+
+def test_worker_detaches_after_its_last_stream(server, monkeypatch):
+    client = BrokerClient(server.address, server.authkey)
+    monkeypatch.setattr(api, "broker", client)
+    monkeypatch.setattr(api, "message_queues", {})
+    workers = server.subscriptions[CLIENT_ID]["workers"]
+
+    assert api.acquire_client_queues(CLIENT_ID)
+    assert api.acquire_client_queues(CLIENT_ID)
+    assert workers == {client.worker_id}
+    api.release_client_queues(CLIENT_ID)
+    assert workers == {client.worker_id}
+    api.release_client_queues(CLIENT_ID)
+    assert workers == set()
+    assert CLIENT_ID not in api.message_queues
+    assert CLIENT_ID not in api.stream_consumers
+    assert not api.acquire_client_queues("project:unknown")
+
+
+def test_routes_are_reattached_after_the_connection_drops(server):
+    client = BrokerClient(server.address, server.authkey)
+    queues = {"messages": queue.Queue(), "status": queue.Queue()}
+    client.attach(CLIENT_ID, queues)
+    gone = {"messages": queue.Queue(), "status": queue.Queue()}
+    client.routes["project:gone"] = gone
+
+    server._drop_worker(client.worker_id)
+    assert queues["status"].get(timeout=5) == {"error": "Lost connection to message broker"}
+    assert queues["status"].get(timeout=5) == {"status": "connected"}
+    assert server.subscriptions[CLIENT_ID]["workers"] == {client.worker_id}
+    assert gone["status"].get(timeout=5) == {"error": "Lost connection to message broker"}
+    assert gone["status"].get(timeout=5) == {"error": "Subscription was lost by the message broker"}
+    assert "project:gone" not in client.routes
+    publish(server, 1)
+    assert queues["messages"].get(timeout=5) == {"n": 0}
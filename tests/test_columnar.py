@@ -0,0 +1,126 @@
+import pytest
+
+from app.columnar import ColumnStore, QueryError, parse_condition
+
+
+@pytest.mark.parametrize("condition, expected", [
+    ("amount>100", ("amount", ">", 100, "100")),
+    ("amount >= 1.5", ("amount", ">=", 1.5, "1.5")),
+    ("region=eu", ("region", "=", "eu", "eu")),
+    ('region="eu"', ("region", "=", "eu", '"eu"')),
+    ("flag!=true", ("flag", "!=", True, "true")),
+    ("attributes.kind=null", ("attributes.kind", "=", None, "null")),
+    ("a.b<=-3", ("a.b", "<=", -3, "-3")),
+])
+def test_parse_condition(condition, expected):
+    assert parse_condition(condition) == expected
+
+
+@pytest.mark.parametrize("condition", ["amount", "=5", ""])
+def test_parse_condition_rejects_malformed(condition):
+    with pytest.raises(QueryError):
+        parse_condition(condition)
+
+
+def make_store(capacity=100):
+    store = ColumnStore(capacity=capacity)
+    rows = [
+        {"region": "eu", "amount": 50, "paid": True},
+        {"region": "eu", "amount": 150, "paid": False},
+        {"region": "us", "amount": 250, "paid": True},
+        {"region": "us", "amount": None, "paid": 1},
+        {"region": "apac", "amount": 1.0},
+    ]
+    for i, row in enumerate(rows):
+        store.append(f"m{i}", row, {"source": "web" if i % 2 else "app"})
+    return store
+
+
+def test_count_and_filters():
+    store = make_store()
+    assert store.query()["count"] == 5
+    assert store.query(["region=eu"])["count"] == 2
+    assert store.query(["amount>100"])["count"] == 2
+    assert store.query(["amount>100", "region=us"])["count"] == 1
+    assert store.query(["region!=eu"])["count"] == 3
+    assert store.query(["amount=null"])["count"] == 1
+    assert store.query(["attributes.source=web"])["count"] == 2
+
+
+def test_equality_keeps_bool_and_number_apart():
+    store = make_store()
+    assert store.query(["paid=true"], ids=10)["message_ids"] == ["m0", "m2"]
+    assert store.query(["paid=1"], ids=10)["message_ids"] == ["m3"]
+    assert store.query(["amount=1"], ids=10)["message_ids"] == ["m4"]
+
+
+def test_unquoted_value_matches_string_column():
+    store = ColumnStore(capacity=100)
+    for i, value in enumerate(["123", 123, "0123", "abc"]):
+        store.append(f"m{i}", {"code": value})
+    assert store.query(["code=123"], ids=10)["message_ids"] == ["m0", "m1"]
+    assert store.query(['code="123"'], ids=10)["message_ids"] == ["m0"]
+    assert store.query(["code=0123"], ids=10)["message_ids"] == ["m2"]
+    assert store.query(["code!=123"], ids=10)["message_ids"] == ["m2", "m3"]
+
+
+def test_group_by():
+    result = make_store().query(group_by=["region"])
+    assert result["groups"] == [
+        {"key": {"region": "eu"}, "count": 2},
+        {"key": {"region": "us"}, "count": 2},
+        {"key": {"region": "apac"}, "count": 1},
+    ]
+    assert result["group_count"] == 3
+
+    result = make_store().query(["amount>0"], group_by=["region", "attributes.source"], limit=1)
+    assert result["group_count"] == 4
+    assert len(result["groups"]) == 1
+
+
+def test_query_errors():
+    store = make_store()
+    with pytest.raises(QueryError):
+        store.query(["missing=1"])
+    with pytest.raises(QueryError):
+        store.query(["region>eu"])
+    with pytest.raises(QueryError):
+        store.query(group_by=["missing"])
+
+
+def test_ring_buffer_keeps_last_rows():
+    store = ColumnStore(capacity=4)
+    for i in range(10):
+        store.append(f"m{i}", {"n": i, "parity": "even" if i % 2 == 0 else "odd"})
+    result = store.query(ids=10)
+    assert result["rows"] == 4
+    assert result["total_received"] == 10
+    assert sorted(result["message_ids"]) == ["m6", "m7", "m8", "m9"]
+    assert store.query(["n<6"])["count"] == 0
+    assert store.query(["parity=even"])["count"] == 2
+
+
+def test_ring_buffer_compacts_dictionaries():
+    store = ColumnStore(capacity=8)
+    for i in range(1000):
+        store.append(f"m{i}", {"unique": f"value-{i}"})
+    column = store.columns["unique"]
+    assert len(column.values) <= 2 * store.capacity + 1
+    assert store.query(["unique=value-999"])["count"] == 1
+    assert store.query(["unique=value-990"])["count"] == 0
+
+
+def test_column_cap_and_arrays():
+    store = ColumnStore(capacity=100, max_columns=3)
+    store.append("m0", {"a": 1, "b": 2, "c": 3, "items": [{"sku": "x"}]})
+    described = store.describe()
+    # message_id takes one of the columns; array paths are never stored
+    assert described["fields"] == ["a", "b", "message_id"]
+    assert described["dropped_fields"] == ["c"]
+
+
+def test_columns_added_later_are_missing_in_earlier_rows():
+    store = ColumnStore(capacity=100)
+    store.append("m0", {"a": 1})
+    store.append("m1", {"a": 2, "late": "x"})
+    assert store.query(["late=null"], ids=10)["message_ids"] == ["m0"]
@@ -0,0 +1,261 @@
+import gzip
+import importlib.util
+import threading
+import time
+
+import pytest
+
+from app import decoders
+from app.decoders import (
+    BINARY_PREVIEW_BYTES,
+    OFFLOAD_MIN_BYTES,
+    SCHEMA_ENCODING_ATTRIBUTE,
+    SCHEMA_NAME_ATTRIBUTE,
+    Decoded,
+    DecodeError,
+    DecoderCache,
+    binary_preview,
+    decode_body,
+    decode_protobuf_wire,
+    register_decoder,
+    submit,
+)
+
+HAS_ZSTANDARD = importlib.util.find_spec("zstandard") is not None
+HAS_FASTAVRO = importlib.util.find_spec("fastavro") is not None
+
+
+def schema_attributes(name):
+    return {SCHEMA_NAME_ATTRIBUTE: f"projects/p/schemas/{name}", SCHEMA_ENCODING_ATTRIBUTE: "BINARY"}
+
+
+def test_plain_text_and_binary():
+    assert decode_body(b'{"a": 1}').value == '{"a": 1}'
+    decoded = decode_body(bytes(range(256)))
+    assert decoded.steps == ["binary"]
+    assert decoded.value == binary_preview(bytes(range(256)))
+    assert decoded.value.startswith("<binary, 256 bytes> 00 01 02")
+    assert decoded.value.endswith(" …")
+    assert len(binary_preview(b"\xff" * BINARY_PREVIEW_BYTES)) < len(binary_preview(b"\xff" * 1000))
+
+
+def test_gzip_by_attribute_and_by_magic_bytes():
+    body = gzip.compress(b'{"compressed": true}')
+    for attributes in ({"content-encoding": "gzip"}, {}):
+        decoded = decode_body(body, attributes)
+        assert decoded.value == '{"compressed": true}'
+        assert decoded.steps == ["gzip"]
+        assert decoded.error is None
+
+
+def test_gzip_failures_are_reported_not_raised():
+    body = gzip.compress(b"x" * 10000)
+    decoded = decode_body(body[:-20])
+    assert decoded.error == "Truncated gzip data"
+    assert decoded.value.startswith("<binary,")
+
+    decoded = decode_body(body, max_bytes=1000)
+    assert "larger than 1000 bytes" in decoded.error
+
+    decoded = decode_body(b"not gzip", {"content-encoding": "gzip"})
+    assert decoded.error.startswith("Invalid gzip data")
+
+
+@pytest.mark.skipif(HAS_ZSTANDARD, reason="zstandard is installed")
+def test_zstd_without_the_package():
+    decoded = decode_body(b"\x28\xb5\x2f\xfd" + b"\x00" * 10)
+    assert decoded.error == "zstd body, but the zstandard package is not installed"
+
+
+@pytest.mark.skipif(not HAS_ZSTANDARD, reason="zstandard is not installed")
+def test_zstd():
+    import zstandard
+
+    body = zstandard.ZstdCompressor().compress(b'{"z": 1}')
+    decoded = decode_body(body)
+    assert (decoded.value, decoded.steps) == ('{"z": 1}', ["zstd"])
+
+
+def test_protobuf_wire_format():
+    data = bytes.fromhex(
+        "0896 01"                      # 1: varint 150
+        "1207 74657374696e67"          # 2: "testing"
+        "1a03 089601"                  # 3: nested message {1: 150}
+        "2001 2002"                    # 4: repeated varint 1, 2
+        "2d 01000000"                  # 5: fixed32 1
+        "31 0200000000000000"          # 6: fixed64 2
+        "3a02 ff00"                    # 7: bytes that are neither text nor a message
+    )
+    assert decode_protobuf_wire(data) == {
+        "1": 150,
+        "2": "testing",
+        "3": {"1": 150},
+        "4": [1, 2],
+        "5": 1,
+        "6": 2,
+        "7": "/wA=",
+    }
+
+
+@pytest.mark.parametrize("data, error", [
+    (bytes.fromhex("08"), "Truncated protobuf varint"),
+    (bytes.fromhex("1205 6869"), "Truncated protobuf message"),
+    (bytes.fromhex("0b"), "Unsupported protobuf wire type 3"),
+    (bytes.fromhex("0001"), "Invalid protobuf field number 0"),
+])
+def test_protobuf_wire_errors(data, error):
+    with pytest.raises(DecodeError, match=error):
+        decode_protobuf_wire(data)
+
+
+def test_registered_protobuf_class():
+    from google.protobuf.timestamp_pb2 import Timestamp
+
+    register_decoder("projects/p/schemas/timestamp", decoders._ProtoClassDecoder("google.protobuf.timestamp_pb2", "Timestamp"))
+    data = Timestamp(seconds=86400).SerializeToString()
+    decoded = decode_body(gzip.compress(data), schema_attributes("timestamp"))
+    assert decoded.value == "1970-01-02T00:00:00Z"
+    assert decoded.steps == ["gzip", "timestamp"]
+
+
+def test_failing_decoder_keeps_the_body():
+    def broken(data):
+        raise ValueError("bad record")
+
+    register_decoder("projects/p/schemas/broken", broken)
+    decoded = decode_body(b"plain", schema_attributes("broken"))
+    assert (decoded.value, decoded.steps, decoded.error) == ("plain", [], "bad record")
+
+    decoded = decode_body(b"\xff\xfe", schema_attributes("broken"))
+    assert decoded.steps == ["binary"]
+    assert decoded.error == "bad record"
+
+
+def test_json_encoded_schema_messages_are_not_decoded():
+    attributes = dict(schema_attributes("never-fetched"), **{SCHEMA_ENCODING_ATTRIBUTE: "JSON"})
+    decoded = decode_body(b'{"a": 1}', attributes)
+    assert (decoded.value, decoded.error) == ('{"a": 1}', None)
+
+
+def test_schema_fetch_failure_is_retried(monkeypatch):
+    calls = []
+
+    def unavailable(schema_name):
+        calls.append(schema_name)
+        raise RuntimeError("schema service unavailable")
+
+    monkeypatch.setattr(decoders, "_get_schema", unavailable)
+    monkeypatch.setattr(decoders, "decoder_cache", DecoderCache(retry_seconds=0.2))
+    for _ in range(3):
+        assert decode_body(b"x", schema_attributes("missing")).error == "schema service unavailable"
+    assert calls == ["projects/p/schemas/missing"]
+
+    time.sleep(0.25)
+    decode_body(b"x", schema_attributes("missing"))
+    assert len(calls) == 2
+
+
+@pytest.mark.skipif(HAS_FASTAVRO, reason="fastavro is installed")
+def test_avro_container_without_the_package():
+    decoded = decode_body(b"Obj\x01" + b"\x00" * 10)
+    assert decoded.error == "Avro container, but the fastavro package is not installed"
+    assert decoded.value == "Obj\x01" + "\x00" * 10
+
+
+@pytest.mark.skipif(not HAS_FASTAVRO, reason="fastavro is not installed")
+def test_avro_container():
+    import io
+
+    import fastavro
+
+    schema = {"type": "record", "name": "Order", "fields": [{"name": "id", "type": "int"}]}
+    buffer = io.BytesIO()
+    fastavro.writer(buffer, schema, [{"id": 1}, {"id": 2}])
+    decoded = decode_body(buffer.getvalue())
+    assert (decoded.value, decoded.steps) == ([{"id": 1}, {"id": 2}], ["avro"])
+
+
+def test_decoded_text():
+    assert Decoded("text").text() == "text"
+    assert Decoded({"a": b"x"}).text() == '{"a": "b\'x\'"}'
+
+
+def test_decoder_cache_compiles_once_per_key_outside_the_lock():
+    cache = DecoderCache()
+    calls = []
+    release = threading.Event()
+
+    def slow_compile(key):
+        calls.append(key)
+        release.wait(5)
+        return key
+
+    threads = [threading.Thread(target=cache.get, args=("slow", slow_compile)) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    # Other keys are served while "slow" is still compiling
+    assert cache.get("fast", lambda key: key) == "fast"
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert calls == ["slow"]
+    assert cache.stats()["compiled"] == 2
+
+
+def test_decoder_cache_shares_failures_with_waiting_callers():
+    cache = DecoderCache(retry_seconds=0)
+    started = threading.Event()
+    errors = []
+
+    def failing(key):
+        started.set()
+        time.sleep(0.1)
+        raise RuntimeError("no such schema")
+
+    def get():
+        try:
+            cache.get("key", failing)
+        except DecodeError as e:
+            errors.append(str(e))
+
+    first = threading.Thread(target=get)
+    first.start()
+    started.wait()
+    second = threading.Thread(target=get)
+    second.start()
+    first.join()
+    second.join()
+    assert errors == ["no such schema"] * 2
+    assert cache.stats()["compiled"] == 1
+
+
+def test_decoder_cache_evicts_least_recently_used():
+    cache = DecoderCache(max_size=2)
+    for key in ("a", "b"):
+        cache.get(key, str.upper)
+    cache.get("a", str.upper)
+    cache.get("c", str.upper)
+    compiled = cache.stats()["compiled"]
+    cache.get("a", str.upper)
+    assert cache.stats()["compiled"] == compiled
+    cache.get("b", str.upper)
+    assert cache.stats()["compiled"] == compiled + 1
+
+
+def test_submit_offloads_only_large_compressed_bodies():
+    ran_on = []
+    done = threading.Event()
+
+    def task():
+        ran_on.append(threading.current_thread().name)
+        done.set()
+
+    submit(b"small", {}, task)
+    submit(b"x" * OFFLOAD_MIN_BYTES, {}, task)
+    assert ran_on == [threading.current_thread().name] * 2
+
+    done.clear()
+    submit(gzip.compress(b"x") + b"\x00" * OFFLOAD_MIN_BYTES, {}, task)
+    assert done.wait(5)
+    assert ran_on[-1].startswith("decode")
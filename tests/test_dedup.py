@@ -0,0 +1,105 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from app import dedup
+from app.dedup import MessageDeduplicator
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = SimpleNamespace(value=1000.0)
+    monkeypatch.setattr(dedup, "time", SimpleNamespace(monotonic=lambda: now.value))
+    return now
+
+
+def test_duplicates_are_detected_and_counted():
+    deduplicator = MessageDeduplicator(max_size=10)
+    assert not deduplicator.is_duplicate("a")
+    assert not deduplicator.is_duplicate("b")
+    assert deduplicator.is_duplicate("a")
+    assert deduplicator.is_duplicate("a")
+    assert deduplicator.stats() == {"duplicates": 2, "tracked_ids": 2, "max_size": 10, "window_seconds": 0}
+
+
+def test_least_recently_seen_ids_are_evicted():
+    deduplicator = MessageDeduplicator(max_size=2)
+    deduplicator.is_duplicate("a")
+    deduplicator.is_duplicate("b")
+    deduplicator.is_duplicate("c")
+    assert not deduplicator.is_duplicate("a")
+    assert deduplicator.stats()["tracked_ids"] == 2
+
+
+def test_a_duplicate_refreshes_its_id():
+    deduplicator = MessageDeduplicator(max_size=2)
+    deduplicator.is_duplicate("a")
+    deduplicator.is_duplicate("b")
+    # "a" becomes the most recent, so "b" is evicted next
+    assert deduplicator.is_duplicate("a")
+    deduplicator.is_duplicate("c")
+    assert deduplicator.is_duplicate("a")
+    assert not deduplicator.is_duplicate("b")
+
+
+def test_ids_expire_after_the_window(clock):
+    deduplicator = MessageDeduplicator(max_size=10, window_seconds=60)
+    deduplicator.is_duplicate("a")
+    clock.value += 30
+    deduplicator.is_duplicate("b")
+    clock.value += 31
+    # "a" was last seen 61 seconds ago, "b" 31
+    assert not deduplicator.is_duplicate("a")
+    assert deduplicator.is_duplicate("b")
+    assert deduplicator.stats()["tracked_ids"] == 2
+
+
+def test_a_duplicate_restarts_its_window(clock):
+    deduplicator = MessageDeduplicator(max_size=10, window_seconds=60)
+    deduplicator.is_duplicate("a")
+    clock.value += 50
+    assert deduplicator.is_duplicate("a")
+    clock.value += 50
+    assert deduplicator.is_duplicate("a")
+
+
+def test_without_a_window_ids_only_leave_by_size(clock):
+    deduplicator = MessageDeduplicator(max_size=10, window_seconds=0)
+    deduplicator.is_duplicate("a")
+    clock.value += 10 ** 6
+    assert deduplicator.is_duplicate("a")
+
+
+def test_zero_size_disables_deduplication():
+    deduplicator = MessageDeduplicator(max_size=0)
+    assert not deduplicator.is_duplicate("a")
+    assert not deduplicator.is_duplicate("a")
+    assert deduplicator.stats()["duplicates"] == 0
+    assert deduplicator.stats()["tracked_ids"] == 0
+
+
+def test_concurrent_callers_see_each_id_once():
+    deduplicator = MessageDeduplicator(max_size=10000)
+    first_seen = []
+
+    def record():
+        for number in range(1000):
+            if not deduplicator.is_duplicate(str(number)):
+                first_seen.append(number)
+
+    threads = [threading.Thread(target=record) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(first_seen) == list(range(1000))
+    assert deduplicator.stats()["duplicates"] == 3000
+
+
+def test_memory_grows_with_tracked_ids():
+    deduplicator = MessageDeduplicator(max_size=1000)
+    empty = deduplicator.memory_bytes()
+    for number in range(100):
+        deduplicator.is_duplicate(f"message-{number}")
+    assert deduplicator.memory_bytes() > empty
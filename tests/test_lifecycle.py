@@ -0,0 +1,152 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from app.dedup import MessageDeduplicator
+from app.lifecycle import ManagedListener, SubscriptionManager, queue_memory
+
+
+class FakeFuture:
+    """Streaming pull future that runs until it is cancelled."""
+
+    def __init__(self):
+        self.cancelled = threading.Event()
+
+    def cancel(self):
+        self.cancelled.set()
+        return True
+
+    def done(self):
+        return self.cancelled.is_set()
+
+    def result(self):
+        self.cancelled.wait()
+        raise RuntimeError("cancelled")
+
+
+class FakeSubscriber:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def fake_listener(streaming, lifecycle=None):
+    """Does what create_subscription_listener does with its lifecycle."""
+    subscriber = FakeSubscriber()
+    future = FakeFuture()
+    try:
+        lifecycle.attach(subscriber, future)
+        streaming.set()
+        try:
+            future.result()
+        except RuntimeError:
+            pass
+    finally:
+        subscriber.close()
+
+
+def start(manager, client_id="project:subscription"):
+    streaming = threading.Event()
+    listener, created = manager.start(client_id, fake_listener, streaming)
+    assert streaming.wait(5)
+    return listener, created
+
+
+def test_start_runs_the_listener_in_a_named_thread():
+    manager = SubscriptionManager()
+    listener, created = start(manager)
+    assert created
+    assert listener.thread.name == "pubsub-project:subscription-listener"
+    report = manager.report()["subscriptions"]["project:subscription"]
+    assert report["listener_alive"] and report["streams"] == 1
+    assert not report["stopping"]
+    manager.stop_all()
+
+
+def test_start_reuses_a_live_listener():
+    manager = SubscriptionManager()
+    listener, _ = start(manager)
+    again, created = manager.start("project:subscription", fake_listener, threading.Event())
+    assert again is listener and not created
+    assert manager.get("project:subscription") is listener
+    manager.stop_all()
+
+
+def test_stop_cancels_the_stream_and_joins_the_thread():
+    manager = SubscriptionManager()
+    listener, _ = start(manager)
+    subscriber, future = listener.subscriber, listener.future
+
+    assert manager.stop("project:subscription")
+    assert future.cancelled.is_set()
+    assert not listener.thread.is_alive()
+    assert subscriber.closed
+    assert manager.get("project:subscription") is None
+    assert manager.report()["subscriptions"] == {}
+    assert manager.report()["process"]["streams"] == 0
+    # Stopping an unknown or already stopped subscription is fine
+    assert manager.stop("project:subscription")
+
+
+def test_stop_while_the_stream_is_opening_cancels_it():
+    listener = ManagedListener("project:subscription")
+    assert listener.stop()
+    future = FakeFuture()
+    listener.attach(FakeSubscriber(), future)
+    assert future.cancelled.is_set()
+    assert listener.report()["streams"] == 0
+
+
+def test_a_stopping_listener_is_replaced():
+    manager = SubscriptionManager()
+    old, _ = start(manager)
+    old.stopping.set()
+    assert manager.get("project:subscription") is None
+
+    new, created = start(manager)
+    assert created and new is not old
+    # The old stream was cancelled before the new one started
+    assert old.future.cancelled.is_set()
+    assert not old.thread.is_alive()
+    manager.stop_all()
+
+
+def test_stop_reports_a_listener_that_does_not_finish():
+    release = threading.Event()
+    listener = ManagedListener("project:stuck")
+    listener.thread = threading.Thread(target=release.wait, daemon=True)
+    listener.thread.start()
+    assert not listener.stop(timeout=0.1)
+    assert listener.report()["listener_alive"]
+    release.set()
+    listener.thread.join()
+
+
+def test_report_counts_callback_threads_and_memory():
+    manager = SubscriptionManager()
+    listener, _ = start(manager)
+    release = threading.Event()
+    with ThreadPoolExecutor(max_workers=3, thread_name_prefix=listener.thread_prefix) as executor:
+        # The executor starts a thread per task submitted while none is idle
+        for _ in range(3):
+            executor.submit(release.wait)
+        queues = {"messages": queue.Queue(), "dedup": MessageDeduplicator()}
+        queues["messages"].put({"data": "x" * 100})
+        queues["dedup"].is_duplicate("a")
+        report = manager.report({"project:subscription": queues, "project:other": queues})
+        release.set()
+
+    entry = report["subscriptions"]["project:subscription"]
+    assert entry["callback_threads"] == 3
+    assert entry["memory"]["pending_messages"] == 1
+    assert entry["memory"]["total_bytes"] == entry["memory"]["pending_bytes"] + entry["memory"]["dedup_bytes"]
+    # Queues without a listener in this process, e.g. routed from the broker
+    assert report["subscriptions"]["project:other"]["listener_alive"] is False
+    assert report["process"]["streams"] == 1
+    manager.stop_all()
+
+
+def test_queue_memory_of_empty_queues():
+    assert queue_memory({"messages": queue.Queue()}) == {"pending_messages": 0, "pending_bytes": 0, "total_bytes": 0}
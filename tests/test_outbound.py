@@ -0,0 +1,145 @@
+import asyncio
+
+import pytest
+from fastapi import WebSocketDisconnect
+
+from app import outbound
+from app.outbound import FULL, PREVIEW, PREVIEW_LENGTH, SAMPLE, SKIP, SocketWriter, make_preview
+
+
+class FakeWebSocket:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.frames = []
+
+    async def send_json(self, frame):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.frames.append(frame)
+
+
+def message_frame(i, size=10):
+    return {"type": "message", "client_id": "p:s", "data": {"data": "x" * size, "message_id": str(i)}}
+
+
+def test_make_preview():
+    small = {"data": {"a": 1}}
+    assert make_preview(small) is small
+
+    large = {"data": {"text": "x" * 1000}, "message_id": "1"}
+    preview = make_preview(large)
+    assert preview["preview"] is True
+    assert preview["message_id"] == "1"
+    assert len(preview["data"]) == PREVIEW_LENGTH + 1
+    assert "preview" not in large
+
+
+def test_levels_follow_the_send_lag():
+    writer = SocketWriter(FakeWebSocket(), max_size=100, sample_rate=1)
+    writer.send_time_avg = 0.1  # slower than WS_SLOW_SEND_MS
+
+    assert writer.offer("p:s", message_frame(0, size=1000))
+    assert writer.level == PREVIEW
+    assert writer._frames[-1]["data"]["preview"] is True
+
+    for i in range(1, 6):
+        writer.offer("p:s", message_frame(i))
+    assert writer.level == SAMPLE
+
+    for i in range(6, 30):
+        writer.offer("p:s", message_frame(i))
+    assert writer.level == SKIP
+    assert writer.skipped["p:s"] > 0
+    assert writer.skipped_total == sum(writer.skipped.values())
+
+
+def test_sample_level_sends_one_in_n():
+    writer = SocketWriter(FakeWebSocket(), sample_rate=5)
+    writer.level = SAMPLE
+    # Keep the level where it is
+    writer._update_level = lambda: None
+    sent = [writer.offer("p:s", message_frame(i)) for i in range(20)]
+    assert sent.count(True) == 4
+
+
+def test_queue_is_bounded():
+    writer = SocketWriter(FakeWebSocket(), max_size=8)
+    results = [writer.offer("p:s", message_frame(i)) for i in range(20)]
+    assert results.count(True) == 8
+    assert writer.skipped_total == 12
+    assert writer.level == FULL
+
+
+def test_control_frames_are_never_degraded():
+    writer = SocketWriter(FakeWebSocket(), max_size=4)
+    writer.level = SKIP
+    for i in range(10):
+        writer.send({"type": "status", "data": i})
+    assert len(writer._frames) == 10
+
+    writer.stop()
+    with pytest.raises(WebSocketDisconnect):
+        writer.send({"type": "status"})
+    with pytest.raises(WebSocketDisconnect):
+        writer.offer("p:s", message_frame(0))
+
+
+def test_fast_client_gets_every_message():
+    async def scenario():
+        websocket = FakeWebSocket()
+        writer = SocketWriter(websocket)
+        writer.start()
+        for i in range(50):
+            writer.offer("p:s", message_frame(i))
+            await asyncio.sleep(0)
+        while writer._frames:
+            await asyncio.sleep(0.01)
+        writer.stop()
+        return websocket, writer
+
+    websocket, writer = asyncio.run(scenario())
+    assert [frame["data"]["message_id"] for frame in websocket.frames] == [str(i) for i in range(50)]
+    assert writer.level == FULL
+    assert writer.stats()["skipped"] == 0
+
+
+def test_slow_client_gets_skip_markers_and_recovers(monkeypatch):
+    monkeypatch.setattr(outbound, "SKIP_MARKER_INTERVAL", 0.05)
+
+    async def scenario():
+        websocket = FakeWebSocket(delay=0.02)
+        writer = SocketWriter(websocket, max_size=200, slow_send_ms=5)
+        writer.start()
+        peak = FULL
+        for i in range(200):
+            writer.offer("p:s", message_frame(i, size=1000))
+            peak = max(peak, writer.level)
+            await asyncio.sleep(0.001)
+
+        # Stop offering until the queue has drained and the markers went out
+        for _ in range(500):
+            if not writer._frames and not writer.skipped:
+                break
+            await asyncio.sleep(0.01)
+
+        # The client got fast again: the level comes down one step at a time
+        websocket.delay = 0
+        writer.send_time_avg = 0.0
+        levels = []
+        for i in range(10):
+            writer.offer("p:s", message_frame(1000 + i))
+            levels.append(writer.level)
+            while writer._frames:
+                await asyncio.sleep(0.01)
+        writer.stop()
+        return websocket, writer, peak, levels
+
+    websocket, writer, peak, levels = asyncio.run(scenario())
+    assert peak == SKIP
+    markers = [frame for frame in websocket.frames if frame["type"] == "skipped"]
+    # Every skipped message is reported, apart from those still waiting for a marker
+    assert markers
+    assert sum(marker["count"] for marker in markers) + sum(writer.skipped.values()) == writer.skipped_total
+    assert all(a - b in (0, 1) for a, b in zip(levels, levels[1:]))
+    assert levels[-1] == FULL
+    assert writer.stats()["degraded"] > 0
@@ -0,0 +1,89 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+from google.cloud import pubsub_v1
+
+from app import peek
+from app.peek import peek_subscription
+
+
+class FakeSubscriber:
+    """Serves a fixed backlog through pull and records what is handed back."""
+
+    def __init__(self, count):
+        self.backlog = [
+            SimpleNamespace(ack_id=f"ack-{number}", message=SimpleNamespace(message_id=str(number), data=b"x" * 10))
+            for number in range(count)
+        ]
+        self.released = []
+        self.threads = set()
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def subscription_path(self, project_id, subscription_id):
+        return f"projects/{project_id}/subscriptions/{subscription_id}"
+
+    def pull(self, request, retry, timeout):
+        with self.lock:
+            self.threads.add(threading.current_thread().name)
+            batch = self.backlog[:request["max_messages"]]
+            del self.backlog[:len(batch)]
+        return SimpleNamespace(received_messages=batch)
+
+    def modify_ack_deadline(self, request):
+        assert request["ack_deadline_seconds"] == 0
+        self.released.extend(request["ack_ids"])
+
+    def close(self):
+        self.closed = True
+
+
+def test_peek_releases_every_message():
+    subscriber = FakeSubscriber(2500)
+    messages, report = peek_subscription("p", "s", 2000, concurrency=2, subscriber=subscriber)
+    assert len(messages) == 2000
+    assert len({message.message_id for message in messages}) == 2000
+    assert sorted(subscriber.released) == sorted(f"ack-{number}" for number in range(2000))
+    assert report["messages"] == 2000
+    assert report["released"] == 2000
+    assert report["bytes"] == 20000
+    assert report["subscription"] == "projects/p/subscriptions/s"
+    # A subscriber passed in is left open for the caller
+    assert not subscriber.closed
+
+
+def test_peek_closes_the_client_it_creates(monkeypatch):
+    created = []
+
+    def make_subscriber():
+        created.append(FakeSubscriber(10))
+        return created[-1]
+
+    monkeypatch.setattr(pubsub_v1, "SubscriberClient", make_subscriber)
+    messages, _ = peek_subscription("p", "s", 100)
+    assert len(messages) == 10
+    assert created[0].closed
+
+
+def test_peek_closes_the_client_when_a_pull_fails(monkeypatch):
+    subscriber = FakeSubscriber(0)
+
+    def fail(**kwargs):
+        raise RuntimeError("permission denied")
+
+    subscriber.pull = fail
+    monkeypatch.setattr(pubsub_v1, "SubscriberClient", lambda: subscriber)
+    with pytest.raises(RuntimeError, match="permission denied"):
+        peek_subscription("p", "s", 100)
+    assert subscriber.closed
+
+
+def test_concurrency_is_capped(monkeypatch):
+    monkeypatch.setattr(peek, "MAX_PEEK_CONCURRENCY", 3)
+    subscriber = FakeSubscriber(5)
+    _, report = peek_subscription("p", "s", 5, concurrency=10000, subscriber=subscriber)
+    assert report["concurrency"] == 3
+    assert len(subscriber.threads) <= 3
+    _, report = peek_subscription("p", "s", 5, concurrency=0, subscriber=FakeSubscriber(5))
+    assert report["concurrency"] == 1
@@ -0,0 +1,182 @@
+import json
+import random
+
+import pytest
+
+from app.render import (
+    BodyStore,
+    Marker,
+    PathError,
+    RenderLimits,
+    analysable,
+    expand_body,
+    parse_body,
+    parse_path,
+    summarize,
+    summarize_body,
+    summarize_text,
+)
+
+
+def random_json(rng, depth=0):
+    kind = rng.choice(["dict", "list", "str", "int", "float", "bool", "null"] if depth < 4 else ["str", "int", "null"])
+    if kind == "dict":
+        return {f"k{i}-{random_string(rng, 3)}": random_json(rng, depth + 1) for i in range(rng.randint(0, 8))}
+    if kind == "list":
+        return [random_json(rng, depth + 1) for _ in range(rng.randint(0, 8))]
+    if kind == "str":
+        return random_string(rng, rng.randint(0, 40))
+    if kind == "int":
+        return rng.randint(-10**6, 10**6)
+    if kind == "float":
+        return rng.uniform(-1000, 1000)
+    if kind == "bool":
+        return rng.random() < 0.5
+    return None
+
+
+def random_string(rng, length):
+    # Quotes, backslashes, brackets, commas and non-ASCII text all need care when scanning
+    alphabet = 'ab c"\\[]{},:/\n\té€😀'
+    return "".join(rng.choice(alphabet) for _ in range(length))
+
+
+LIMITS = [
+    RenderLimits(max_depth=8, max_items=50, max_string=1000, max_bytes=65536),
+    RenderLimits(max_depth=2, max_items=3, max_string=5, max_bytes=65536),
+    RenderLimits(max_depth=8, max_items=50, max_string=1000, max_bytes=200),
+    RenderLimits(max_depth=3, max_items=2, max_string=10, max_bytes=50),
+]
+
+
+@pytest.mark.parametrize("limits", LIMITS)
+@pytest.mark.parametrize("indent", [None, 2])
+def test_text_summary_matches_json_loads(limits, indent):
+    rng = random.Random(42)
+    for _ in range(200):
+        value = random_json(rng)
+        text = json.dumps(value, indent=indent, ensure_ascii=rng.random() < 0.5)
+        assert summarize_text(text, limits) == summarize(json.loads(text), limits)
+
+
+def test_untruncated_summary_is_the_document():
+    rng = random.Random(1)
+    limits = RenderLimits(max_depth=100, max_items=10**6, max_string=10**6, max_bytes=10**8)
+    for _ in range(100):
+        value = random_json(rng)
+        text = json.dumps(value)
+        assert summarize_text(text, limits) == (json.loads(text), False)
+        assert summarize_body(text, limits) == (json.loads(text), True, False)
+
+
+def test_markers():
+    limits = RenderLimits(max_depth=2, max_items=2, max_string=3)
+    summary, truncated = summarize({"a": [1, 2, 3, 4], "b": {"c": {"d": 1}}, "e": "abcdef", "f": 1}, limits)
+    assert truncated
+    assert summary == {
+        "a": [1, 2, "…2 more items"],
+        "b": {"c": "{…1 keys}"},
+        "…": "2 more keys",
+    }
+    assert isinstance(summary["…"], Marker)
+    assert summarize("abcdef", limits) == ("abc…(3 more chars)", True)
+
+
+def test_summary_size_is_bounded():
+    value = {"items": [{"id": i, "name": "x" * 100} for i in range(100000)]}
+    text = json.dumps(value)
+    limits = RenderLimits(max_bytes=10000)
+    summary, truncated = summarize_text(text, limits)
+    assert truncated
+    assert len(json.dumps(summary)) < 3 * limits.max_bytes
+
+
+def test_scan_limit_stops_the_scan():
+    text = json.dumps({"skipped": ["x" * 100] * 10000, "after": 1})
+    limits = RenderLimits(max_depth=1, max_bytes=10, max_scan=1000)
+    summary, truncated = summarize_text(text, limits)
+    assert truncated
+    assert "after" not in summary
+
+
+@pytest.mark.parametrize("text", ['{"a": 1', '{"a": 1} x', "[1, 2,]", '{"a" 1}'])
+def test_invalid_json_raises(text):
+    with pytest.raises(ValueError):
+        summarize_text(text)
+
+
+def test_summarize_body_falls_back_to_text():
+    limits = RenderLimits(max_string=5, max_bytes=10)
+    assert summarize_body(b"not json", limits) == ("not j…(3 more chars)", False, True)
+    assert summarize_body("short", limits) == ("short", False, False)
+    assert summarize_body("not json at all, and long", limits)[1:] == (False, True)
+    assert summarize_body({"ok": "yes"}, limits) == ({"ok": "yes"}, True, False)
+
+
+def test_paths():
+    assert parse_path("orders[2].items") == ["orders", 2, "items"]
+    assert parse_path("") == []
+
+    document = {"orders": [{"id": i, "items": list(range(i))} for i in range(5)]}
+    text = json.dumps(document)
+    limits = RenderLimits(max_bytes=10)
+    assert summarize_text(text, limits, "orders[3].items") == summarize([0, 1, 2], limits)
+    assert summarize_body(text, limits, "orders[3].items")[0] == [0, 1, 2]
+    with pytest.raises(PathError):
+        summarize_text(text, limits, "orders[9]")
+    with pytest.raises(PathError):
+        summarize({"a": 1}, limits, "b")
+
+
+def test_parse_body():
+    assert parse_body(b'{"a": [1, 2]}') == {"a": [1, 2]}
+    assert parse_body("plain text") == "plain text"
+    assert parse_body(b"\xff") == "�"
+    record = {"decoded": True}
+    assert parse_body(record) is record
+
+
+def test_body_store_evicts_least_recently_used():
+    store = BodyStore(max_bytes=10)
+    store.put("a", "1234")
+    store.put("b", "1234")
+    store.get("a")
+    store.put("c", "1234")
+    assert store.get("b") is None
+    assert store.get("a") == "1234"
+    assert store.memory_bytes() == 8
+    # Bodies larger than the store are not kept at all
+    store.put("big", "x" * 11)
+    assert store.get("big") is None
+    assert store.get("c") == "1234"
+
+
+def test_expand_body():
+    store = BodyStore()
+    store.put("m1", json.dumps({"orders": [{"items": ["x" * 50] * 3}]}))
+    result = expand_body(store, "m1", "orders[0].items", RenderLimits(max_string=10))
+    assert result["data"] == ["x" * 10 + "…(40 more chars)"] * 3
+    assert result["truncated"]
+    with pytest.raises(KeyError):
+        expand_body(store, "missing", "")
+    with pytest.raises(PathError):
+        expand_body(store, "m1", "orders[1]")
+
+
+@pytest.mark.parametrize("value", ["é" * 30, "😀" * 30, 'a"b\\c\n' * 10, "x" * 29 + "😀" * 5])
+def test_long_escaped_strings_are_cut_by_characters(value):
+    limits = RenderLimits(max_string=10, max_bytes=20)
+    for ensure_ascii in (True, False):
+        text = json.dumps({"value": value}, ensure_ascii=ensure_ascii)
+        summary, truncated = summarize_text(text, limits)
+        assert truncated
+        assert summary == {"value": f"{value[:10]}…({len(value) - 10} more chars)"}
+
+
+def test_analysable():
+    assert analysable("x" * 100, max_bytes=100)
+    assert not analysable("x" * 101, max_bytes=100)
+    assert not analysable(b"x" * 101, max_bytes=100)
+    # Decoded objects are judged by the size of the message as received
+    assert analysable({"a": 1}, size=100, max_bytes=100)
+    assert not analysable({"a": 1}, size=101, max_bytes=100)
@@ -0,0 +1,115 @@
+import json
+import queue
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.replay import ReplayLog
+from app.routes import api
+
+
+def test_since_returns_entries_after_an_id():
+    log = ReplayLog(max_size=10)
+    for i in range(5):
+        assert log.append({"n": i}) == i + 1
+    assert log.since(2) == (0, [(3, {"n": 2}), (4, {"n": 3}), (5, {"n": 4})])
+    assert log.since(5) == (0, [])
+    assert log.since(0) == (0, [(number, {"n": number - 1}) for number in range(1, 6)])
+
+
+def test_since_counts_evicted_entries():
+    log = ReplayLog(max_size=3)
+    for i in range(10):
+        log.append(i)
+    missed, entries = log.since(2)
+    # 3..7 were evicted, 8..10 are still there
+    assert missed == 5
+    assert [number for number, _ in entries] == [8, 9, 10]
+
+
+def test_event_ids_are_tied_to_one_log():
+    log, other = ReplayLog(), ReplayLog()
+    event_id = log.format_id(7)
+    assert log.parse_id(event_id) == 7
+    assert other.parse_id(event_id) is None
+    assert log.parse_id(None) is None
+    assert log.parse_id(f"{log.epoch}-x") is None
+
+
+def test_memory_bytes():
+    log = ReplayLog()
+    log.append({"a": "x" * 100})
+    assert log.memory_bytes() >= 100
+
+
+@pytest.fixture
+def subscription():
+    client_id = "project:subscription"
+    queues = {"messages": queue.Queue(), "status": queue.Queue(), "replay": ReplayLog()}
+    api.message_queues[client_id] = queues
+    yield client_id, queues
+    api.message_queues.pop(client_id, None)
+
+
+def stream(client_id, url, headers=None):
+    """Read an SSE stream and parse its events.
+
+    The test client waits for the whole response, so the stream is ended by
+    dropping the subscription once the pending messages have been sent.
+    """
+    timer = threading.Timer(0.5, api.message_queues.pop, (client_id, None))
+    timer.start()
+    response = TestClient(app).get(url, headers=headers)
+    timer.join()
+    assert response.status_code == 200
+
+    events = []
+    for block in response.text.split("\n\n"):
+        event = dict(line.split(": ", 1) for line in block.splitlines() if ": " in line)
+        if "data" in event:
+            event["data"] = json.loads(event["data"])
+            events.append(event)
+    return events
+
+
+def message_ids(events):
+    return [event["data"]["data"]["message_id"] for event in events if event.get("event") == "message"]
+
+
+def test_stream_resumes_after_last_event_id(subscription):
+    client_id, queues = subscription
+    replay = queues["replay"]
+    for i in range(5):
+        replay.append({"message_id": str(i)})
+    queues["messages"].put({"message_id": "5"})
+
+    events = stream(client_id, f"/api/stream/{client_id}", {"Last-Event-ID": replay.format_id(3)})
+
+    assert message_ids(events) == ["3", "4", "5"]
+    assert [event["id"] for event in events if "id" in event] == [replay.format_id(n) for n in (4, 5, 6)]
+    assert events[-1]["event"] == "closed"
+
+
+def test_stream_reports_messages_it_cannot_replay(subscription):
+    client_id, queues = subscription
+    replay = queues["replay"] = ReplayLog(max_size=2)
+    for i in range(6):
+        replay.append({"message_id": str(i)})
+
+    events = stream(client_id, f"/api/stream/{client_id}?last_event_id={replay.format_id(1)}")
+
+    assert events[0]["event"] == "skipped"
+    assert events[0]["data"]["count"] == 3
+    assert message_ids(events) == ["4", "5"]
+
+
+def test_stream_from_another_log_starts_with_new_messages(subscription):
+    client_id, queues = subscription
+    queues["replay"].append({"message_id": "old"})
+    queues["messages"].put({"message_id": "new"})
+
+    events = stream(client_id, f"/api/stream/{client_id}", {"Last-Event-ID": ReplayLog().format_id(1)})
+
+    assert message_ids(events) == ["new"]
@@ -0,0 +1,144 @@
+from app.render import RenderLimits
+from app.routes.api import shape_for_client
+from app.shapes import ShapeTracker, fingerprint, flatten, limit_changes, structure
+
+
+def test_structure_ignores_values_order_and_array_length():
+    assert structure({"a": 1, "b": [{"c": "x"}]}) == structure({"b": [{"c": "y"}, {"c": "z"}], "a": 2})
+    assert structure({"a": 1}) != structure({"a": {"b": 1}})
+    assert structure({"a": []}) == structure({"a": [1, 2]})
+    assert structure({"a": []}) != structure({"a": [{"b": 1}]})
+    assert structure("text") is None
+
+
+def test_flatten():
+    data = {"order": {"id": 7, "items": [{"sku": "A"}, {"sku": "B"}], "tags": [], "meta": {}}}
+    assert flatten(data) == {
+        "order.id": 7,
+        "order.items[0].sku": "A",
+        "order.items[1].sku": "B",
+        "order.tags": [],
+        "order.meta": {},
+    }
+    assert flatten(5) == {"": 5}
+    assert list(flatten(data, limit=2)) == ["order.id", "order.items[0].sku"]
+
+
+def test_fingerprint_tells_types_apart():
+    assert fingerprint(1) == fingerprint(1)
+    assert fingerprint(1) != fingerprint(True)
+    assert fingerprint(1) != fingerprint("1")
+    assert fingerprint([]) != fingerprint({})
+
+
+def test_first_message_of_a_shape_is_new():
+    tracker = ShapeTracker()
+    first = tracker.observe({"id": 1, "status": "new"})
+    assert first["new"] and first["count"] == 1
+    assert "changes" not in first
+
+    second = tracker.observe({"id": 2, "status": "new"})
+    assert second["id"] == first["id"]
+    assert not second["new"] and second["count"] == 2
+    assert second["changes"] == [["id", 2]]
+    assert second["removed"] == []
+
+    other = tracker.observe({"id": 3, "status": {"code": 1}})
+    assert other["new"] and other["id"] != first["id"]
+
+
+def test_changes_and_removed_paths_within_a_shape():
+    tracker = ShapeTracker()
+    tracker.observe({"items": [1, 2, 3], "total": 6})
+    shape = tracker.observe({"items": [1, 5], "total": 6})
+    assert shape["changes"] == [["items[1]", 5]]
+    assert shape["removed"] == ["items[2]"]
+
+
+def test_attributes_are_part_of_the_shape():
+    tracker = ShapeTracker()
+    first = tracker.observe({"a": 1}, {"type": "order"})
+    assert tracker.observe({"a": 1})["new"]
+    shape = tracker.observe({"a": 1}, {"type": "refund"})
+    assert shape["id"] == first["id"]
+    assert shape["changes"] == [["@type", "refund"]]
+
+
+def test_least_recently_seen_shapes_are_forgotten():
+    tracker = ShapeTracker(max_shapes=2)
+    tracker.observe({"a": 1})
+    tracker.observe({"b": 1})
+    tracker.observe({"a": 2})
+    tracker.observe({"c": 1})
+    assert not tracker.observe({"a": 3})["new"]
+    assert tracker.observe({"b": 2})["new"]
+    assert tracker.messages == 6
+
+
+def test_counts_most_frequent_first():
+    tracker = ShapeTracker()
+    tracker.observe({"rare": 1})
+    for value in range(3):
+        tracker.observe({"common": value, "other": value})
+    counts = tracker.counts()
+    assert [shape["count"] for shape in counts] == [3, 1]
+    assert counts[0]["keys"] == ["common", "other"]
+    assert ShapeTracker().observe(["not", "a", "dict"])["id"]
+
+
+def test_only_fingerprints_of_the_last_message_are_kept():
+    tracker = ShapeTracker()
+    tracker.observe({"text": "x" * 10000, "n": 1})
+    (shape,) = tracker._shapes.values()
+    assert set(shape.last) == {"text", "n"}
+    assert all(isinstance(value, int) for value in shape.last.values())
+    assert tracker.observe({"text": "x" * 10000, "n": 2})["changes"] == [["n", 2]]
+    assert tracker.observe({"text": "y", "n": 2})["changes"] == [["text", "y"]]
+
+
+def test_messages_with_too_many_fields_are_not_compared():
+    tracker = ShapeTracker(max_fields=5)
+    big = {"items": list(range(10))}
+    assert tracker.observe(big)["new"]
+    shape = tracker.observe(big)
+    assert not shape["new"] and shape["count"] == 2
+    assert "changes" not in shape
+    (stored,) = tracker._shapes.values()
+    assert stored.last is None
+
+
+def test_flat_and_nested_messages_reuse_their_shape():
+    tracker = ShapeTracker()
+    flat = tracker.observe({"a": 1, "b": "x"})
+    assert tracker.observe({"b": "y", "a": 1})["id"] == flat["id"]
+    assert len(tracker._flat_keys) == 2
+    nested = tracker.observe({"a": {"b": 1}})
+    assert tracker.observe({"a": {"b": 2}})["count"] == 2
+    assert nested["id"] != flat["id"]
+
+
+def test_limit_changes():
+    tracker = ShapeTracker()
+    tracker.observe({f"f{index}": 0 for index in range(10)} | {"text": ""})
+    shape = tracker.observe({f"f{index}": 1 for index in range(10)} | {"text": "x" * 100})
+    limit_changes(shape, RenderLimits(max_items=3, max_string=10))
+    assert shape["more_changes"] == 8
+    assert shape["changes"] == [["f0", 1], ["f1", 1], ["f2", 1]]
+
+    shape = tracker.observe({f"f{index}": 1 for index in range(10)} | {"text": "y" * 100})
+    limit_changes(shape, RenderLimits(max_string=10))
+    path, value = shape["changes"][0]
+    assert path == "text" and value.startswith("yyyyyyyyyy") and len(value) < 100
+    assert "more_changes" not in shape
+
+    assert limit_changes({"id": "x", "new": True}) == {"id": "x", "new": True}
+
+
+def test_shape_changes_are_only_sent_in_compact_mode():
+    message = {"data": {}, "shape": {"id": "x", "count": 2, "new": False, "changes": [], "removed": [], "more_changes": 1}}
+    assert shape_for_client(message, compact=True) is message
+    plain = shape_for_client(message, compact=False)
+    assert plain["shape"] == {"id": "x", "count": 2, "new": False}
+    assert "changes" in message["shape"]
+    first = {"data": {}, "shape": {"id": "x", "count": 1, "new": True}}
+    assert shape_for_client(first, compact=False) is first
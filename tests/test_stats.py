@@ -0,0 +1,154 @@
+import random
+
+import pytest
+
+from app.stats import (
+    MAX_TOP_VALUE_LENGTH,
+    FieldStats,
+    HyperLogLog,
+    QuantileSketch,
+    SubscriptionStats,
+    TopK,
+    iter_field_values,
+)
+
+
+@pytest.mark.parametrize("n", [10, 1000, 50000])
+def test_hyperloglog_error(n):
+    sketch = HyperLogLog()
+    for i in range(n):
+        sketch.add(f"value-{i}")
+    # Standard error is 1.04 / sqrt(1024), about 3%; allow three of them
+    assert abs(sketch.count() - n) <= max(0.1 * n, 1)
+
+
+def test_hyperloglog_merge_is_union():
+    a, b, both = HyperLogLog(), HyperLogLog(), HyperLogLog()
+    for i in range(3000):
+        a.add(i)
+        both.add(i)
+    for i in range(2000, 6000):
+        b.add(i)
+        both.add(i)
+    a.merge(b)
+    assert a.count() == both.count()
+
+
+def test_topk_space_saving_bounds():
+    rng = random.Random(1)
+    capacity = 32
+    sketch = TopK(capacity)
+    truth = {}
+    stream = [int(rng.paretovariate(1.2)) for _ in range(20000)]
+    for value in stream:
+        sketch.add(value)
+        truth[value] = truth.get(value, 0) + 1
+
+    slack = len(stream) / capacity
+    for value, count in truth.items():
+        if count > slack:
+            # Every item above N / capacity is kept, never under-counted
+            # and over-counted by at most N / capacity
+            assert value in sketch.counters
+            assert count <= sketch.counters[value] <= count + slack
+    assert len(sketch.counters) <= capacity
+
+
+def test_topk_top_is_sorted():
+    sketch = TopK()
+    for value, count in [("a", 3), ("b", 7), ("c", 5)]:
+        sketch.add(value, count)
+    assert sketch.top(2) == [("b", 7), ("c", 5)]
+
+
+def test_quantile_sketch_rank_error():
+    random.seed(7)
+    values = list(range(100000))
+    shuffled = values[:]
+    random.shuffle(shuffled)
+    sketch = QuantileSketch()
+    for value in shuffled:
+        sketch.add(value)
+
+    assert sketch.count == len(values)
+    assert (sketch.min, sketch.max) == (0, len(values) - 1)
+    for q, estimate in sketch.quantiles([0.5, 0.9, 0.99]).items():
+        assert abs(estimate / len(values) - q) <= 0.02
+
+
+def test_quantile_sketch_merge():
+    random.seed(3)
+    a, b = QuantileSketch(), QuantileSketch()
+    for value in range(5000):
+        a.add(value)
+    for value in range(5000, 10000):
+        b.add(value)
+    a.merge(b)
+    assert a.count == 10000
+    assert (a.min, a.max) == (0, 9999)
+    assert abs(a.quantiles([0.5])[0.5] - 5000) <= 200
+
+
+def test_field_stats_keeps_types_apart():
+    field = FieldStats()
+    for value in [True, 1, 1.0, "1"]:
+        field.add(value)
+    snapshot = field.snapshot()
+    assert snapshot["distinct"] == 4
+    assert sorted(repr(top["value"]) for top in snapshot["top_values"]) == ["'1'", "1", "1.0", "True"]
+    # Only the real numbers feed the quantiles
+    assert snapshot["numeric"]["count"] == 2
+
+
+def test_field_stats_truncates_long_values():
+    field = FieldStats()
+    field.add("x" * 5000)
+    field.add("x" * 5001)
+    snapshot = field.snapshot()
+    assert snapshot["distinct"] == 2
+    (top,) = snapshot["top_values"]
+    assert len(top["value"]) == MAX_TOP_VALUE_LENGTH + 1
+    assert top["count"] == 2
+
+
+def test_field_stats_null_rate():
+    field = FieldStats()
+    for value in [None, 1, None, 2]:
+        field.add(value)
+    assert field.snapshot()["null_rate"] == 0.5
+
+
+def test_iter_field_values():
+    data = {"a": {"b": 1}, "items": [{"sku": "x"}, {"sku": "y"}], "empty": {}}
+    assert list(iter_field_values(data)) == [("a.b", 1), ("items[].sku", "x"), ("items[].sku", "y")]
+    assert list(iter_field_values(5)) == [("$", 5)]
+
+
+def test_subscription_stats_caps_fields_and_counts_dropped_paths():
+    stats = SubscriptionStats(max_fields=2, window_seconds=0)
+    for i in range(50):
+        stats.add_message({"a": i, "b": i, "extra": i, f"more{i % 5}": i})
+    snapshot = stats.snapshot()
+    assert set(snapshot["fields"]) == {"a", "b"}
+    assert snapshot["tracked_fields"] == 2
+    # Distinct dropped paths, not dropped values
+    assert snapshot["dropped_fields"] == 6
+
+
+def test_subscription_stats_window_rotation():
+    stats = SubscriptionStats(max_fields=2, window_seconds=60)
+    stats.add_message({"old": 1})
+    stats._window_start -= 61
+    stats.add_message({"new": 1})
+    assert set(stats.snapshot()["fields"]) == {"old", "new"}
+
+    # A path from the previous window does not count twice against the cap
+    stats.add_message({"old": 2})
+    assert set(stats.snapshot()["fields"]) == {"old", "new"}
+
+    # After two idle windows the stats start over
+    stats._window_start -= 121
+    stats.add_message({"newest": 1})
+    snapshot = stats.snapshot()
+    assert set(snapshot["fields"]) == {"newest"}
+    assert snapshot["fields"]["newest"]["count"] == 1